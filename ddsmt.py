@@ -21,30 +21,40 @@
 # along with ddSMT.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import bisect
+import hashlib
+import json
+import math
 import os
+import pickle
 import random
 import resource
+import selectors
 import sys
 import shutil
+import signal
+import threading
 import time
 
 from argparse import ArgumentParser, REMAINDER
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from subprocess import Popen, PIPE, TimeoutExpired
-from parser.ddsmtparser import DDSMTParser, DDSMTParseException
+from parser import smtparser, ddsmtparser
+from parser.ddsmtparser import DDSMTParser, DDSMTParseException, \
+        DDSMTParseCheckException, SMTFormula, SMTNode, SMTCmdNode, \
+        SMTScopeNode, KIND_AND, KIND_BVAND, KIND_BVASHR, KIND_BVLSHR, \
+        KIND_BVOR, KIND_BVSHL, KIND_ITE, KIND_LET, KIND_OR, KIND_STORE, \
+        KIND_VARB
 
 
 __version__ = "1.0"
 __author__  = "Aina Niemetz <aina.niemetz@gmail.com>"
 
 
-g_golden_exit = 0
-g_golden_err = None
-g_golden_runtime = 0
-g_current_runtime = 0
-g_ntests = 0
-g_testtime = 0
-g_args = None
-g_smtformula = None
+g_reducer = None
+g_reducer_lock = threading.Lock()  # held by reduce (not reentrant)
+g_jobserver = None
 g_tmpfile = "/tmp/tmp-" + str(os.getpid()) + ".smt2"
 g_tmpbin = "/tmp/ddsmt-bin-" + str(os.getpid())
 
@@ -59,43 +69,863 @@ class DDSMTException (Exception):
 
 
 class DDSMTCmd ():
-    def __init__(self, cmd, timeout, log):
+    def __init__(self, cmd, timeout, log, data = None, pass_fds = (),
+                 pattern = None, limits = None, njobs = 1):
         self.cmd = cmd
         self.timeout = timeout
+        # tests run concurrently (njobs) slow each other down, the process is
+        # killed after njobs times the timeout only (see run_cmd)
+        self.deadline = timeout * njobs if timeout else None
         self.log = log
+        self.data = data  # passed via stdin if given
+        self.pass_fds = pass_fds
+        self.pattern = pattern  # kill process as soon as it is printed
+        self.limits = limits    # (memory limit in MiB, cpu limit in seconds)
+        self.process = None
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.matched = False
+        self.rusage = None
+        self.runtime = None
+        self.nleaked = 0  # processes left behind in the process group
+        self.leakedcputime = 0
+
+    def __rlimits(self):
+        # the address space limit in bytes and the soft and hard cpu limit in
+        # seconds (SIGXCPU on the soft limit, SIGKILL on the hard limit)
+        (memlimit, cpulimit) = self.limits
+        memlimit = memlimit * 1024 * 1024 if memlimit else None
+        cpulimit = math.ceil(cpulimit) if cpulimit else None
+        return (memlimit, cpulimit)
+
+    def __setrlimits(self):
+        # called in the child before executing the command (preexec_fn)
+        (memlimit, cpulimit) = self.__rlimits()
+        if memlimit:
+            resource.setrlimit(resource.RLIMIT_AS, (memlimit, memlimit))
+        if cpulimit:
+            resource.setrlimit(resource.RLIMIT_CPU, (cpulimit, cpulimit + 1))
+
+    def __popen_args(self):
+        # Note: the limits are set before executing the command, in the child
+        #       (preexec_fn) if no other threads are running (preexec_fn is not
+        #       safe otherwise, e.g., with -j), and by a shell wrapper
+        #       otherwise
+        if not self.limits:
+            return (self.cmd, None)
+        if threading.active_count() == 1:
+            return (self.cmd, self.__setrlimits)
+        (memlimit, cpulimit) = self.__rlimits()
+        ulimit = []
+        if memlimit:
+            ulimit.append("ulimit -v {}".format(memlimit // 1024))
+        if cpulimit:
+            ulimit.append("ulimit -S -t {}".format(cpulimit))
+            ulimit.append("ulimit -H -t {}".format(cpulimit + 1))
+        script = " && ".join(ulimit + ["exec \"$@\""])
+        return (["/bin/sh", "-c", script, "sh"] + list(self.cmd), None)
+
+    def __kill(self):
+        # Note: the process is reaped via wait4 only (in __reap), a pid that
+        #       is not reaped yet cannot be reused
+        with self.lock:
+            if self.process and self.process.returncode == None:
+                os.killpg(self.process.pid, signal.SIGKILL)
+
+    def __group_stat(self):
+        # number of processes in the process group of the command (on
+        # systems without /proc, at least one) and their cpu time (including
+        # their terminated children)
+        n, cputime = 0, 0
+        try:
+            for pid in os.listdir("/proc"):
+                if not pid.isdigit():
+                    continue
+                try:
+                    with open("/proc/{}/stat".format(pid)) as infile:
+                        stat = infile.read()
+                except IOError:
+                    continue
+                # pgrp is the third field after the (parenthesized) command,
+                # followed by utime, stime, cutime and cstime (fields 12-15)
+                fields = stat[stat.rindex(")") + 2:].split()
+                if int(fields[2]) == self.process.pid:
+                    n += 1
+                    cputime += sum(int(f) for f in fields[11:15])
+        except OSError:
+            pass
+        return (max(n, 1), cputime / os.sysconf("SC_CLK_TCK"))
+
+    def __kill_leaked(self):
+        # kill processes that outlived the command (e.g., solvers started
+        # by a wrapper script), the process group persists as long as any
+        # of them is alive
+        try:
+            os.killpg(self.process.pid, 0)
+        except ProcessLookupError:
+            return
+        (self.nleaked, self.leakedcputime) = self.__group_stat()
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def __reap(self, timeout = None):
+        # wait for the process to finish and collect its resource usage
+        deadline = time.time() + timeout if timeout != None else None
+        delay = 0.0005
+        while True:
+            with self.lock:
+                (pid, status, rusage) = os.wait4(self.process.pid, os.WNOHANG)
+                if pid:
+                    self.process.returncode = os.waitstatus_to_exitcode(status)
+                    self.rusage = rusage
+                    self.__kill_leaked()
+                    g_reducer.processes.remove(self.process.pid)
+                    return
+            if deadline != None and time.time() >= deadline:
+                raise TimeoutExpired (self.cmd, timeout)
+            time.sleep(delay)
+            delay = min(2 * delay, 0.05)
+
+    def __stream(self, timeout, pattern):
+        # read output as it is produced and decide as soon as the pattern
+        # shows up rather than waiting for the process to finish
+        process = self.process
+        pattern = pattern.encode() if pattern else None
+        selector = selectors.DefaultSelector()
+        selector.register(process.stdout, selectors.EVENT_READ)
+        selector.register(process.stderr, selectors.EVENT_READ)
+        data = None
+        if self.data != None:
+            data = memoryview(self.data)
+            if data:
+                os.set_blocking(process.stdin.fileno(), False)
+                selector.register(process.stdin, selectors.EVENT_WRITE)
+            else:
+                process.stdin.close()
+        out, err = bytearray(), bytearray()
+        start = time.time()
+        try:
+            while selector.get_map():
+                remaining = None
+                if timeout:
+                    remaining = timeout - (time.time() - start)
+                    if remaining <= 0:
+                        raise TimeoutExpired (self.cmd, timeout)
+                for (key, events) in selector.select(remaining):
+                    if key.fileobj is process.stdin:
+                        try:
+                            data = data[os.write(
+                                process.stdin.fileno(), data[:65536]):]
+                        except BrokenPipeError:
+                            data = None
+                        if not data:
+                            selector.unregister(process.stdin)
+                            process.stdin.close()
+                        continue
+                    chunk = os.read(key.fileobj.fileno(), 65536)
+                    if not chunk:
+                        selector.unregister(key.fileobj)
+                        continue
+                    buf = out if key.fileobj is process.stdout else err
+                    pos = max(0, len(buf) - len(pattern) + 1) if pattern else 0
+                    buf += chunk
+                    if pattern and pattern in buf[pos:]:
+                        self.matched = True
+                        self.__kill()
+                        self.__reap()
+                        return (bytes(out), bytes(err))
+            if timeout:
+                self.__reap(max(0, timeout - (time.time() - start)))
+            else:
+                self.__reap()
+        finally:
+            selector.close()
+            for f in (process.stdin, process.stdout, process.stderr):
+                if f and not f.closed:
+                    f.close()
+        return (bytes(out), bytes(err))
+
+    def cputime(self):
+        # of the whole process group: the command (including its terminated
+        # children) and the processes it left behind
+        if not self.rusage:
+            return None
+        return self.rusage.ru_utime + self.rusage.ru_stime \
+                + self.leakedcputime
+
+    def maxrss(self):
+        # in MiB
+        if not self.rusage:
+            return None
+        return self.rusage.ru_maxrss / 1024
 
     def run_cmd(self, is_golden = False):
-        global g_golden_runtime
-        self.process = Popen (self.cmd, stdout=PIPE, stderr=PIPE)
+        (cmd, preexec_fn) = self.__popen_args()
+        self.process = Popen (cmd,
+                              stdin=PIPE if self.data != None else None,
+                              stdout=PIPE, stderr=PIPE,
+                              pass_fds=self.pass_fds,
+                              preexec_fn=preexec_fn,
+                              start_new_session=True)
+        if not g_reducer.processes.add(self.process.pid):
+            self.cancelled = True  # started during cleanup
+        if self.cancelled:
+            self.__kill()
         start = time.time()
         try:
             if is_golden:
-                self.out, self.err = self.process.communicate()
-                g_golden_runtime = time.time() - start
-                g_current_runtime = g_golden_runtime
+                self.out, self.err = self.__stream(None, None)
+                g_reducer.golden_runtime = time.time() - start
+                g_reducer.current_runtime = g_reducer.golden_runtime
             else:
-                self.out, self.err = self.process.communicate(
-                    timeout=self.timeout)
+                self.out, self.err = self.__stream(self.deadline, self.pattern)
         except TimeoutExpired:
-            self.process.kill()
+            self.__kill()
+            self.__reap()
+            self.runtime = time.time() - start
             self.out, self.err = None, None
             self.log (2, "[!!] timeout: process terminated")
             if is_golden:
                 raise DDSMTException ("initial run timed out")
+            self.rcode = None
+            return (self.out, self.err)
 
+        self.runtime = time.time() - start
         self.rcode = self.process.returncode
+        if self.timeout and self.runtime > self.timeout and not self.matched \
+           and self.cputime() > self.timeout:
+            # finished before the deadline only because it was extended for
+            # concurrent tests, but would not have finished in time alone
+            self.out, self.err = None, None
+            self.log (2, "[!!] timeout: cpu time exceeded")
+            self.rcode = None
+            return (self.out, self.err)
+        # killed by the cpu limit (the exit code of a shell that runs the
+        # command is 128 plus the signal)
+        if self.limits and self.limits[1] and not self.matched \
+           and self.rcode in (-signal.SIGXCPU, -signal.SIGKILL,
+                              128 + signal.SIGXCPU, 128 + signal.SIGKILL) \
+           and self.cputime() >= math.ceil(self.limits[1]):
+            self.out, self.err = None, None
+            self.log (2, "[!!] cpu limit: process terminated")
+            if is_golden:
+                raise DDSMTException ("initial run exceeded cpu limit")
+            self.rcode = None
         return (self.out, self.err)
 
+    def cancel(self):
+        # Note: may be called from another thread while run_cmd is waiting
+        #       for the process to finish
+        self.cancelled = True
+        self.__kill()
+
+
+class DDSMTCache ():
+    """DDSMTCache
+
+       Content-addressed cache of test results. Candidates are identified by
+       the hash of their dumped bytes (prefixed with a key that identifies the
+       command and the search pattern). For each candidate, the verdict, i.e.,
+       the exit code and whether the search pattern was matched, is stored in
+       memory and (optionally) on disk in given cache directory.
+    """
+
+    def __init__(self, prefix, cachedir = None):
+        self.prefix = prefix
+        self.cachedir = cachedir
+        self.verdicts = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, data):
+        h = hashlib.sha256(self.prefix)
+        h.update(data)
+        return h.hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.cachedir, key[:2], key)
+
+    def lookup(self, key):
+        verdict = self.verdicts.get(key)
+        if verdict == None and self.cachedir:
+            try:
+                with open(self.__path(key), 'r') as infile:
+                    (exitcode, matched) = infile.read().split()
+                    verdict = (None if exitcode == "?" else int(exitcode),
+                               matched == "1")
+                    self.verdicts[key] = verdict
+            except (IOError, ValueError):
+                pass
+        if verdict == None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return verdict
+
+    def store(self, key, exitcode, matched):
+        self.verdicts[key] = (exitcode, matched)
+        if self.cachedir:
+            path = self.__path(key)
+            tmppath = "{}.{}".format(path, os.getpid())
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok = True)
+                with open(tmppath, 'w') as outfile:
+                    outfile.write("{} {}\n".format(
+                        "?" if exitcode == None else exitcode, int(matched)))
+                os.rename(tmppath, path)
+            except IOError as e:
+                raise DDSMTException (str(e))
+
+
+class DDSMTTimeouts ():
+    """DDSMTTimeouts
+
+       Model of test runtimes. For successful and failing candidates
+       separately, the mean and variance of their runtimes are maintained as
+       exponentially weighted moving averages (EWMA), as is the size of
+       tested candidates. The timeout for a candidate is the mean runtime of
+       successful candidates plus k standard deviations (but at least 1.5
+       times the mean plus the given slack in seconds, since few samples
+       underestimate the variance), scaled up for candidates larger than
+       average. Runs that timed out took at least their timeout and are
+       sampled as such (censored samples) to raise the timeout, capped at
+       twice the maximum runtime of successful candidates. No timeout is
+       imposed as long as no successful run was sampled.
+    """
+
+    def __init__(self, alpha = 0.2, k = 4, slack = 0.5):
+        self.alpha = alpha
+        self.k = k
+        self.slack = slack
+        self.stats = { True: [0, 0, 0], False: [0, 0, 0] }  # n, mean, var
+        self.size = 0
+        self.max = 0  # maximum runtime of successful candidates
+
+    def sample(self, runtime, size, success):
+        if success:
+            self.max = max(self.max, runtime)
+        self.__sample(runtime, size, success)
+
+    def censor(self, runtime, size):
+        # timed out after given runtime, i.e., would have taken longer
+        if self.stats[True][0] == 0:
+            return
+        self.__sample(min(runtime, 2 * self.max), size, True)
+
+    def __sample(self, runtime, size, success):
+        stats = self.stats[success]
+        if stats[0] == 0:
+            stats[1] = runtime
+        else:
+            diff = runtime - stats[1]
+            incr = self.alpha * diff
+            stats[1] += incr
+            stats[2] = (1 - self.alpha) * (stats[2] + diff * incr)
+        stats[0] += 1
+        self.size = size if not self.size \
+                else self.size + self.alpha * (size - self.size)
+
+    def timeout(self, size = None):
+        (n, mean, var) = self.stats[True]
+        if n == 0:
+            return None
+        timeout = mean + max(0.5 * mean + self.slack,
+                             self.k * math.sqrt(var))
+        if size and self.size and size > self.size:
+            timeout *= size / self.size
+        return timeout
+
+    def __str__(self):
+        return "runtimes: successful: {} (mean: {:.3f}, sd: {:.3f}), " \
+               "failing: {} (mean: {:.3f}, sd: {:.3f}), " \
+               "timeout: {:.3f}".format(
+                   self.stats[True][0], self.stats[True][1],
+                   math.sqrt(self.stats[True][2]),
+                   self.stats[False][0], self.stats[False][1],
+                   math.sqrt(self.stats[False][2]), self.timeout())
+
+
+class DDSMTSession ():
+    """DDSMTSession
+
+       A solver process that is kept alive to test several candidates. Each
+       candidate is passed via stdin, either wrapped in (push 1)/(pop 1) or
+       followed by a (reset), and the end of its output is detected by means
+       of an (echo) command. The process is restarted if it crashes or hangs.
+
+       In push mode, the set-logic and set-option commands of a candidate
+       (its header) are not allowed within (push 1) and are therefore issued
+       once per process. The process is restarted if the header of a
+       candidate differs from the header of the process.
+
+       After MAX_FAILURES consecutive candidates that crashed or hung the
+       process, the session is disabled (candidates are then only tested in
+       fresh processes).
+    """
+
+    HEADER = (b"(set-logic", b"(set-option")
+    MAX_FAILURES = 3
+
+    def __init__(self, cmd, mode, logic, log):
+        assert (mode in ("push", "reset"))
+        self.cmd = cmd
+        self.mode = mode
+        self.logic = logic
+        self.log = log
+        self.process = None
+        self.selector = None
+        self.header = None
+        self.fresh = False
+        self.nstarts = 0
+        self.ntests = 0
+        self.nfailures = 0  # consecutive
+        self.disabled = False
+        self.cancelled = False
+
+    def __start(self):
+        self.process = Popen (self.cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE,
+                              start_new_session=True)
+        os.set_blocking(self.process.stdin.fileno(), False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.process.stdout, selectors.EVENT_READ)
+        self.selector.register(self.process.stderr, selectors.EVENT_READ)
+        self.fresh = True
+        self.nstarts += 1
+
+    def __header(self, lines):
+        header = [l for l in lines if l.startswith(DDSMTSession.HEADER)]
+        if self.logic != "none" and \
+           not any(l.startswith(b"(set-logic") for l in header):
+            header.append("(set-logic {})".format(self.logic).encode())
+        return header
+
+    def __request(self, data):
+        sentinel = "ddsmt-session-{}-{}".format(os.getpid(), self.ntests)
+        if self.mode == "push":
+            # the header is issued once per process, outside of (push 1)
+            lines = [l for l in data.split(b"\n") if l != b"(exit)" \
+                     and not l.startswith(DDSMTSession.HEADER)]
+            req = [b"(push 1)"] + lines + [b"(pop 1)"]
+            if self.fresh:
+                req = self.header + req
+        else:
+            req = [l for l in data.split(b"\n") if l != b"(exit)"]
+            req.append(b"(reset)")
+        req.append("(echo \"{}\")\n".format(sentinel).encode())
+        self.fresh = False
+        return (b"\n".join(req), sentinel.encode())
+
+    def kill(self):
+        process = self.process
+        if process:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            process.wait()
+        self.process = None
+        if self.selector:
+            self.selector.close()
+            self.selector = None
+
+    def cancel(self):
+        # Note: may be called from another thread while test is waiting for
+        #       the solver, which then sees the process die
+        self.cancelled = True
+        process = self.process
+        if process and process.poll() == None:
+            os.killpg(process.pid, signal.SIGKILL)
+
+    def test(self, data, pattern, timeout):
+        """test(data, pattern, timeout)
+
+           Run given candidate in the session.
+
+           :data:    The candidate (bytes).
+           :pattern: String to search for in the output of the candidate.
+           :timeout: Timeout in seconds (or None).
+           :return:  True if the output of the candidate contains given
+                     pattern, False if not, and None if the process died or
+                     did not finish the candidate in time.
+        """
+        self.cancelled = False
+        res = self.__test(data, pattern, timeout)
+        if res != None:
+            self.nfailures = 0
+        elif not self.cancelled:
+            self.nfailures += 1
+        if self.nfailures >= DDSMTSession.MAX_FAILURES:
+            self.log (2, "[!!] session disabled after {} failures".format(
+                self.nfailures))
+            self.kill()
+            self.disabled = True
+        return res
+
+    def __test(self, data, pattern, timeout):
+        if self.mode == "push":
+            header = self.__header(data.split(b"\n"))
+            if self.process and header != self.header:
+                self.log (3, "session restarted (header changed)")
+                self.kill()
+            self.header = header
+        if not self.process or self.process.poll() != None:
+            self.kill()
+            self.__start()
+        (req, sentinel) = self.__request(data)
+        self.ntests += 1
+        process = self.process
+        stdin = process.stdin.fileno()
+        req = memoryview(req)
+        self.selector.register(process.stdin, selectors.EVENT_WRITE)
+        out, err = b"", b""
+        start = time.time()
+        try:
+            while sentinel not in out:
+                remaining = None
+                if timeout:
+                    remaining = timeout - (time.time() - start)
+                    if remaining <= 0:
+                        self.log (2, "[!!] timeout: session terminated")
+                        self.kill()
+                        return None
+                for (key, events) in self.selector.select(remaining):
+                    if key.fileobj is process.stdin:
+                        req = req[os.write(stdin, req[:65536]):]
+                        if not req:
+                            self.selector.unregister(process.stdin)
+                        continue
+                    chunk = os.read(key.fileobj.fileno(), 65536)
+                    if not chunk:
+                        self.log (2, "[!!] session terminated unexpectedly")
+                        self.kill()
+                        return None
+                    if key.fileobj is process.stdout:
+                        out += chunk
+                    else:
+                        err += chunk
+            # collect pending error output of this candidate
+            for (key, events) in self.selector.select(0):
+                if key.fileobj is process.stderr:
+                    err += os.read(key.fileobj.fileno(), 65536)
+        except (BrokenPipeError, OSError, ValueError):
+            self.log (2, "[!!] session terminated unexpectedly")
+            self.kill()
+            return None
+        out = out[:out.index(sentinel)]
+        return pattern in err.decode(errors="replace") \
+                or pattern in out.decode(errors="replace")
+
+
+class DDSMTPass ():
+    """DDSMTPass
+
+       Substitution pass (a function that takes the current round and returns
+       the number of substituted nodes) and its yield statistics. The rate
+       (nodes substituted per candidate) averages the most recent run with
+       all previous runs, decaying older runs. Candidates are counted as if
+       tested one by one (including cache hits, excluding stale tests), the
+       rate is thus independent of machine load, -j and --speculate.
+    """
+
+    def __init__(self, name, what, fun):
+        self.name = name
+        self.what = what    # "scopes", "cmds" or "terms"
+        self.fun = fun
+        self.nruns = 0
+        self.ntests = 0
+        self.testtime = 0
+        self.nsubst = 0
+        self.ncandidates = 0
+        self.rate = 0       # nodes per candidate (decayed)
+        self.nfailed = 0    # number of consecutive unproductive runs
+        self.skip = 0       # number of rounds to skip
+
+    def update(self, nsubst, ntests, testtime, ncandidates):
+        self.nruns += 1
+        self.ntests += ntests
+        self.testtime += testtime
+        self.nsubst += nsubst
+        self.ncandidates += ncandidates
+        self.rate = (self.rate + nsubst / max(ncandidates, 1)) / 2
+
+
+class DDSMTScheduler ():
+    """DDSMTScheduler
+
+       Adaptive scheduler for substitution passes. The first round runs all
+       passes in the given order, subsequent rounds order passes by their
+       yield (nodes substituted per candidate, ties are broken by the given
+       order), which does not depend on timing (the order of passes, and
+       thus the result, is the same for any number of jobs).
+       A pass that did not substitute anything is skipped for 1, 2, 4, ...
+       rounds (after 1, 2, 3, ... consecutive unproductive runs) but at most
+       max_skip rounds, so that no pass starves.
+
+       A pass is stale if it did not substitute anything and the formula did
+       not change since. Stale passes are never run again (they would not
+       substitute anything either); reduction is done when all passes are
+       stale. If a round did not substitute anything, skipped passes are run
+       in the next round regardless.
+
+       The scheduler also maintains the position of the reduction (current
+       round, passes due in this round and the pass to run next), which can be
+       saved and restored to resume an interrupted run (see _checkpoint).
+    """
+
+    def __init__(self, passes, fixed = False, max_skip = 4):
+        self.passes = passes
+        self.fixed = fixed
+        self.max_skip = max_skip
+        self.stale = set()
+        self.nrounds = 0
+        self.nsubst_round = 1
+        self.nsubst = { "scopes": 0, "cmds": 0, "terms": 0 }
+        self.due = []
+        self.pos = 0
+        self.ncalls = 0         # calls to _substitute in the current pass
+        self.nsubst_pass = 0    # nodes substituted in the current pass
+        self.pass_start = None  # (tests, testing time, candidates) at start
+                                # of the pass
+        self.resume = None      # position in the current pass to resume from
+
+    def done(self):
+        return len(self.stale) == len(self.passes)
+
+    def next_round(self):
+        progress = self.nsubst_round > 0
+        self.nsubst_round = 0
+        self.nrounds += 1
+        self.due = self.schedule(self.nrounds, progress)
+        self.pos = 0
+
+    def schedule(self, nrounds, progress):
+        due = []
+        for p in self.passes:
+            if p.name in self.stale:
+                continue
+            if p.skip and progress:
+                p.skip -= 1
+                continue
+            due.append(p)
+        if not self.fixed and nrounds > 1:
+            # Note: stable, passes with equal rates keep the given order
+            due.sort(key = lambda p: -p.rate)
+        return due
+
+    def run(self, p, nrounds):
+        self.ncalls = 0
+        self.nsubst_pass = 0
+        self.pass_start = (g_reducer.ntests, g_reducer.testtime,
+                           g_reducer.ncandidates)
+        if self.resume:
+            self.nsubst_pass = self.resume["nsubst"]
+            self.pass_start = (
+                    g_reducer.ntests - self.resume["ntests"],
+                    g_reducer.testtime - self.resume["testtime"],
+                    g_reducer.ncandidates - self.resume["ncandidates"])
+        (ntests_prev, testtime_prev, ncandidates_prev) = self.pass_start
+        nsubst = self.nsubst_pass + p.fun(nrounds)
+        self.resume = None
+        p.update(nsubst, g_reducer.ntests - ntests_prev,
+                 g_reducer.testtime - testtime_prev,
+                 g_reducer.ncandidates - ncandidates_prev)
+        self.nsubst_round += nsubst
+        self.nsubst[p.what] += nsubst
+        if nsubst:
+            self.stale.clear()
+            p.nfailed = 0
+            p.skip = 0
+        else:
+            self.stale.add(p.name)
+            p.nfailed += 1
+            if not self.fixed:
+                p.skip = min(2 ** (p.nfailed - 1), self.max_skip)
+        return nsubst
+
+    def state(self, position = None):
+        """state(position)
+
+           Save the state of the scheduler.
+
+           :position: Position in the current pass (see _substitute), None
+                      if not within a pass.
+           :return:   Dictionary of lists, numbers and strings (JSON).
+        """
+        state = {
+            "passes": dict((p.name, [p.nruns, p.ntests, p.testtime,
+                                     p.nsubst, p.ncandidates, p.rate,
+                                     p.nfailed, p.skip])
+                           for p in self.passes),
+            "stale": sorted(self.stale),
+            "nrounds": self.nrounds,
+            "nsubst_round": self.nsubst_round,
+            "nsubst": self.nsubst,
+            "due": [p.name for p in self.due],
+            "pos": self.pos,
+            "resume": None }
+        if position:
+            (ntests_prev, testtime_prev, ncandidates_prev) = self.pass_start
+            state["resume"] = dict(position, ncall = self.ncalls,
+                    nsubst = self.nsubst_pass,
+                    ntests = g_reducer.ntests - ntests_prev,
+                    testtime = g_reducer.testtime - testtime_prev,
+                    ncandidates = g_reducer.ncandidates - ncandidates_prev)
+        return state
+
+    def restore(self, state):
+        """restore(state)
+
+           Restore the state of the scheduler as saved via state().
+
+           :state: Dictionary as returned by state().
+        """
+        passes = dict((p.name, p) for p in self.passes)
+        for name, stats in state["passes"].items():
+            p = passes[name]
+            (p.nruns, p.ntests, p.testtime, p.nsubst, p.ncandidates, p.rate,
+             p.nfailed, p.skip) = stats
+        self.stale = set(state["stale"])
+        self.nrounds = state["nrounds"]
+        self.nsubst_round = state["nsubst_round"]
+        self.nsubst = state["nsubst"]
+        self.due = [passes[name] for name in state["due"]]
+        self.pos = state["pos"]
+        self.resume = state["resume"]
+
+
+class DDSMTJobserver ():
+    """DDSMTJobserver
+
+       Client of a jobserver, i.e., a pipe shared by several processes (e.g.,
+       the ddSMT instances started by ddsmtbatch.py) that holds one token per
+       free job slot. Every process has one implicit slot, each further test
+       that is run in parallel requires a token. Tokens are acquired without
+       blocking (if none is available, fewer tests are run in parallel) and
+       must be written back to the pipe when the test is done.
+    """
+
+    def __init__(self, rfd, wfd):
+        self.rfd = rfd
+        self.wfd = wfd
+        self.tokens = []
+        os.set_blocking(rfd, False)
+
+    def acquire(self):
+        try:
+            token = os.read(self.rfd, 1)
+        except (BlockingIOError, InterruptedError):
+            return False
+        if not token:
+            return False
+        self.tokens.append(token)
+        return True
+
+    def release(self, keep = 0):
+        while len(self.tokens) > keep:
+            os.write(self.wfd, self.tokens.pop())
+
+
+class DDSMTProcesses ():
+    """DDSMTProcesses
+
+       Registry of the process groups of running tests. Tests are run in a
+       session of their own and thus do not receive signals sent to the
+       process group of ddSMT (e.g., SIGINT on Ctrl-C), their process groups
+       are killed on cleanup instead. Processes started after cleanup are
+       killed right away (see DDSMTCmd.run_cmd).
+    """
+
+    def __init__(self):
+        self.pgids = set()
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def add(self, pgid):
+        with self.lock:
+            if self.closed:
+                return False
+            self.pgids.add(pgid)
+            return True
+
+    def remove(self, pgid):
+        with self.lock:
+            self.pgids.discard(pgid)
+
+    def kill(self):
+        with self.lock:
+            self.closed = True
+            for pgid in self.pgids:
+                try:
+                    os.killpg(pgid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            self.pgids.clear()
+
+
+class DDSMTReducer ():
+    """DDSMTReducer
+
+       State of a reduction: the options, the formula, the golden run, test
+       statistics, test cache, timeout model, scheduler and solver sessions.
+       The functions of this module operate on the active reducer g_reducer
+       (see reduce), several reductions can thus be run in one process one
+       after the other.
+    """
+
+    def __init__(self, args, smtformula, oracle = None):
+        self.args = args
+        self.smtformula = smtformula
+        self.oracle = oracle
+        self.golden_exit = 0
+        self.golden_err = None
+        self.golden_runtime = 0
+        self.current_runtime = 0
+        self.ntests = 0
+        self.nstale = 0
+        self.ncandidates = 0    # candidates decided (as if tested serially)
+        self.testtime = 0
+        self.testcputime = 0
+        self.testmaxrss = 0
+        self.nleaked = 0
+        self.cache = None
+        self.timeouts = DDSMTTimeouts ()
+        self.scheduler = None
+        self.checkpoint_time = 0
+        self.sessions = {}
+        self.memfds = {}
+        self.processes = DDSMTProcesses ()
+
+
+def _tmpfile (worker = 0):
+    return g_tmpfile if worker == 0 else \
+            "/tmp/tmp-{}-{}.smt2".format(os.getpid(), worker)
+
+
+def _tmpbin (worker = 0):
+    return g_tmpbin if worker == 0 else \
+            "/tmp/ddsmt-bin-{}-{}".format(os.getpid(), worker)
+
+
 def _cleanup ():
-    if os.path.exists(g_tmpfile):
-        os.remove(g_tmpfile)
-    if os.path.exists(g_tmpbin):
-        os.remove(g_tmpbin)
+    g_reducer.processes.kill()
+    if g_jobserver:
+        g_jobserver.release()
+    for session in g_reducer.sessions.values():
+        session.kill()
+    for fd in g_reducer.memfds.values():
+        os.close(fd)
+    njobs = g_reducer.args.jobs if g_reducer.args else 1
+    for worker in range(njobs):
+        if os.path.exists(_tmpfile(worker)):
+            os.remove(_tmpfile(worker))
+        if os.path.exists(_tmpbin(worker)):
+            os.remove(_tmpbin(worker))
 
 
 def _log (verbosity, msg = "", update = False):
-    global g_args
-    if g_args.verbosity >= verbosity:
+    if g_reducer.args.verbosity >= verbosity:
         sys.stdout.write(" " * 80 + "\r")
         if update:
             sys.stdout.write("[ddsmt] {}\r".format(msg))
@@ -104,40 +934,424 @@ def _log (verbosity, msg = "", update = False):
             sys.stdout.write("[ddsmt] {}\n".format(msg))
 
 
-def _dump (filename = None, root = None):
-    global g_smtformula
-    assert (g_smtformula)
+def _dumps ():
+    assert (g_reducer.smtformula)
+    return g_reducer.smtformula.dumps().encode()
+
+
+def _read (filename):
+    try:
+        with open(filename, 'rb') as infile:
+            return infile.read()
+    except IOError as e:
+        raise DDSMTException (str(e))
+
+
+def _write (filename, data):
     try:
-        g_smtformula.dump(filename, root)
+        with open(filename, 'wb') as outfile:
+            outfile.write(data)
     except IOError as e:
         raise DDSMTException (str(e))
 
 
-def _run (is_golden = False):
-    global g_args, g_golden_runtime, g_current_runtime
+def _checkpoint (position = None, force = False):
+    """_checkpoint(position, force)
+
+       Write a checkpoint of the reduction state to the file given via option
+       --checkpoint (or --resume), if the checkpoint interval has passed since
+       the last checkpoint (or force is True). The checkpoint comprises the
+       substitutions and fresh variables of the formula, the golden run, the
+       statistics, the timeout model, the test cache, the state of the
+       scheduler (including the given position in the current pass) and the
+       state of the random number generator. It is written to a temporary
+       file first and then renamed, a previous checkpoint thus stays intact if
+       writing fails or is interrupted.
+
+       :position: Function that returns the position in the current pass
+                  (see _substitute), None if not within a pass.
+       :force:    Bool indicating whether to ignore the checkpoint interval.
+    """
+    if not g_reducer.args.checkpoint:
+        return
+    if not force and time.time() - g_reducer.checkpoint_time < \
+                     g_reducer.args.checkpoint_interval:
+        return
+    state = {
+        "version": 1,
+        "input": g_reducer.args.input_hash,
+        "share_terms": g_reducer.args.share_terms,
+        "cache_prefix": hashlib.sha256(g_reducer.cache.prefix).hexdigest(),
+        "formula": g_reducer.smtformula.save_substs(),
+        "golden": [g_reducer.golden_exit,
+                   g_reducer.golden_err.decode("latin-1"),
+                   g_reducer.golden_runtime, g_reducer.args.cmpoutput],
+        "stats": [g_reducer.ntests, g_reducer.nstale, g_reducer.testtime,
+                  g_reducer.testcputime, g_reducer.testmaxrss,
+                  g_reducer.nleaked, g_reducer.current_runtime,
+                  g_reducer.ncandidates],
+        "timeouts": [g_reducer.timeouts.stats[True],
+                     g_reducer.timeouts.stats[False], g_reducer.timeouts.size,
+                     g_reducer.timeouts.max],
+        "cache": [g_reducer.cache.verdicts, g_reducer.cache.hits,
+                  g_reducer.cache.misses],
+        "scheduler": g_reducer.scheduler.state(
+            position() if position else None),
+        "random": random.getstate() }
+    tmpfile = "{}.{}".format(g_reducer.args.checkpoint, os.getpid())
     try:
-        if not g_args.timeout:
-            cmd = DDSMTCmd(g_args.cmd, 1.5 * g_golden_runtime, _log)
-        elif g_args.timeout_relative:
-            cmd = DDSMTCmd(g_args.cmd, g_args.timeout + g_golden_runtime, _log)
-        elif g_args.timeout_dynamic:
-            cmd = DDSMTCmd(g_args.cmd, g_args.timeout + g_current_runtime, _log)
+        with open(tmpfile, 'w') as outfile:
+            json.dump(state, outfile)
+        os.replace(tmpfile, g_reducer.args.checkpoint)
+    except IOError as e:
+        raise DDSMTException (str(e))
+    g_reducer.checkpoint_time = time.time()
+    _log (2, "checkpoint written to '{}'".format(g_reducer.args.checkpoint))
+
+
+def _read_checkpoint (filename):
+    """_read_checkpoint(filename)
+
+       Read a checkpoint written by _checkpoint and check that it belongs to
+       the input file.
+
+       :filename: The checkpoint file.
+       :return:   The checkpoint (dictionary).
+    """
+    try:
+        with open(filename, 'r') as infile:
+            state = json.load(infile)
+    except (IOError, ValueError) as e:
+        raise DDSMTException ("unable to read checkpoint: {}".format(str(e)))
+    if not isinstance(state, dict) or state.get("version") != 1:
+        raise DDSMTException ("invalid checkpoint '{}'".format(filename))
+    if state["input"] != g_reducer.args.input_hash:
+        raise DDSMTException ("checkpoint '{}' does not belong to given "\
+                              "input file".format(filename))
+    if state.get("share_terms", False) != g_reducer.args.share_terms:
+        raise DDSMTException ("checkpoint '{}' was written {} option "\
+                              "--share-terms".format(filename, "with" \
+                                  if state.get("share_terms") else "without"))
+    return state
+
+
+def _resume (state):
+    """_resume(state)
+
+       Restore the substitutions of the formula, the golden run, the
+       statistics, the timeout model and the state of the random number
+       generator saved in given checkpoint (the golden run is not repeated).
+
+       :state: The checkpoint as returned by _read_checkpoint.
+    """
+    try:
+        g_reducer.smtformula.load_substs(state["formula"])
+        (g_reducer.golden_exit, golden_err, g_reducer.golden_runtime,
+         cmpoutput) = state["golden"]
+        g_reducer.golden_err = golden_err.encode("latin-1")
+        if g_reducer.args.cmpoutput == None:
+            g_reducer.args.cmpoutput = cmpoutput
+        (g_reducer.ntests, g_reducer.nstale, g_reducer.testtime,
+         g_reducer.testcputime, g_reducer.testmaxrss, g_reducer.nleaked,
+         g_reducer.current_runtime, g_reducer.ncandidates) = state["stats"]
+        (g_reducer.timeouts.stats[True], g_reducer.timeouts.stats[False],
+         g_reducer.timeouts.size, g_reducer.timeouts.max) = state["timeouts"]
+        (version, internalstate, gauss) = state["random"]
+        random.setstate((version, tuple(internalstate), gauss))
+    except DDSMTParseCheckException as e:
+        raise DDSMTException ("invalid checkpoint: {}".format(e.msg))
+    except (KeyError, TypeError, ValueError):
+        raise DDSMTException ("invalid checkpoint '{}'".format(
+            g_reducer.args.resume))
+
+
+def _resume_reduction (state):
+    """_resume_reduction(state)
+
+       Restore the test cache and the state of the scheduler saved in given
+       checkpoint. Test results are only restored if the checkpoint was
+       written for the same binary, options and search pattern.
+
+       :state: The checkpoint as returned by _read_checkpoint.
+    """
+    try:
+        cache = g_reducer.cache
+        if state["cache_prefix"] == hashlib.sha256(cache.prefix).hexdigest():
+            (verdicts, cache.hits, cache.misses) = state["cache"]
+            g_reducer.cache.verdicts = dict((key, tuple(verdict))
+                                    for key, verdict in verdicts.items())
         else:
-            cmd = DDSMTCmd(g_args.cmd, g_args.timeout, _log)
+            _log (1, "[!!] command or search pattern changed: "\
+                     "test results of checkpoint discarded")
+        g_reducer.scheduler.restore(state["scheduler"])
+    except (KeyError, TypeError, ValueError):
+        raise DDSMTException ("invalid checkpoint '{}'".format(
+            g_reducer.args.resume))
+
+
+def _resume_nodes (ids):
+    """_resume_nodes(ids)
+
+       Map the ids of nodes of the input formula saved in a checkpoint to
+       nodes.
+
+       :ids:    List of node ids (relative to the first node of the formula).
+       :return: List of nodes, None if not all ids belong to the input
+                formula.
+    """
+    nodes = g_reducer.smtformula.parsed_nodes()
+    ids = [i + g_reducer.smtformula.id_base for i in ids]
+    if not all(i in nodes for i in ids):
+        return None
+    return [nodes[i] for i in ids]
+
+
+def _output (data):
+    # the output file is updated whenever a reduction was successful
+    if g_reducer.args.outfile:
+        _write (g_reducer.args.outfile, data)
+
+
+def _deliver (worker, data):
+    """_deliver(worker, data)
+
+       Make given candidate available to the solver run by given worker as
+       configured by option --delivery: written to the temporary file of the
+       worker ('file'), passed via stdin ('stdin'), or written to an anonymous
+       in-memory file of the worker that is passed as /proc/self/fd/<fd>
+       ('memfd').
+
+       :worker: The worker.
+       :data:   The candidate (bytes).
+       :return: Tuple (list of input file arguments, stdin data, file
+                descriptors to be inherited by the solver).
+    """
+    if g_reducer.args.delivery == "stdin":
+        return ([], data, ())
+    if g_reducer.args.delivery == "memfd":
+        if worker not in g_reducer.memfds:
+            g_reducer.memfds[worker] = os.memfd_create(
+                    "ddsmt-{}".format(worker))
+        fd = g_reducer.memfds[worker]
+        os.ftruncate(fd, 0)
+        view = memoryview(data)
+        while view:
+            view = view[os.pwrite(fd, view, len(data) - len(view)):]
+        return (["/proc/self/fd/{}".format(fd)], None, (fd,))
+    _write(_tmpfile(worker), data)
+    return ([_tmpfile(worker)], None, ())
+
+
+def _cmd (worker = 0, data = None):
+    if g_reducer.oracle:
+        return None
+    (args, stdin, pass_fds) = _deliver(worker, data)
+    cmd = [_tmpbin(worker)] + g_reducer.args.cmd[1:] + args
+    if not g_reducer.args.timeout:
+        timeout = g_reducer.timeouts.timeout(
+                len(data) if data != None else None)
+    elif g_reducer.args.timeout_relative:
+        timeout = g_reducer.args.timeout + g_reducer.golden_runtime
+    elif g_reducer.args.timeout_dynamic:
+        timeout = g_reducer.args.timeout + g_reducer.current_runtime
+    else:
+        timeout = g_reducer.args.timeout
+    limits = None
+    if g_reducer.args.memlimit or g_reducer.args.cpulimit:
+        limits = (g_reducer.args.memlimit, g_reducer.args.cpulimit)
+    return DDSMTCmd(cmd, timeout, _log, stdin, pass_fds,
+                    g_reducer.args.cmpoutput if g_reducer.args.early_kill \
+                            else None, limits, g_reducer.args.jobs)
+
+
+def _run (is_golden = False, cmd = None):
+    cmd = cmd if cmd else _cmd()
+    try:
         (out, err) = cmd.run_cmd(is_golden)
         return (cmd.rcode, out, err)
     except OSError as e:
-        raise DDSMTException("{}: {}".format(str(e), g_cmd[0]))
+        raise DDSMTException("{}: {}".format(str(e), cmd.cmd[0]))
+
+
+def _match (out, err):
+    return g_reducer.args.cmpoutput in err.decode() \
+            or g_reducer.args.cmpoutput in out.decode()
+
+
+def _cache_lookup (key):
+    verdict = g_reducer.cache.lookup(key)
+    if verdict == None:
+        return None
+    (exitcode, matched) = verdict
+    return exitcode == g_reducer.golden_exit and matched
+
+
+def _cache_store (key, exitcode, matched):
+    if matched != None:  # do not cache timeouts
+        g_reducer.cache.store(key, exitcode, matched)
+
 
+def _session (worker = 0):
+    if not g_reducer.args.session:
+        return None
+    if worker not in g_reducer.sessions:
+        g_reducer.sessions[worker] = DDSMTSession (
+                [_tmpbin(worker)] + g_reducer.args.cmd[1:] + \
+                        g_reducer.args.session_args,
+                g_reducer.args.session, g_reducer.smtformula.logic, _log)
+    session = g_reducer.sessions[worker]
+    return None if session.disabled else session
 
-def _test ():
-    global g_args, g_ntests, g_testtime
-    g_ntests += 1
+
+def _cancel (worker, cmd):
+    if cmd:
+        cmd.cancel()
+    session = _session(worker)
+    if session:
+        session.cancel()
+
+
+def _execute (worker, cmd, data):
+    """_execute(worker, cmd, data)
+
+       Test given candidate, which was delivered to given worker.
+
+       In session mode, the candidate is first tested in the persistent
+       solver session of the worker. Candidates that do not reproduce the
+       search pattern in the session are rejected right away. If the session
+       matches the pattern (the exit code is only available for a fresh
+       process) or crashes or hangs, the candidate is tested in a fresh
+       process.
+
+       In-process reductions (see reduce) call the oracle instead.
+
+       :worker: The worker.
+       :cmd:    The command to execute on the candidate.
+       :data:   The candidate (bytes).
+       :return: Tuple (exit code, matched), where exit code is None if unknown
+                and matched is None in case of a timeout.
+    """
+    if g_reducer.oracle:
+        return (g_reducer.golden_exit, _oracle(data))
+    session = _session(worker)
+    if session:
+        if session.test(data, g_reducer.args.cmpoutput,
+                        cmd.deadline) == False:
+            return (None, False)
+    (exitcode, out, err) = _run(False, cmd)
+    if cmd.matched:
+        # killed on match (option --early-kill), the exit code is ignored
+        return (g_reducer.golden_exit, True)
+    if exitcode == None:
+        return (None, None)
+    return (exitcode, _match(out, err))
+
+
+def _oracle (data):
+    return bool(g_reducer.oracle(data.decode()))
+
+
+def _account (cmd):
+    if not cmd:
+        return
+    g_reducer.nleaked += cmd.nleaked
+    if cmd.rusage:
+        g_reducer.testcputime += cmd.cputime()
+        g_reducer.testmaxrss = max(g_reducer.testmaxrss, cmd.maxrss())
+
+
+def _runtime (cmd, runtime):
+    # in session mode, a candidate tested in a fresh process was tested in
+    # the session before, only the fresh process is sampled
+    if cmd and cmd.runtime != None:
+        runtime = cmd.runtime
+    # tests run concurrently slow each other down, the runtime of a test run
+    # alone is estimated by its cpu time (for single-threaded solvers), but
+    # at least its share of the runtime
+    njobs = g_reducer.args.jobs
+    if njobs == 1 or not cmd or not cmd.rusage:
+        return runtime
+    return min(runtime, max(cmd.cputime(), runtime / njobs))
+
+
+def _sample (runtime, size, exitcode, matched):
+    if matched == None:
+        g_reducer.timeouts.censor(runtime, size)
+    else:
+        g_reducer.timeouts.sample(runtime, size,
+                exitcode == g_reducer.golden_exit and bool(matched))
+
+
+def _test (data):
+    key = g_reducer.cache.key(data)
+    res = _cache_lookup(key)
+    if res != None:
+        return res
+    g_reducer.ntests += 1
     start = time.time()
-    (exitcode, out, err) = _run()
-    g_testtime += time.time() - start
-    return exitcode == g_golden_exit and \
-        (g_args.cmpoutput in err.decode() or g_args.cmpoutput in out.decode())
+    cmd = _cmd(0, data)
+    (exitcode, matched) = _execute(0, cmd, data)
+    runtime = time.time() - start
+    g_reducer.testtime += runtime
+    _account (cmd)
+    runtime = _runtime(cmd, runtime)
+    _sample (runtime, len(data), exitcode, matched)
+    _cache_store(key, exitcode, matched)
+    res = exitcode == g_reducer.golden_exit and bool(matched)
+    if res:
+        g_reducer.current_runtime = runtime
+    return res
+
+class DDSMTCandidates ():
+    """DDSMTCandidates
+
+       Ordered set of nodes that are still to be substituted. Removing nodes
+       (after a successful substitution) takes constant time per node, removed
+       nodes are left as holes and dropped when the list of remaining nodes is
+       requested (once per granularity).
+    """
+
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+        self.pos = dict((n.id, i) for i, n in enumerate(self.nodes))
+        self.nholes = 0
+
+    def __len__(self):
+        return len(self.pos)
+
+    def remove(self, nodes):
+        for n in nodes:
+            i = self.pos.pop(n.id, None)
+            if i != None:
+                self.nodes[i] = None
+                self.nholes += 1
+
+    def live(self):
+        if self.nholes:
+            self.nodes = [n for n in self.nodes if n != None]
+            self.pos = dict((n.id, i) for i, n in enumerate(self.nodes))
+            self.nholes = 0
+        return self.nodes
+
+
+def _traverse (roots, bfs, visit):
+    """_traverse(roots, bfs, visit)
+
+       Visit nodes in depth-first (or breadth-first if bfs is True) order,
+       starting from a given list of roots.
+
+       :roots: List of nodes from which to begin searching.
+       :bfs:   Bool indicating whether to use breadth-first search.
+       :visit: Function called on each visited node, returns the list of nodes
+               to visit next (or None).
+    """
+    to_visit = deque(roots)
+    pop = to_visit.popleft if bfs else to_visit.pop
+    while to_visit:
+        succs = visit(pop())
+        if succs:
+            to_visit.extend(succs)
+
 
 def _filter_scopes (filter_fun, bfs, root = None):
     """_filter_scopes(filter_fun, bfs, root)
@@ -158,20 +1372,17 @@ def _filter_scopes (filter_fun, bfs, root = None):
        :bfs:        Bool indicating whether to use breadth-first search.
        :return:     List of scope nodes that fit the filtering condition.
     """
-    global g_smtformula
-    assert (g_smtformula)
+    assert (g_reducer.smtformula)
     scopes = []
-    to_visit = [root if root else g_smtformula.scopes]
-    while to_visit:
-        if bfs:
-            cur = to_visit.pop(0)
-        else:
-            cur = to_visit.pop()
+
+    def visit (cur):
         if cur.is_subst():
-            continue
+            return None
         if filter_fun(cur):
             scopes.append(cur)
-        to_visit.extend(cur.scopes)
+        return cur.scopes
+
+    _traverse ([root if root else g_reducer.smtformula.scopes], bfs, visit)
     return scopes
 
 def _filter_cmds (filter_fun, bfs):
@@ -188,12 +1399,11 @@ def _filter_cmds (filter_fun, bfs):
        :bfs:        Bool indicating whether to use breadth-first search.
        :return:     List of command nodes that fit the filtering condition.
     """
-    global g_smtformula
-    assert (g_smtformula)
+    assert (g_reducer.smtformula)
     cmds = []
     scopes = _filter_scopes (lambda x: x.is_regular(), bfs)
     to_visit = [c for cmd_list in [s.cmds for s in scopes] for c in cmd_list]
-    to_visit.extend(g_smtformula.scopes.declfun_cmds.values())
+    to_visit.extend(g_reducer.smtformula.scopes.declfun_cmds.values())
     while to_visit:
         cur = to_visit.pop()
         if cur.is_subst():
@@ -219,27 +1429,399 @@ def _filter_terms (filter_fun, bfs, roots):
        :return:     List of term nodes that fit the filtering condition.
     """
     nodes = []
-    to_visit = roots
-    visited = {}
-    while to_visit:
-        if bfs:
-            cur = to_visit.pop(0).get_subst()
-        else:
-            cur = to_visit.pop().get_subst()
+    visited = set()
+
+    def visit (cur):
+        cur = cur.get_subst()
         if not cur or cur.id in visited:
-            continue
-        visited[cur.id] = cur
+            return None
+        visited.add(cur.id)
         if cur.is_fun() and cur.children and cur.children[0].is_subst():
-            continue
+            return None
         if filter_fun(cur):
             nodes.append(cur)
-        if cur.children:
-            to_visit.extend(cur.children)
+        return cur.children
+
+    _traverse (roots, bfs, visit)
+    return nodes
+
+def _level_terms (nodes, visited):
+    """_level_terms(nodes, visited)
+
+       Resolve given term nodes to their substitutions and drop the ones that
+       were already visited (on a previous level).
+
+       :nodes:   List of term nodes.
+       :visited: Set of ids of visited term nodes (updated).
+       :return:  List of term nodes of the level.
+    """
+    level = []
+    for node in nodes:
+        cur = node.get_subst()
+        if not cur or cur.id in visited:
+            continue
+        visited.add(cur.id)
+        level.append(cur)
+    return level
+
+def _index_terms (filter_fun, cmds, kinds = None, sort = None):
+    """_index_terms(filter_fun, cmds, kinds, sort)
+
+       Collect a list of term nodes that fit a condition defined by given
+       filtering function filter_fun from the terms index of the formula
+       rather than by traversing the formula (see _filter_terms). Only terms
+       of given kinds and sort class are considered.
+
+       Nodes are ordered by command and, within a command, in reverse order of
+       creation, which approximates the order of a depth-first search (terms
+       shared between commands are ordered by the command they were created
+       in).
+
+       :filter_fun: Boolean function that returns True if a node should be
+                    added.
+       :cmds:       List of commands of the same kind the terms descend from.
+       :kinds:      List of term kinds to consider (None for all).
+       :sort:       Sort class (see SMTTermIndex.sort_class) to consider (None
+                    for all).
+       :return:     List of term nodes that fit the filtering condition.
+    """
+    assert (g_reducer.smtformula and g_reducer.smtformula.terms_index)
+    assert (all(c.kind == cmds[0].kind for c in cmds))
+    ids = sorted(c.id for c in cmds)
+    nodes = [t for t in g_reducer.smtformula.terms_index.get_terms(
+                 cmds[0].kind, kinds, sort) if filter_fun(t)]
+    nodes.sort(key = lambda t: (bisect.bisect_left(ids, t.id), -t.id))
     return nodes
 
-def _substitute (subst_fun, substlist, superset, randomized,
-                 with_vars = False):
-    """_substitute(subst_fun, substlist, superset, randomized, with_vars)
+def _apply_subst (subst_fun, subset):
+    """_apply_subst(subst_fun, subset)
+
+       Substitute all nodes in given subset that are not substituted yet as
+       defined by given substitution function subst_fun.
+
+       :subst_fun: Function used to determine node substitutions.
+       :subset:    List of nodes to substitute.
+       :return:    Number of nodes substituted.
+    """
+    nsubst = 0
+    for item in subset:
+        if not item.is_subst():
+            item.subst (subst_fun(item))
+            nsubst += 1
+    return nsubst
+
+
+def _save_substs (substlist):
+    """_save_substs(substlist)
+
+       Open a checkpoint of the current substitution state (substitutions and
+       declarations of substitution variables). All changes up to the
+       matching _restore_substs or _commit_substs are recorded in the undo
+       journal of given substitution list.
+
+       :substlist: Map from nodes in the input formula to their corresponding
+                   nodes in the reduced formula.
+       :return:    Checkpoint to be passed to _restore_substs/_commit_substs.
+    """
+    return substlist.checkpoint()
+
+
+def _commit_substs (substlist, checkpoint):
+    """_commit_substs(substlist, checkpoint)
+
+       Keep all substitutions (and fresh variables) added since given
+       checkpoint was opened.
+
+       :substlist:  Map from nodes in the input formula to their corresponding
+                    nodes in the reduced formula.
+       :checkpoint: Checkpoint as returned by _save_substs.
+    """
+    substlist.commit(checkpoint)
+
+
+def _restore_substs (substlist, checkpoint):
+    """_restore_substs(substlist, checkpoint)
+
+       Restore the substitution state of given checkpoint, i.e., undo all
+       substitutions (and fresh variables) added since it was opened.
+       Takes time linear in the number of undone changes.
+
+       :substlist:  Map from nodes in the input formula to their corresponding
+                    nodes in the reduced formula.
+       :checkpoint: Checkpoint as returned by _save_substs.
+       :return:     The undone changes (to be passed to _replay_substs).
+    """
+    return substlist.rollback(checkpoint)
+
+
+def _replay_substs (substlist, changes):
+    """_replay_substs(substlist, changes)
+
+       Redo changes undone by _restore_substs (no other substitutions may
+       have been committed in between).
+
+       :substlist: Map from nodes in the input formula to their corresponding
+                   nodes in the reduced formula.
+       :changes:   Changes as returned by _restore_substs.
+    """
+    substlist.replay(changes)
+
+
+def _substitute_parallel (subst_fun, substlist, subsets, gran, start_time,
+                          first = False):
+    """_substitute_parallel(subst_fun, substlist, subsets, gran, start_time,
+                            first)
+
+       Test given subsets concurrently on g_reducer.args.jobs workers (with
+       option --jobserver, workers beyond the first only run a test if they
+       obtain a token from the jobserver). Each worker dumps its candidate
+       into its own temporary file and runs its own copy of the binary.
+       Candidates are decided in order: the first successful subset is
+       committed as soon as all previous subsets failed, candidates tested
+       concurrently relative to the then outdated formula are cancelled (or
+       discarded) and testing resumes with the subset following the committed
+       one.
+
+       Tests run concurrently slow each other down. To not turn this into
+       timeouts, the deadline of a test is extended by a factor of the number
+       of jobs, and a test that finishes after its timeout times out only if
+       its cpu time exceeds the timeout (see DDSMTCmd.run_cmd). Its cpu time
+       is also sampled as its runtime (see _runtime). For single-threaded
+       solvers, the result is thus the same as testing the subsets one by
+       one unless tests time out by a narrow margin.
+
+       :subst_fun:  Function used to determine node substitutions.
+       :substlist:  Map from nodes in the input formula to their corresponding
+                    nodes in the reduced formula.
+       :subsets:    List of subsets of nodes to attempt to substitute.
+       :gran:       Current granularity (for logging).
+       :start_time: Start time of the current testing round.
+       :first:      Bool indicating whether to stop after the first successful
+                    subset.
+       :return:     Tuple (number of nodes substituted, list of successfully
+                    substituted subsets).
+    """
+    nsubst_total = 0
+    substituted = []
+    idle = list(range(g_reducer.args.jobs))
+    running = {}    # future -> (subset index, worker, cmd, start time, key)
+    candidates = {} # subset index -> (nsubst, substitution changes,
+                    #                  candidate)
+    results = {}    # subset index -> test result (None if nothing to test)
+    next_idx = 0    # next subset to dispatch
+    cur_idx = 0     # next subset to decide
+    timeout = False
+
+    pool = ThreadPoolExecutor (max_workers = g_reducer.args.jobs)
+    try:
+        while True:
+            # dispatch candidates relative to the current formula
+            while idle and next_idx < len(subsets) and not timeout \
+                  and not (first and substituted):
+                if g_reducer.args.roundtime and \
+                   time.time() - start_time > g_reducer.args.roundtime:
+                    _log (2, "[!!] test round timeout: reducing granularity")
+                    timeout = True
+                    break
+                if g_jobserver and running and \
+                   len(g_jobserver.tokens) < len(running) and \
+                   not g_jobserver.acquire():
+                    break
+                checkpoint = _save_substs (substlist)
+                nsubst = _apply_subst (subst_fun, subsets[next_idx])
+                data = _dumps() if nsubst else None
+                changes = _restore_substs (substlist, checkpoint)
+                if nsubst == 0:
+                    results[next_idx] = None
+                else:
+                    candidates[next_idx] = (nsubst, changes, data)
+                    key = g_reducer.cache.key(data)
+                    results[next_idx] = _cache_lookup(key)
+                    if results[next_idx] == None:
+                        del(results[next_idx])
+                        worker = idle.pop()
+                        cmd = _cmd(worker, data)
+                        running[pool.submit(_execute, worker, cmd, data)] = \
+                                (next_idx, worker, cmd, time.time(), key)
+                        g_reducer.ntests += 1
+                next_idx += 1
+
+            # decide candidates in order
+            while cur_idx in results:
+                success = results.pop(cur_idx)
+                if success != None:
+                    g_reducer.ncandidates += 1
+                if success:
+                    (nsubst, changes, data) = candidates[cur_idx]
+                    _replay_substs (substlist, changes)
+                    _output (data)
+                    nsubst_total += nsubst
+                    substituted.append(subsets[cur_idx])
+                    # discard candidates based on the outdated formula
+                    for f in running:
+                        _cancel (running[f][1], running[f][2])
+                    wait (running)
+                    for f in running:
+                        idle.append(running[f][1])
+                    g_reducer.nstale += len(running) + len(results)
+                    running.clear()
+                    results.clear()
+                    next_idx = cur_idx + 1
+                candidates.pop(cur_idx, None)
+                if success != None:
+                    _log (2, "    granularity: {}, subset {} of {}, " \
+                             "substituted: {}".format(gran, cur_idx + 1,
+                          len(subsets), nsubst if success else 0), True)
+                cur_idx += 1
+
+            if g_jobserver:
+                g_jobserver.release(max(len(running) - 1, 0))
+
+            if not running:
+                assert (cur_idx == next_idx)
+                if timeout or next_idx >= len(subsets) \
+                   or (first and substituted):
+                    break
+                continue
+
+            # with a jobserver, check for free job slots periodically
+            poll = g_jobserver and idle and next_idx < len(subsets)
+            (done, not_done) = wait (running, timeout = 0.1 if poll else None,
+                                     return_when = FIRST_COMPLETED)
+            for f in done:
+                (idx, worker, cmd, start, key) = running.pop(f)
+                idle.append(worker)
+                runtime = time.time() - start
+                g_reducer.testtime += runtime
+                _account (cmd)
+                (exitcode, matched) = f.result()
+                runtime = _runtime(cmd, runtime)
+                _sample (runtime, len(candidates[idx][2]), exitcode, matched)
+                _cache_store(key, exitcode, matched)
+                results[idx] = exitcode == g_reducer.golden_exit \
+                        and bool(matched)
+                if results[idx]:
+                    g_reducer.current_runtime = runtime
+    finally:
+        # do not wait for running tests on interrupt
+        for f in running:
+            _cancel (running[f][1], running[f][2])
+        pool.shutdown()
+    if g_jobserver:
+        g_jobserver.release()
+    return (nsubst_total, substituted)
+
+
+def _substitute_serial (subst_fun, substlist, subsets, gran, start_time,
+                        first = False):
+    """_substitute_serial(subst_fun, substlist, subsets, gran, start_time,
+                          first)
+
+       Test given subsets one by one.
+
+       :subst_fun:  Function used to determine node substitutions.
+       :substlist:  Map from nodes in the input formula to their corresponding
+                    nodes in the reduced formula.
+       :subsets:    List of subsets of nodes to attempt to substitute.
+       :gran:       Current granularity (for logging).
+       :start_time: Start time of the current testing round.
+       :first:      Bool indicating whether to stop after the first successful
+                    subset.
+       :return:     Tuple (number of nodes substituted, list of successfully
+                    substituted subsets).
+    """
+    nsubst_total = 0
+    substituted = []
+    for idx, subset in enumerate(subsets):
+        if g_reducer.args.roundtime:
+            if time.time() - start_time > g_reducer.args.roundtime:
+                _log (2, "[!!] test round timeout: reducing granularity")
+                break
+        checkpoint = _save_substs (substlist)
+        nsubst = _apply_subst (subst_fun, subset)
+        if nsubst == 0:
+            _commit_substs (substlist, checkpoint)
+            continue
+
+        g_reducer.ncandidates += 1
+        data = _dumps()
+        if _test(data):
+            _commit_substs (substlist, checkpoint)
+            _output (data)
+            nsubst_total += nsubst
+            substituted.append(subset)
+            _log (2, "    granularity: {}, subset {} of {}, " \
+                     "substituted: {}".format(gran, idx + 1,
+                  len(subsets), nsubst), True)
+            if first:
+                break
+        else:
+            _log (2, "    granularity: {}, subset {} of {}, "\
+                     "substituted: 0".format(gran, idx + 1,
+                  len(subsets)), True)
+            _restore_substs (substlist, checkpoint)
+    return (nsubst_total, substituted)
+
+
+def _substitute_ddmin (subst_fun, substlist, superset, n = 1):
+    """_substitute_ddmin(subst_fun, substlist, superset, n)
+
+       Attempt to substitute nodes as defined by given substitution function
+       subst_fun following Zeller's ddmin algorithm. The nodes that are kept
+       (not substituted yet) are split into n chunks. Each round first tests
+       the complements (keep only one chunk and substitute all others), then
+       the chunks themselves. After a success testing restarts on the reduced
+       set of nodes, with 2 chunks if a complement was substituted and n - 1
+       chunks if a single chunk was substituted. If no test succeeds, the
+       number of chunks is doubled until each chunk is a single node.
+
+       :subst_fun:  Function used to determine node substitutions.
+       :substlist:  Map from nodes in the input formula to their corresponding
+                    nodes in the reduced formula.
+       :superset:   List of nodes to attempt to substitute.
+       :n:          Initial number of chunks.
+       :return:     Total number of nodes substituted.
+    """
+    nsubst_total = 0
+    kept = list(superset)
+    while kept:
+        start_time = time.time()
+        n = min(n, len(kept))
+        size = -(-len(kept) // n)
+        chunks = [kept[s:s+size] for s in range(0, len(kept), size)]
+        complements = []
+        if len(chunks) > 2:
+            complements = [kept[:s] + kept[s+size:]
+                           for s in range(0, len(kept), size)]
+        subsets = complements + chunks
+        if g_reducer.args.jobs > 1:
+            (nsubst, substituted) = _substitute_parallel (
+                    subst_fun, substlist, subsets, size, start_time, True)
+        else:
+            (nsubst, substituted) = _substitute_serial (
+                    subst_fun, substlist, subsets, size, start_time, True)
+        nsubst_total += nsubst
+        if substituted:
+            idx = next(i for i, s in enumerate(subsets)
+                       if s is substituted[0])
+            if idx < len(complements):
+                n = 2
+            else:
+                n = max(n - 1, 2)
+        elif n >= len(kept):
+            break
+        else:
+            n = min(2 * n, len(kept))
+        kept = [node for node in kept if not node.is_subst()]
+        g_reducer.scheduler.nsubst_pass += nsubst
+        _checkpoint (lambda: { "nodes": [node.id - g_reducer.smtformula.id_base
+                                         for node in kept],
+                               "gran": n })
+    return nsubst_total
+
+
+def _substitute (subst_fun, substlist, superset, randomized):
+    """_substitute(subst_fun, substlist, superset, randomized)
 
        Attempt to substitute nodes in contiguous subsets as defined by given
        substitution function subst_fun. Remove substituted nodes from superset
@@ -248,70 +1830,69 @@ def _substitute (subst_fun, substlist, superset, randomized,
        If randomized is True, sample subsets randomly rather than splitting
        into contiguous subsets.
 
+       If more than one job is given (option -j, or --speculate), subsets are
+       tested concurrently (see _substitute_parallel).
+
+       If option --ddmin is given, reduce with complement testing instead
+       (see _substitute_ddmin).
+
+       When resuming from a checkpoint (option --resume), calls that were
+       completed in the current pass before the checkpoint was written are
+       skipped, and the call that was interrupted continues with the saved
+       remaining nodes and granularity.
+
        :subst_fun:  Function used to determine node substitutions.
        :substlist:  Map from nodes in the input formula to their corresponding
                     nodes in the reduced formula.
        :superset:   List of nodes to attempt to substitute.
        :randomized: Bool indicating whether to randomize subset selection.
-       :with_vars:  Bool indicating whether the substitution creates new
-                    variables.
        :return:     Total number of nodes substituted.
     """
-    global g_smtformula, g_current_runtime
 
-    assert (g_smtformula)
-    assert (substlist is g_smtformula.substs)
+    assert (g_reducer.smtformula)
+    assert (substlist is g_reducer.smtformula.substs)
+    gran = None
+    resume = g_reducer.scheduler.resume
+    g_reducer.scheduler.ncalls += 1
+    if resume and g_reducer.scheduler.ncalls <= resume["ncall"]:
+        if g_reducer.scheduler.ncalls < resume["ncall"]:
+            return 0    # completed before the checkpoint was written
+        nodes = _resume_nodes (resume["nodes"])
+        if nodes == None:
+            _log (2, "[!!] unable to resume at saved position, restarting")
+        else:
+            (superset, gran) = (nodes, resume["gran"])
+    if g_reducer.args.ddmin:
+        return _substitute_ddmin (subst_fun, substlist, superset,
+                                  gran if gran else 1)
+
     nsubst_total = 0
-    gran = len(superset)
+    candidates = DDSMTCandidates (superset)
+    gran = gran if gran != None else len(candidates)
 
     while gran > 0:
         start_time = time.time()
+        superset = candidates.live()
         if randomized:
             subsets = [random.sample(superset, gran) for s in range(
                        0, len(superset), gran)]
         else:
             subsets = [superset[s:s+gran] for s in range (
                        0, len(superset), gran)]
-        tests_performed = 0
-        for subset in subsets:
-            if g_args.roundtime:
-                if time.time() - start_time > g_args.roundtime:
-                    _log (2, "[!!] test round timeout: reducing granularity")
-                    break
-            tests_performed += 1
-            nsubst = 0
-            cpy_substs = substlist.substs.copy()
-            cpy_declfun_cmds = g_smtformula.scopes.declfun_cmds.copy()
-            for item in subset:
-                if not item.is_subst():
-                    item.subst (subst_fun(item))
-                    nsubst += 1
-            if nsubst == 0:
-                continue
-
-            _dump (g_tmpfile)
-            start = time.time()
-            if _test():
-                g_current_runtime = time.time() - start
-                _dump (g_args.outfile)
-                nsubst_total += nsubst
-                _log (2, "    granularity: {}, subset {} of {}, " \
-                         "substituted: {}".format(gran, tests_performed,
-                      len(subsets), nsubst), True)
-                superset = list(set(superset) - set(subset))
-            else:
-                _log (2, "    granularity: {}, subset {} of {}, "\
-                         "substituted: 0".format(gran, tests_performed,
-                      len(subsets)), True)
-                substlist.substs = cpy_substs
-                if with_vars:
-                    for name in g_smtformula.scopes.declfun_cmds:
-                        assert (g_smtformula.find_fun(
-                            name, scope = g_smtformula.scopes))
-                        if name not in cpy_declfun_cmds:
-                            g_smtformula.delete_fun(name)
-                g_smtformula.scopes.declfun_cmds = cpy_declfun_cmds
+        if g_reducer.args.jobs > 1:
+            (nsubst, substituted) = _substitute_parallel (
+                    subst_fun, substlist, subsets, gran, start_time)
+        else:
+            (nsubst, substituted) = _substitute_serial (
+                    subst_fun, substlist, subsets, gran, start_time)
+        nsubst_total += nsubst
+        for subset in substituted:
+            candidates.remove(subset)
         gran = gran // 2
+        g_reducer.scheduler.nsubst_pass += nsubst
+        _checkpoint (lambda: { "nodes": [node.id - g_reducer.smtformula.id_base
+                                         for node in candidates.live()],
+                               "gran": gran })
     return nsubst_total
 
 
@@ -327,13 +1908,12 @@ def _substitute_scopes (bfs, randomized):
                     substitution.
        :return:     Total number of nodes substituted.
     """
-    global g_smtformula
-    assert (g_smtformula)
+    assert (g_reducer.smtformula)
     _log (2)
     _log (2, "----------------------------------------------------------------")
     _log (2, "substitute SCOPES:")
     _log (2, "----------------------------------------------------------------")
-    ntests_prev = g_ntests
+    ntests_prev = g_reducer.ntests
     nsubst_total = 0
     level = 1
     while True:
@@ -341,11 +1921,11 @@ def _substitute_scopes (bfs, randomized):
                                  x.is_regular(), bfs)
         if not scopes:
             break
-        nsubst_total += _substitute (
-                lambda x: None, g_smtformula.substs, scopes, randomized)
+        nsubst_total += _substitute (lambda x: None,
+                g_reducer.smtformula.substs, scopes, randomized)
         level += 1
     _log (2, "  >> {} scope(s) substituted in total".format(nsubst_total))
-    _log (3, "  >> {} test(s)".format(g_ntests - ntests_prev))
+    _log (3, "  >> {} test(s)".format(g_reducer.ntests - ntests_prev))
     return nsubst_total
 
 def _substitute_cmds (bfs, randomized, filter_fun = None):
@@ -360,31 +1940,76 @@ def _substitute_cmds (bfs, randomized, filter_fun = None):
                     substitution.
        :return:     Total number of nodes substituted.
     """
-    global g_smtformula
-    assert (g_smtformula)
+    assert (g_reducer.smtformula)
     _log (2)
     _log (2, "----------------------------------------------------------------")
     _log (2, "substitute COMMANDS:")
     _log (2, "----------------------------------------------------------------")
-    ntests_prev = g_ntests
+    ntests_prev = g_reducer.ntests
     filter_fun = filter_fun if filter_fun else \
             lambda x: not x.is_setlogic() and not x.is_exit()
-    nsubst_total = _substitute (lambda x: None, g_smtformula.substs,
+    nsubst_total = _substitute (lambda x: None, g_reducer.smtformula.substs,
             _filter_cmds(filter_fun, bfs), randomized)
     _log (2, "  >> {} command(s) substituted in total".format(nsubst_total))
-    _log (3, "  >> {} test(s)".format(g_ntests - ntests_prev))
+    _log (3, "  >> {} test(s)".format(g_reducer.ntests - ntests_prev))
     return nsubst_total
 
 
-def _substitute_terms (subst_fun, filter_fun, cmds, bfs, randomized, msg = None,
-                       with_vars = False):
+def _substitute_terms_hdd (subst_fun, filter_fun, cmds, randomized):
+    """_substitute_terms_hdd(subst_fun, filter_fun, cmds, randomized)
+
+       Hierarchical delta debugging: attempt to substitute term nodes as
+       defined by given substitution function subst_fun and filtering
+       condition filter_fun one level of the term DAG at a time, starting
+       from the roots of given commands. Terms are assigned the level at
+       which they are first reached. Subterms of terms substituted at a level
+       are never tested.
+
+       :subst_fun:  Function used to determine node substitutions.
+       :filter_fun: Function used to select terms to substitute.
+       :cmds:       List of commands to substitute terms from.
+       :randomized: Bool indicating whether to randomize subset selection.
+       :return:     Total number of nodes substituted.
+    """
+    nsubst_total = 0
+    depth = 0
+    visited = set()
+    level = _level_terms ([t for term_list in
+                [c.children if c.is_getvalue() else [c.children[-1]] \
+                        for c in cmds] for t in term_list], visited)
+    while level:
+        terms = [t for t in level if not (t.is_fun() and t.children and
+                 t.children[0].is_subst()) and filter_fun(t)]
+        if terms:
+            _log (3, "    level {}: {} term(s)".format(depth, len(terms)))
+            nsubst_total += _substitute (
+                    subst_fun, g_reducer.smtformula.substs, terms, randomized)
+        # subterms of substituted terms are not considered, their
+        # substitution takes their place on the next level instead
+        succs = []
+        for node in level:
+            cur = node.get_subst()
+            if cur is not node:
+                succs.append(cur)
+            elif not (cur.is_fun() and cur.children and
+                      cur.children[0].is_subst()):
+                succs.extend(cur.children)
+        level = _level_terms ([n for n in succs if n], visited)
+        depth += 1
+    return nsubst_total
+
+
+def _substitute_terms (subst_fun, filter_fun, cmds, bfs, randomized,
+                       msg = None, kinds = None, sort = None):
     """_substitute_terms(subst_fun, filter_fun, cmds, bfs, randomized, msg,
-                         with_vars)
+                         kinds, sort)
 
        Attempt to substitute term nodes as defined by given substitution
        function subst_fun and filtering condition filter_fun. Terms descend from
        a given command list cmds and are collected in the order indicated by the
-       bfs parameter.
+       bfs parameter. In depth-first order, terms are fetched from the terms
+       index, restricted to given kinds and sort class, which must include all
+       terms that fit filter_fun.
 
        :subst_fun:  Function used to determine node substitutions.
        :filter_fun: Function used to select terms to substitute.
@@ -393,439 +2018,757 @@ def _substitute_terms (subst_fun, filter_fun, cmds, bfs, randomized, msg = None,
                     order.
        :randomized: Bool indicating whether to randomize subset selection.
        :msg:        String to write to the log.
-       :with_vars:  Bool indicating whether the substitution creates new
-                    variables.
+       :kinds:      List of term kinds to consider (None for all).
+       :sort:       Sort class to consider (None for all).
        :return:     Total number of nodes substituted.
     """
     _log (2)
     _log (2, msg if msg else "substitute TERMS:")
-    ntests_prev = g_ntests
-    terms = _filter_terms (filter_fun, bfs, [t for term_list in
-                [c.children if c.is_getvalue() else [c.children[-1]] \
-                        for c in cmds] for t in term_list])
-
-    nsubst_total = _substitute (subst_fun, g_smtformula.substs, terms, \
-                    randomized, with_vars)
+    ntests_prev = g_reducer.ntests
+    if g_reducer.args.hdd:
+        nsubst_total = _substitute_terms_hdd (subst_fun, filter_fun, cmds,
+                                              randomized)
+        _log (2, "    >> {} term(s) substituted in total".format(nsubst_total))
+        _log (3, "    >> {} test(s)".format(g_reducer.ntests - ntests_prev))
+        return nsubst_total
+    if bfs or not g_reducer.smtformula.terms_index:
+        terms = _filter_terms (filter_fun, bfs, [t for term_list in
+                    [c.children if c.is_getvalue() else [c.children[-1]] \
+                            for c in cmds] for t in term_list])
+    else:
+        terms = _index_terms (filter_fun, cmds, kinds, sort)
+
+    nsubst_total = _substitute (subst_fun, g_reducer.smtformula.substs,
+                                terms, randomized)
 
     _log (2, "    >> {} term(s) substituted in total".format(nsubst_total))
-    _log (3, "    >> {} test(s)".format(g_ntests - ntests_prev))
+    _log (3, "    >> {} test(s)".format(g_reducer.ntests - ntests_prev))
     return nsubst_total
 
 
-def ddsmt_main ():
-    global g_tmpfile, g_args, g_smtformula
+def _term_pass (name, cmds_filter, cmds_msg, subst_fun, filter_fun, msg,
+                kinds = None, sort = None):
+    """_term_pass(name, cmds_filter, cmds_msg, subst_fun, filter_fun, msg,
+                  kinds, sort)
 
-    nrounds = 0
-    nsubst_total  = 0
-    nsubst_round  = 1
-    nscopes_subst = 0
-    ncmds_subst   = 0
-    nterms_subst  = 0
+       Create a term substitution pass on the commands that fit given filtering
+       function cmds_filter (see _substitute_terms).
 
-    succeeded = "none"
+       :return: A DDSMTPass.
+    """
+    def fun (nrounds):
+        cmds = _filter_cmds (cmds_filter, g_reducer.args.bfs)
+        if not cmds:
+            return 0
+        return _substitute_terms (subst_fun, filter_fun, cmds,
+                g_reducer.args.bfs, g_reducer.args.randomized,
+                "{} in {} cmds".format(msg, cmds_msg),
+                kinds, sort)
+    return DDSMTPass ("{}:{}".format(name, cmds_msg.strip("'")), "terms",
+                      fun)
 
-    sf = g_smtformula
 
-    while nsubst_round:
-        nsubst_round = 0
-        nsubst = 0
-        nrounds += 1
+def _passes ():
+    """_passes()
 
-        nsubst = _substitute_scopes (g_args.bfs, g_args.randomized)
-        if nsubst:
-            succeeded = "scopes"
-            nsubst_round += nsubst
-            nscopes_subst += nsubst
-        elif succeeded == "scopes":
-            break
+       Collect the substitution passes applicable to the input formula, in
+       their initial order.
 
-        # initially, eliminate asserts only
-        # -> prevent lots of likely unsuccessful testing when eliminating
-        #    e.g. declare-funs previous to term substitution
-        if nrounds > 1:
-           nsubst = _substitute_cmds (g_args.bfs, g_args.randomized)
-        else:
-           nsubst = _substitute_cmds (g_args.bfs, g_args.randomized,
-                                      lambda x: x.is_assert())
-        if nsubst:
-           succeeded = "cmds"
-           nsubst_round += nsubst
-           ncmds_subst += nsubst
-        elif succeeded == "cmds":
-           break
-
-        cmds = [_filter_cmds (lambda x: x.is_definefun(), g_args.bfs),
-                _filter_cmds (lambda x: x.is_assert(), g_args.bfs),
-                _filter_cmds (lambda x: x.is_getvalue(), g_args.bfs)]
-        cmds_msgs = ["'define-fun'", "'assert'", "'get-value'"]
-
-        for i in range(0,len(cmds)):
-            if cmds[i]:
-                _log(2)
-                _log (2, "---------------------------------------------------"\
-                         "-------------")
-                _log (2, "substitute TERMs in {} cmds:".format(cmds_msgs[i]))
-                _log (2, "---------------------------------------------------"\
-                         "-------------")
-
-                ### BV substitutions
-                if sf.is_bv_logic():
-                    nsubst = _substitute_terms (
-                            lambda x: sf.bvZeroConstNode(x.sort),
-                            lambda x: not x.is_const() \
-                                      and x.sort and x.sort.is_bv_sort(),
-                            cmds[i], g_args.bfs, g_args.randomized,
-                            "  substitute BV terms with '0'")
-                    if nsubst:
-                        succeeded = "bv0_{}".format(i)
-                        nsubst_round += nsubst
-                        nterms_subst += nsubst
-                    elif succeeded == "bv0_{}".format(i):
-                        break
-                    nsubst = _substitute_terms (
-                            lambda x: x.children[1].get_subst() \
-                                if x.children[0].get_subst().is_false_bvconst()\
-                                else x.children[0].get_subst(),
-                            lambda x: x.is_bvor() and \
-                                (x.children[0].get_subst().is_false_bvconst() \
-                                 or
-                                 x.children[1].get_subst().is_false_bvconst()),
-                            cmds[i], g_args.bfs, g_args.randomized,
-                            "  substitute (bvor term false) with term")
-                    if nsubst:
-                        succeeded = "bvor_{}".format(i)
-                        nsubst_round += nsubst
-                        nterms_subst += nsubst
-                    elif succeeded == "bvor_{}".format(i):
-                        break
-                    nsubst = _substitute_terms (
-                            lambda x: x.children[1].get_subst() \
-                                if x.children[0].get_subst().is_true_bvconst() \
-                                else x.children[0].get_subst(),
-                            lambda x: x.is_bvand() and \
-                                (x.children[0].get_subst().is_true_bvconst() \
-                                 or
-                                 x.children[1].get_subst().is_true_bvconst()),
-                            cmds[i], g_args.bfs, g_args.randomized,
-                            "  substitute (bvand term true) with term")
-                    if nsubst:
-                        succeeded = "bvand_{}".format(i)
-                        nsubst_round += nsubst
-                        nterms_subst += nsubst
-                    elif succeeded == "bvand_{}".format(i):
-                        break
-                    nsubst = _substitute_terms (
-                            lambda x: sf.add_fresh_declfunCmdNode(x.sort),
-                            lambda x: not x.is_const()                   \
-                                      and x.sort and x.sort.is_bv_sort() \
-                                      and not sf.is_substvar(x),
-                            cmds[i], g_args.bfs, g_args.randomized,
-                            "  substitute BV terms with fresh variables",
-                            True)
-                    if nsubst:
-                        succeeded = "bvvar_{}".format(i)
-                        nsubst_round += nsubst
-                        nterms_subst += nsubst
-                    elif succeeded == "bvvar_{}".format(i):
-                        break
-                    nsubst = _substitute_terms (
-                            lambda x: x.children[0].get_subst(),
-                            lambda x: x.is_bvshift(),
-                            cmds[i], g_args.bfs, g_args.randomized,
-                            "  substitute (bv(shl|lshr|ashr) term shift) "\
-                            "with term")
-                    if nsubst:
-                        succeeded = "bvshift_{}".format(i)
-                        nsubst_round += nsubst
-                        nterms_subst += nsubst
-                    elif succeeded == "bvshift_{}".format(i):
-                        break
-
-                ### Int substitutions
-                if sf.is_int_logic() or sf.is_real_logic():
-                    nsubst = _substitute_terms (
-                            lambda x: sf.zeroConstNNode(),
-                            lambda x: not x.is_const() \
-                                      and x.sort and x.sort.is_int_sort(),
-                            cmds[i], g_args.bfs, g_args.randomized,
-                            "  substitute Int terms with '0'")
-                    if nsubst:
-                        succeeded = "int0_{}".format(i)
-                        nsubst_round += nsubst
-                        nterms_subst += nsubst
-                    elif succeeded == "int0_{}".format(i):
-                        break
-                    nsubst = _substitute_terms (
-                            lambda x: sf.add_fresh_declfunCmdNode(x.sort),
-                            lambda x: not x.is_const()                    \
-                                      and x.sort and x.sort.is_int_sort() \
-                                      and not sf.is_substvar(x),
-                            cmds[i], g_args.bfs, g_args.randomized,
-                            "  substitute Int terms with fresh variables",
-                            True)
-                    if nsubst:
-                        succeeded = "intvar_{}".format(i)
-                        nsubst_round += nsubst
-                        nterms_subst += nsubst
-                    elif succeeded == "intvar_{}".format(i):
-                        break
-
-                ### Real substitutions
-                if sf.is_real_logic():
-                    nsubst = _substitute_terms (
-                            lambda x: sf.zeroConstDNode(),
-                            lambda x: not x.is_const() \
-                                      and x.sort and x.sort.is_real_sort(),
-                            cmds[i], g_args.bfs, g_args.randomized,
-                            "  substitute Real terms with '0'")
-                    if nsubst:
-                        succeeded = "real0_{}".format(i)
-                        nsubst_round += nsubst
-                        nterms_subst += nsubst
-                    elif succeeded == "real0_{}".format(i):
-                        break
-                    nsubst = _substitute_terms (
-                            lambda x: sf.add_fresh_declfunCmdNode(x.sort),
-                            lambda x: not x.is_const()                     \
-                                      and x.sort and x.sort.is_real_sort() \
-                                      and not sf.is_substvar(x),
-                            cmds[i], g_args.bfs, g_args.randomized,
-                            "  substitute Real terms with fresh variables",
-                            True)
-                    if nsubst:
-                        succeeded = "realvar_{}".format(i)
-                        nsubst_round += nsubst
-                        nterms_subst += nsubst
-                    elif succeeded == "realvar_{}".format(i):
-                        break
-
-                ### Core substitutions
-                nsubst = _substitute_terms (
-                        lambda x: x.children[-1].get_subst(),
-                        lambda x: x.is_let(),
-                        cmds[i], g_args.bfs, g_args.randomized,
-                        "  substitute LETs with child term")
-                if nsubst:
-                    succeeded = "let_{}".format(i)
-                    nsubst_round += nsubst
-                    nterms_subst += nsubst
-                elif succeeded == "let_{}".format(i):
-                    break
-
-                nsubst = _substitute_terms (
-                        lambda x: None,
-                        lambda x: x.is_varb() and x.children[0].is_subst(),
-                        cmds[i], g_args.bfs, g_args.randomized,
-                        "  eliminate redundant variable bindings")
-                if nsubst:
-                    succeeded = "varb_{}".format(i)
-                    nsubst_round += nsubst
-                    nterms_subst += nsubst
-                elif succeeded == "varb_{}".format(i):
-                    break
-
-                nsubst = _substitute_terms (
-                        lambda x: sf.boolConstNode("false"),
-                        lambda x: not x.is_const() \
-                                  and x.sort and x.sort.is_bool_sort(),
-                        cmds[i], g_args.bfs, g_args.randomized,
-                        "  substitute Boolean terms with 'false'")
-                if nsubst:
-                    succeeded = "false_{}".format(i)
-                    nsubst_round += nsubst
-                    nterms_subst += nsubst
-                elif succeeded == "false_{}".format(i):
-                    break
+       :return: List of DDSMTPass.
+    """
+    assert (g_reducer.smtformula)
+    sf = g_reducer.smtformula
+
+    passes = [
+        DDSMTPass ("scopes", "scopes", lambda nrounds:
+            _substitute_scopes (g_reducer.args.bfs,
+                                g_reducer.args.randomized)),
+        DDSMTPass ("asserts", "cmds", lambda nrounds:
+            _substitute_cmds (g_reducer.args.bfs, g_reducer.args.randomized,
+                              lambda x: x.is_assert())),
+        DDSMTPass ("cmds", "cmds", lambda nrounds:
+            _substitute_cmds (g_reducer.args.bfs, g_reducer.args.randomized))
+    ]
+    # initially, eliminate asserts only
+    # -> prevent lots of likely unsuccessful testing when eliminating
+    #    e.g. declare-funs previous to term substitution
+    passes[-1].skip = 1
+
+    terms = []
+    ### BV substitutions
+    if sf.is_bv_logic():
+        terms.extend([
+            ("bv0",
+             lambda x: sf.bvZeroConstNode(x.sort),
+             lambda x: not x.is_const() and x.sort and x.sort.is_bv_sort(),
+             "  substitute BV terms with '0'",
+             None, "BitVec"),
+            ("bvor",
+             lambda x: x.children[1].get_subst() \
+                 if x.children[0].get_subst().is_false_bvconst() \
+                 else x.children[0].get_subst(),
+             lambda x: x.is_bvor() and \
+                 (x.children[0].get_subst().is_false_bvconst() \
+                  or
+                  x.children[1].get_subst().is_false_bvconst()),
+             "  substitute (bvor term false) with term",
+             [KIND_BVOR], None),
+            ("bvand",
+             lambda x: x.children[1].get_subst() \
+                 if x.children[0].get_subst().is_true_bvconst() \
+                 else x.children[0].get_subst(),
+             lambda x: x.is_bvand() and \
+                 (x.children[0].get_subst().is_true_bvconst() \
+                  or
+                  x.children[1].get_subst().is_true_bvconst()),
+             "  substitute (bvand term true) with term",
+             [KIND_BVAND], None),
+            ("bvvar",
+             lambda x: sf.add_fresh_declfunCmdNode(x.sort),
+             lambda x: not x.is_const()                   \
+                       and x.sort and x.sort.is_bv_sort() \
+                       and not sf.is_substvar(x),
+             "  substitute BV terms with fresh variables",
+             None, "BitVec"),
+            ("bvshift",
+             lambda x: x.children[0].get_subst(),
+             lambda x: x.is_bvshift(),
+             "  substitute (bv(shl|lshr|ashr) term shift) with term",
+             [KIND_BVSHL, KIND_BVLSHR, KIND_BVASHR], None)])
+
+    ### Int substitutions
+    if sf.is_int_logic() or sf.is_real_logic():
+        terms.extend([
+            ("int0",
+             lambda x: sf.zeroConstNNode(),
+             lambda x: not x.is_const() and x.sort and x.sort.is_int_sort(),
+             "  substitute Int terms with '0'",
+             None, "Int"),
+            ("intvar",
+             lambda x: sf.add_fresh_declfunCmdNode(x.sort),
+             lambda x: not x.is_const()                    \
+                       and x.sort and x.sort.is_int_sort() \
+                       and not sf.is_substvar(x),
+             "  substitute Int terms with fresh variables",
+             None, "Int")])
+
+    ### Real substitutions
+    if sf.is_real_logic():
+        terms.extend([
+            ("real0",
+             lambda x: sf.zeroConstDNode(),
+             lambda x: not x.is_const() and x.sort and x.sort.is_real_sort(),
+             "  substitute Real terms with '0'",
+             None, "Real"),
+            ("realvar",
+             lambda x: sf.add_fresh_declfunCmdNode(x.sort),
+             lambda x: not x.is_const()                     \
+                       and x.sort and x.sort.is_real_sort() \
+                       and not sf.is_substvar(x),
+             "  substitute Real terms with fresh variables",
+             None, "Real")])
+
+    ### Core substitutions
+    terms.extend([
+        ("let",
+         lambda x: x.children[-1].get_subst(),
+         lambda x: x.is_let(),
+         "  substitute LETs with child term",
+         [KIND_LET], None),
+        ("varb",
+         lambda x: None,
+         lambda x: x.is_varb() and x.children[0].is_subst(),
+         "  eliminate redundant variable bindings",
+         [KIND_VARB], None),
+        ("false",
+         lambda x: sf.boolConstNode("false"),
+         lambda x: not x.is_const() and x.sort and x.sort.is_bool_sort(),
+         "  substitute Boolean terms with 'false'",
+         None, "Bool"),
+        ("or",
+         lambda x: x.children[1].get_subst() \
+             if x.children[0].get_subst().is_false_const() \
+             else x.children[0].get_subst(),
+         lambda x: x.is_or() \
+             and (x.children[0].get_subst().is_false_const()\
+             or x.children[1].get_subst().is_false_const()),
+         "  substitute (or term false) with term",
+         [KIND_OR], None),
+        ("true",
+         lambda x: sf.boolConstNode("true"),
+         lambda x: not x.is_const() and x.sort and x.sort.is_bool_sort(),
+         "  substitute Boolean terms with 'true'",
+         None, "Bool"),
+        ("and",
+         lambda x: x.children[1].get_subst() \
+             if x.children[0].get_subst().is_true_const() \
+             else x.children[0].get_subst(),
+         lambda x: x.is_and() \
+             and (x.children[0].get_subst().is_true_const() \
+             or x.children[1].get_subst().is_true_const()),
+         "  substitute (and term true) with term",
+         [KIND_AND], None),
+        ("boolvar",
+         lambda x: sf.add_fresh_declfunCmdNode(x.sort),
+         lambda x: not x.is_const()                     \
+                   and x.sort and x.sort.is_bool_sort() \
+                   and not sf.is_substvar(x),
+         "  substitute Boolean terms with fresh variables",
+         None, "Bool")])
+    if sf.is_arr_logic():
+        terms.append(
+            ("store",
+             lambda x: x.children[0],  # array
+             lambda x: x.is_write(),
+             "  substitute STOREs with array child",
+             [KIND_STORE], None))
+    terms.extend([
+        ("iteleft",
+         lambda x: x.children[1],  # left child
+         lambda x: x.is_ite(),
+         "  substitute ITE with left child",
+         [KIND_ITE], None),
+        ("iteright",
+         lambda x: x.children[2],  # right child
+         lambda x: x.is_ite(),
+         "  substitute ITE with right child",
+         [KIND_ITE], None)])
+
+    cmds_filters = [(lambda x: x.is_definefun(), "'define-fun'"),
+                    (lambda x: x.is_assert(), "'assert'"),
+                    (lambda x: x.is_getvalue(), "'get-value'")]
+    for (cmds_filter, cmds_msg) in cmds_filters:
+        for (name, subst_fun, filter_fun, msg, kinds, sort) in terms:
+            passes.append(_term_pass (name, cmds_filter, cmds_msg, subst_fun,
+                                      filter_fun, msg, kinds, sort))
+    return passes
 
-                nsubst = _substitute_terms (
-                        lambda x: x.children[1].get_subst() \
-                                if x.children[0].get_subst().is_false_const() \
-                                else x.children[0].get_subst(),
-                        lambda x: x.is_or() \
-                                and (x.children[0].get_subst().is_false_const()\
-                                or x.children[1].get_subst().is_false_const()),
-                        cmds[i], g_args.bfs, g_args.randomized,
-                        "  substitute (or term false) with term")
-                if nsubst:
-                    succeeded = "or_{}".format(i)
-                    nsubst_round += nsubst
-                    nterms_subst += nsubst
-                elif succeeded == "or_{}".format(i):
-                    break
 
-                nsubst = _substitute_terms (
-                        lambda x: sf.boolConstNode("true"),
-                        lambda x: not x.is_const() \
-                                  and x.sort and x.sort.is_bool_sort(),
-                        cmds[i], g_args.bfs, g_args.randomized,
-                        "  substitute Boolean terms with 'true'")
-                if nsubst:
-                    succeeded = "true_{}".format(i)
-                    nsubst_round += nsubst
-                    nterms_subst += nsubst
-                elif succeeded == "true_{}".format(i):
-                    break
+def ddsmt_main ():
+    scheduler = g_reducer.scheduler
 
-                nsubst = _substitute_terms (
-                        lambda x: x.children[1].get_subst() \
-                                if x.children[0].get_subst().is_true_const() \
-                                else x.children[0].get_subst(),
-                        lambda x: x.is_and() \
-                                and (x.children[0].get_subst().is_true_const() \
-                                or x.children[1].get_subst().is_true_const()),
-                        cmds[i], g_args.bfs, g_args.randomized,
-                        "  substitute (and term true) with term")
-                if nsubst:
-                    succeeded = "and_{}".format(i)
-                    nsubst_round += nsubst
-                    nterms_subst += nsubst
-                elif succeeded == "and_{}".format(i):
-                    break
+    while not scheduler.done():
+        if scheduler.pos >= len(scheduler.due):
+            scheduler.next_round()
 
-                nsubst = _substitute_terms (
-                        lambda x: sf.add_fresh_declfunCmdNode(x.sort),
-                        lambda x: not x.is_const()                   \
-                                  and x.sort and x.sort.is_bool_sort() \
-                                  and not sf.is_substvar(x),
-                        cmds[i], g_args.bfs, g_args.randomized,
-                        "  substitute Boolean terms with fresh variables",
-                        True)
-                if nsubst:
-                    succeeded = "boolvar_{}".format(i)
-                    nsubst_round += nsubst
-                    nterms_subst += nsubst
-                elif succeeded == "boolvar_{}".format(i):
-                    break
+        while scheduler.pos < len(scheduler.due) and not scheduler.done():
+            scheduler.run(scheduler.due[scheduler.pos], scheduler.nrounds)
+            scheduler.pos += 1
+            _checkpoint ()
+        scheduler.pos = len(scheduler.due)
 
-                if sf.is_arr_logic():
-                    nsubst = _substitute_terms (
-                            lambda x: x.children[0],  # array
-                            lambda x: x.is_write(),
-                            cmds[i], g_args.bfs, g_args.randomized,
-                            "  substitute STOREs with array child")
-                    if nsubst:
-                        succeeded = "store_{}".format(i)
-                        nsubst_round += nsubst
-                        nterms_subst += nsubst
-                    elif succeeded == "store_{}".format(i):
-                        break
-
-                nsubst = _substitute_terms (
-                        lambda x: x.children[1],  # left child
-                        lambda x: x.is_ite(),
-                        cmds[i], g_args.bfs, g_args.randomized,
-                        "  substitute ITE with left child")
-                if nsubst:
-                    succeeded = "iteleft_{}".format(i)
-                    nsubst_round += nsubst
-                    nterms_subst += nsubst
-                elif succeeded == "iteleft_{}".format(i):
-                    break
-                nsubst = _substitute_terms (
-                        lambda x: x.children[2],  # right child
-                        lambda x: x.is_ite(),
-                        cmds[i], g_args.bfs, g_args.randomized,
-                        "  substitute ITE with right child")
-                if nsubst:
-                    succeeded = "iteright_{}".format(i)
-                    nsubst_round += nsubst
-                    nterms_subst += nsubst
-                elif succeeded == "iteright_{}".format(i):
-                    break
+        if not g_reducer.args.timeout:
+            _log (2, "round {}: {}".format(scheduler.nrounds,
+                                           g_reducer.timeouts))
+    _checkpoint (force = True)
 
-        nsubst_total += nsubst_round
+    nrounds = scheduler.nrounds
+    nsubst = scheduler.nsubst
+    nsubst_total = sum(nsubst.values())
 
     _log (1)
-    _log (2, "total testing time: {0: .2f}".format(g_testtime))
+    _log (2, "total testing time: {0: .2f}".format(g_reducer.testtime))
+    _log (2, "total solver cpu time: {0: .2f}".format(g_reducer.testcputime))
+    _log (2, "solver peak memory: {0: .1f} MiB".format(g_reducer.testmaxrss))
+    if g_reducer.nleaked:
+        _log (1, "leaked processes: {} (killed)".format(g_reducer.nleaked))
     _log (1, "rounds total: {}".format(nrounds))
-    _log (1, "tests  total: {}".format(g_ntests))
+    _log (1, "tests  total: {}".format(g_reducer.ntests))
+    _log (1, "cache  hits:  {} (misses: {})".format(
+        g_reducer.cache.hits, g_reducer.cache.misses))
+    if g_reducer.sessions:
+        _log (2, "session tests: {} (processes started: {})".format(
+            sum([s.ntests for s in g_reducer.sessions.values()]),
+            sum([s.nstarts for s in g_reducer.sessions.values()])))
+    if g_reducer.args.jobs > 1:
+        _log (2, "tests  stale: {}".format(g_reducer.nstale))
     _log (1, "substs total: {}".format(nsubst_total))
     _log (1)
-    _log (1, "scopes substituted: {}".format(nscopes_subst))
-    _log (1, "cmds   substituted: {}".format(ncmds_subst))
-    _log (1, "terms  substituted: {}".format(nterms_subst))
+    _log (1, "scopes substituted: {}".format(nsubst["scopes"]))
+    _log (1, "cmds   substituted: {}".format(nsubst["cmds"]))
+    _log (1, "terms  substituted: {}".format(nsubst["terms"]))
+    _log (2)
+    for p in scheduler.passes:
+        if p.nruns:
+            _log (2, "pass {:<24} runs: {}, tests: {}, time: {:.2f}, " \
+                     "substituted: {}".format(p.name, p.nruns, p.ntests,
+                  p.testtime, p.nsubst))
+
+    return nsubst_total
+
+def _argparser ():
+    """_argparser()
+
+       Create the parser for the command line options (which also provides
+       the defaults for the options of reduce).
+
+       :return: An ArgumentParser.
+    """
+    usage="ddsmt.py [<options>] <infile> <outfile> <cmd> [<cmd options>]"
+    aparser = ArgumentParser (usage=usage)
+    aparser.add_argument ("infile",
+                          help="the input file (in SMT-LIB v2 format)")
+    aparser.add_argument ("outfile",
+                          help="the output file")
+    aparser.add_argument ("cmd", nargs=REMAINDER,
+                          help="the command (with optional arguments)")
+
+    aparser.add_argument ("-r", action="store_true", dest="randomized",
+                          default=False,
+                          help="randomize substitution subsets")
+    aparser.add_argument ("-b", action="store_true", dest="bfs",\
+                          default=False,
+                          help="search for terms in breadth-first order ")
+    aparser.add_argument ("--ddmin", action="store_true",
+                          dest="ddmin", default=False,
+                          help="reduce with complement testing (keep "\
+                               "only one subset, substitute all others) "\
+                               "and restart granularity after a success "\
+                               "(ddmin)")
+    aparser.add_argument ("--fixed-order", action="store_true",
+                          dest="fixed_order", default=False,
+                          help="run substitution passes in fixed order "\
+                               "rather than ordered by their yield")
+    aparser.add_argument ("--max-skip", type=int, dest="max_skip",
+                          default=4, metavar="val",
+                          help="skip unproductive substitution passes "\
+                               "for at most given number of rounds "\
+                               "(default: 4)")
+    aparser.add_argument ("--hdd", action="store_true", dest="hdd",
+                          default=False,
+                          help="substitute terms level by level from "\
+                               "the roots downwards (hierarchical delta "\
+                               "debugging)")
+    aparser.add_argument ("-t", dest="timeout", metavar="val",\
+                          default=None, type=float, \
+                          help="absolute: timeout for test runs in "\
+                               "seconds. relative: timeout is [val] "\
+                               " seconds longer than golden runtime. " \
+                               "dynamic: timeout is [val] seconds longer "\
+                               "than most recent successful test. "\
+                               "(default: absolute. When timeout is "\
+                               "unspecified, it is adapted to the "\
+                               "runtimes of successful tests: mean "\
+                               "plus 4 standard deviations, at least "\
+                               "1.5 * mean + 0.5 seconds.)")
+    aparser.add_argument ("--memlimit", dest="memlimit", metavar="val",
+                          default=None, type=int,
+                          help="limit the address space of test runs "\
+                               "to [val] MiB")
+    aparser.add_argument ("--cpulimit", dest="cpulimit", metavar="val",
+                          default=None, type=float,
+                          help="limit the cpu time of test runs to [val] "\
+                               "seconds (test runs that exceed it are "\
+                               "handled as timeouts)")
+    aparser.add_argument ("--golden-runs", dest="golden_runs",
+                          metavar="val", default=1, type=int,
+                          help="number of initial runs to sample the "\
+                               "runtime of the input file (default: 1)")
+    timeout_group = aparser.add_mutually_exclusive_group()
+    timeout_group.add_argument ("--rel", action="store_true",
+                          dest="timeout_relative", default=False, \
+                          help="timeouts are relative to \
+                                test time of input file")
+    timeout_group.add_argument ("--dyn", action="store_true",
+                          dest="timeout_dynamic", default=False,
+                          help="timeouts are relative to the runtime of"\
+                               "the most recent successful test")
+    aparser.add_argument ("--round", dest="roundtime", metavar = "val",
+                          default=None, type=float, help="approximate time"\
+                               " limit for testing rounds in seconds")
+    aparser.add_argument ("-j", dest="jobs", metavar="val",
+                          default=1, type=int,
+                          help="number of tests to run in parallel "\
+                               "(default: 1)")
+    aparser.add_argument ("--jobserver", dest="jobserver",
+                          metavar="r,w", default=None,
+                          help="file descriptors of the read and write "\
+                               "end of a jobserver pipe that limits the "\
+                               "number of tests run in parallel by "\
+                               "several instances of ddSMT (see "\
+                               "ddsmtbatch.py)")
+    aparser.add_argument ("--speculate", action="store_true",
+                          dest="speculate", default=False,
+                          help="start testing the next subset while "\
+                               "the current one is tested, assuming "\
+                               "that it fails (implies -j 2 if no "\
+                               "more jobs are given)")
+    aparser.add_argument ("--cache", dest="cachedir", metavar="dir",
+                          default=None,
+                          help="additionally store test results on disk "\
+                               "in given directory (for reuse in "\
+                               "subsequent runs)")
+    aparser.add_argument ("--parse-cache", dest="parse_cache",
+                          metavar="dir", default=None,
+                          help="store the parsed input formula in given "\
+                               "directory and load it from there in "\
+                               "subsequent runs on the same input (the "\
+                               "directory must be trusted: owned by the "\
+                               "user and not writable by others)")
+    aparser.add_argument ("--share-terms", action="store_true",
+                          dest="share_terms", default=False,
+                          help="represent structurally equal function "\
+                               "applications (within the same scope) "\
+                               "by a single node while parsing (a "\
+                               "substitution of a shared term applies "\
+                               "to all of its occurrences)")
+    aparser.add_argument ("--checkpoint", dest="checkpoint",
+                          metavar="file", default=None,
+                          help="periodically save the state of the "\
+                               "reduction to given file (to be resumed "\
+                               "via --resume)")
+    aparser.add_argument ("--checkpoint-interval",
+                          dest="checkpoint_interval", metavar="val",
+                          default=300, type=float,
+                          help="minimum time between checkpoints in "\
+                               "seconds (default: 300)")
+    aparser.add_argument ("--resume", dest="resume", metavar="file",
+                          default=None,
+                          help="resume the reduction from given "\
+                               "checkpoint (further checkpoints are "\
+                               "written to the same file unless "\
+                               "--checkpoint is given)")
+    aparser.add_argument ("--delivery", dest="delivery", default="file",
+                          choices=["file", "stdin", "memfd"],
+                          help="pass candidates to the solver via "\
+                               "temporary file, stdin, or in-memory "\
+                               "file /proc/self/fd/<fd> (default: file)")
+    aparser.add_argument ("--session", dest="session", default=None,
+                          choices=["push", "reset"],
+                          help="keep the solver alive and pass "\
+                               "candidates via stdin, separated by "\
+                               "(push 1)/(pop 1) or (reset); candidates "\
+                               "that reproduce the failure are confirmed "\
+                               "by a fresh process (requires a search "\
+                               "pattern, disabled after 3 consecutive "\
+                               "crashes or timeouts)")
+    aparser.add_argument ("--session-args", dest="session_args",
+                          metavar="args", default="",
+                          help="additional command line options for "\
+                               "the solver in session mode (e.g., "\
+                               "to read from stdin)")
+    aparser.add_argument ("-v", action="count", default=0,
+                          dest="verbosity", help="increase verbosity")
+    aparser.add_argument ("-o", dest="cmpoutput",
+                          help = "use exit code and search pattern string "\
+                                 "to identify failing input (default: "\
+                                 "error exit code and stderr output)")
+    aparser.add_argument ("--early-kill", action="store_true",
+                          dest="early_kill", default=False,
+                          help="terminate the solver as soon as the "\
+                               "search pattern appears in its output "\
+                               "(ignores the exit code of the solver)")
+    aparser.add_argument ("--version", action="version",
+                          version=__version__)
+    return aparser
+
+
+def _check_args (args):
+    """_check_args(args)
+
+       Check the given options and normalize them.
+
+       :args: The options (as returned by _argparser).
+    """
+    if args.jobs < 1:
+        raise DDSMTException ("number of jobs must be at least 1")
+    if args.golden_runs < 1:
+        raise DDSMTException ("number of initial runs must be at least 1")
+    if args.memlimit != None and args.memlimit <= 0:
+        raise DDSMTException ("memory limit must be positive")
+    if args.cpulimit != None and args.cpulimit <= 0:
+        raise DDSMTException ("cpu limit must be positive")
+    if (args.memlimit or args.cpulimit) and not hasattr(resource, "prlimit"):
+        raise DDSMTException ("memory and cpu limits are not supported on "\
+                              "this platform")
+    if args.checkpoint_interval < 0:
+        raise DDSMTException ("checkpoint interval must not be negative")
+    if args.resume and not args.checkpoint:
+        args.checkpoint = args.resume
+    if args.speculate and args.jobs == 1:
+        # one speculative test in flight, decided in order
+        # (see _substitute_parallel)
+        args.jobs = 2
+    if isinstance(args.session_args, str):
+        args.session_args = args.session_args.split()
+    if args.delivery == "memfd" and not hasattr(os, "memfd_create"):
+        raise DDSMTException ("memfd not supported on this platform")
+
+
+def _prepare (data, state = None):
+    """_prepare(data, state)
+
+       Determine the behavior to preserve by running the command (or calling
+       the oracle) on the input (golden run), or restore it from given
+       checkpoint, and set up the test cache and the scheduler.
+
+       :data:  The input formula (bytes).
+       :state: The checkpoint to resume from (None to start from scratch).
+    """
+    args = g_reducer.args
+    _log (1)
+    if state:
+        _log (1, "resuming from checkpoint '{}'".format(args.resume))
+        _resume (state)
+    else:
+        _log (1, "starting initial run... ")
+        for i in range(args.golden_runs):
+            if g_reducer.oracle:
+                start = time.time()
+                (exitcode, out, err) = (0 if _oracle(data) else 1, b"", b"")
+                g_reducer.golden_runtime = time.time() - start
+            else:
+                cmd = _cmd(0, data)
+                (exitcode, out, err) = _run(True, cmd)
+            # runs only have to agree in the behavior to preserve, i.e., the
+            # exit code and the match of the search pattern (if given, the
+            # error output otherwise)
+            result = (exitcode, _match(out, err) \
+                    if args.cmpoutput != None else err)
+            if i > 0 and result != golden:
+                raise DDSMTException ("initial runs differ in exit code or "\
+                        "{}".format("search pattern match" \
+                            if args.cmpoutput != None else "error output"))
+            golden = result
+            (g_reducer.golden_exit, g_reducer.golden_err) = (exitcode, err)
+            g_reducer.timeouts.sample(
+                    g_reducer.golden_runtime, len(data), True)
+        g_reducer.golden_runtime = g_reducer.timeouts.stats[True][1]
+    if g_reducer.oracle and g_reducer.golden_exit != 0:
+        raise DDSMTException ("oracle does not hold for the input formula")
+    if args.cmpoutput == None:
+        args.cmpoutput = g_reducer.golden_err.decode()
+    _log (1, "golden exit: {}".format(g_reducer.golden_exit))
+    if args.cmpoutput:
+        _log (1, "golden err: {}".format(args.cmpoutput))
+    _log (1, "golden runtime: {0: .2f} seconds".format(
+        g_reducer.golden_runtime))
+    if not state and not g_reducer.oracle:
+        _log (2, "golden cpu time: {0: .2f} seconds".format(cmd.cputime()))
+        _log (2, "golden memory: {0: .1f} MiB".format(cmd.maxrss()))
+    if not args.timeout:
+        _log (2, "golden {}".format(g_reducer.timeouts))
+    if args.early_kill and not args.cmpoutput:
+        raise DDSMTException ("option --early-kill requires a search "\
+                              "pattern")
+    if args.session and not args.cmpoutput:
+        # any output matches the empty pattern, all candidates would be
+        # tested in a fresh process anyway
+        _log (1, "session mode disabled (no search pattern)")
+        args.session = None
+
+    # test results are identified by the binary, its options, the search
+    # pattern and the candidate
+    if g_reducer.oracle:
+        cache_prefix = b"oracle\0"
+    else:
+        with open(g_tmpbin, 'rb') as binfile:
+            cache_prefix = hashlib.sha256(binfile.read()).digest()
+        cache_prefix += "\0".join(args.cmd[1:] + \
+                [args.delivery, args.cmpoutput, ""]).encode()
+        if args.early_kill:
+            cache_prefix += b"early-kill\0"
+    g_reducer.cache = DDSMTCache (cache_prefix, args.cachedir)
+
+    g_reducer.scheduler = DDSMTScheduler (_passes(), args.fixed_order,
+                                          args.max_skip)
+    if state:
+        _resume_reduction (state)
+        _output (_dumps())
+    g_reducer.checkpoint_time = time.time()
+
+
+def _activate (smtformula):
+    # the nodes of a formula refer to it via class attributes, see
+    # DDSMTParser.parse
+    prev = SMTNode.g_smtformula
+    SMTNode.g_smtformula = smtformula
+    SMTCmdNode.g_smtformula = smtformula
+    SMTScopeNode.g_smtformula = smtformula
+    return prev
+
+
+def _parse (filename, data):
+    """_parse(filename, data)
+
+       Parse given input file. With a parse cache (option --parse-cache),
+       the formula is loaded from the cache if the same input was parsed
+       before (by the same parser, with the same --share-terms setting), and
+       stored in the cache otherwise. Formulas are unpickled when loaded,
+       which may execute arbitrary code, the cache is therefore trusted
+       and must be a directory of the user that is not writable by others
+       (it is created with mode 0700). Cache files that cannot be loaded are
+       ignored (the input is parsed).
+
+       :filename: The input file.
+       :data:     The contents of the input file (bytes).
+       :return:   The formula.
+    """
+    args = g_reducer.args
+    if not args.parse_cache:
+        return _report_shared (DDSMTParser(args.share_terms).parse(filename))
+    try:
+        os.makedirs(args.parse_cache, mode = 0o700, exist_ok = True)
+        st = os.stat(args.parse_cache)
+    except OSError as e:
+        raise DDSMTException (str(e))
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        raise DDSMTException ("parse cache '{}' is not owned by the current "\
+                              "user or writable by others".format(
+                                  args.parse_cache))
+    h = hashlib.sha256(data)
+    for module in (smtparser, ddsmtparser):
+        h.update(_read(module.__file__))
+    h.update(b"share-terms" if args.share_terms else b"")
+    path = os.path.join(args.parse_cache, h.hexdigest() + ".formula")
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as infile:
+                smtformula = SMTFormula.load(infile)
+            _activate (smtformula)
+            _log (1, "parser: loaded '{}'".format(path))
+            return _report_shared (smtformula)
+        except (IOError, DDSMTParseCheckException, pickle.UnpicklingError,
+                EOFError, AttributeError, ValueError):
+            _log (1, "parser: unable to load '{}', parsing input".format(
+                path))
+    smtformula = DDSMTParser(args.share_terms).parse(filename)
+    tmppath = "{}.{}".format(path, os.getpid())
+    try:
+        with open(tmppath, 'wb') as outfile:
+            smtformula.save(outfile)
+        os.rename(tmppath, path)
+    except IOError as e:
+        raise DDSMTException (str(e))
+    _log (2, "parser: saved '{}'".format(path))
+    return _report_shared (smtformula)
+
+
+def _report_shared (smtformula):
+    if g_reducer.args.share_terms:
+        _log (1, "parser: {} function application(s) shared".format(
+            smtformula.nshared))
+    return smtformula
+
+
+def reduce (formula, oracle, outfile = None, **options):
+    """reduce(formula, oracle, outfile, **options)
+
+       Reduce given formula in-process: candidates are tested by calling
+       given oracle, a Python function that decides whether a candidate (an
+       SMT-LIB v2 string) still exhibits the behavior of interest, rather
+       than by running a command. With more than one job (option jobs), the
+       oracle is called concurrently from several threads.
+
+       The reduction uses its own reducer (see DDSMTReducer), reductions can
+       thus be run one after the other in one process. This function is not
+       reentrant, since the reducer (and the formula) are activated in module
+       state: calling it while another reduction is running (in another
+       thread, or from the oracle) raises a DDSMTException.
+
+       :formula: The input formula, either the name of a file in SMT-LIB v2
+                 format or a formula as returned by DDSMTParser.parse.
+       :oracle:  Function that takes a candidate and returns True if it
+                 exhibits the behavior of interest (and False otherwise).
+       :outfile: The output file, written whenever a reduction was
+                 successful (None to not write an output file).
+       :options: Command line options, named as the corresponding attributes
+                 of the parsed command line (e.g., jobs = 4, ddmin = True).
+                 Options that only apply to commands (e.g., timeouts, search
+                 patterns, solver sessions) are not supported.
+       :return:  The reduced formula (SMT-LIB v2 string).
+    """
+    global g_reducer
+    args = _argparser().parse_args(["", ""])
+    cmd_options = ("timeout", "timeout_relative", "timeout_dynamic",
+                   "memlimit", "cpulimit", "cmpoutput", "early_kill",
+                   "cachedir", "delivery", "session", "session_args",
+                   "jobserver")
+    for name, value in options.items():
+        if name in ("infile", "outfile", "cmd") or not hasattr(args, name):
+            raise DDSMTException ("unknown option '{}'".format(name))
+        if name in cmd_options and value != getattr(args, name):
+            raise DDSMTException (
+                    "option '{}' requires a command".format(name))
+        setattr(args, name, value)
+    args.infile = formula if isinstance(formula, str) else None
+    args.outfile = outfile
+    _check_args (args)
+
+    if not g_reducer_lock.acquire(blocking = False):
+        raise DDSMTException ("reduce() called during another reduction")
+    prev_reducer = g_reducer
+    prev_formula = _activate (None)
+    g_reducer = DDSMTReducer (args, None, oracle)
+    try:
+        if args.infile:
+            if not os.path.isfile(args.infile):
+                raise DDSMTException ("given input file does not exist")
+            data = _read(args.infile)
+            smtformula = _parse(args.infile, data)
+        else:
+            smtformula = formula
+            _activate (smtformula)
+            data = smtformula.dumps().encode()
+        g_reducer.smtformula = smtformula
+        args.input_hash = hashlib.sha256(data).hexdigest()
+        state = _read_checkpoint(args.resume) if args.resume else None
+        _prepare (data, state)
+        ddsmt_main ()
+        return smtformula.dumps()
+    finally:
+        _cleanup ()
+        g_reducer = prev_reducer
+        _activate (prev_formula)
+        g_reducer_lock.release()
 
-    if nsubst_total == 0:
-        sys.exit ("[ddsmt] unable to reduce input file")
 
 if __name__ == "__main__":
+    # clean up (kill running tests) on SIGTERM as on SIGINT
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     try:
-        usage="ddsmt.py [<options>] <infile> <outfile> <cmd> [<cmd options>]"
-        aparser = ArgumentParser (usage=usage)
-        aparser.add_argument ("infile",
-                              help="the input file (in SMT-LIB v2 format)")
-        aparser.add_argument ("outfile",
-                              help="the output file")
-        aparser.add_argument ("cmd", nargs=REMAINDER,
-                              help="the command (with optional arguments)")
-
-        aparser.add_argument ("-r", action="store_true", dest="randomized",
-                              default=False,
-                              help="randomize substitution subsets")
-        aparser.add_argument ("-b", action="store_true", dest="bfs",\
-                              default=False,
-                              help="search for terms in breadth-first order ")
-        aparser.add_argument ("-t", dest="timeout", metavar="val",\
-                              default=None, type=float, \
-                              help="absolute: timeout for test runs in "\
-                                   "seconds. relative: timeout is [val] "\
-                                   " seconds longer than golden runtime. " \
-                                   "dynamic: timeout is [val] seconds longer "\
-                                   "than most recent successful test. "\
-                                   "(default: absolute. When timeout is "\
-                                   "unspecified, default is " \
-                                   "1.5 * golden runtime.)")
-        timeout_group = aparser.add_mutually_exclusive_group()
-        timeout_group.add_argument ("--rel", action="store_true",
-                              dest="timeout_relative", default=False, \
-                              help="timeouts are relative to \
-                                    test time of input file")
-        timeout_group.add_argument ("--dyn", action="store_true",
-                              dest="timeout_dynamic", default=False,
-                              help="timeouts are relative to the runtime of"\
-                                   "the most recent successful test")
-        aparser.add_argument ("--round", dest="roundtime", metavar = "val",
-                              default=None, type=float, help="approximate time"\
-                                   " limit for testing rounds in seconds")
-        aparser.add_argument ("-v", action="count", default=0,
-                              dest="verbosity", help="increase verbosity")
-        aparser.add_argument ("-o", dest="cmpoutput",
-                              help = "use exit code and search pattern string "\
-                                     "to identify failing input (default: "\
-                                     "error exit code and stderr output)")
-        aparser.add_argument ("--version", action="version",
-                              version=__version__)
-        g_args = aparser.parse_args()
+        g_reducer = DDSMTReducer (_argparser().parse_args(), None)
+        args = g_reducer.args
 
 ## TODO profile debug
-#        g_args.infile = "trash/testcase8.stp.smt2"
-#        g_args.infile = "trash/noregions-fullmemite.stp.smt2"
+#        args.infile = "trash/testcase8.stp.smt2"
+#        args.infile = "trash/noregions-fullmemite.stp.smt2"
 
 # TODO profile debug
-#        if not g_args.cmd:  # special handling (nargs=REMAINDER)
+#        if not args.cmd:  # special handling (nargs=REMAINDER)
 #            raise DDSMTException ("too few arguments")
 
-        if not os.path.exists(g_args.infile):
+        if not os.path.exists(args.infile):
             raise DDSMTException ("given input file does not exist")
-        if os.path.isdir(g_args.infile):
+        if os.path.isdir(args.infile):
             raise DDSMTException ("given input file is a directory")
-        #if os.path.exists(g_args.outfile):
+        #if os.path.exists(args.outfile):
         #    raise DDSMTException ("given output file does already exist")
-        if not g_args.cmd:
+        if not args.cmd:
             raise DDSMTException ("command missing")
-
-        _log (1, "input  file: '{}'".format(g_args.infile))
-        _log (1, "output file: '{}'".format(g_args.outfile))
+        _check_args (args)
+        if args.jobserver:
+            try:
+                (rfd, wfd) = [int(fd) for fd in args.jobserver.split(",")]
+                g_jobserver = DDSMTJobserver (rfd, wfd)
+            except (ValueError, OSError):
+                raise DDSMTException ("invalid jobserver '{}'".format(
+                    args.jobserver))
+
+        _log (1, "input  file: '{}'".format(args.infile))
+        _log (1, "output file: '{}'".format(args.outfile))
         _log (1, "command:     '{}'".format(
-            " ".join([str(c) for c in g_args.cmd])))
+            " ".join([str(c) for c in args.cmd])))
 
-        ifilesize = os.path.getsize(g_args.infile)
+        ifilesize = os.path.getsize(args.infile)
+        data = _read(args.infile)
+        args.input_hash = hashlib.sha256(data).hexdigest()
+        state = _read_checkpoint(args.resume) if args.resume else None
 
-        parser = DDSMTParser()
-        g_smtformula = parser.parse(g_args.infile)
+        g_reducer.smtformula = _parse(args.infile, data)
 
         #### debug
-        #to_visit = [g_smtformula.scopes]
+        #to_visit = [g_reducer.smtformula.scopes]
         #while to_visit:
         #    scope = to_visit.pop()
         #    print ("level: {}\ncommands: {}\nsorts: {}\nfuns:{}".format(
@@ -841,30 +2784,25 @@ if __name__ == "__main__":
         _log (3, "parser: maxrss: {} MiB".format(
             resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1000))
 
-        #_dump(g_args.outfile)
+        #_dump(args.outfile)
         #sys.exit(0)
         ######
-        #_dump(g_args.outfile)
+        #_dump(args.outfile)
         #sys.exit(0)
         #######
 
-        shutil.copyfile(g_args.infile, g_tmpfile)
-        shutil.copy(g_args.cmd[0], g_tmpbin)  # make copy of binary
-        g_args.cmd[0] = g_tmpbin              # use copy for _run
-        g_args.cmd.append(g_tmpfile)
-        _log (1)
-        _log (1, "starting initial run... ")
-        (g_golden_exit, out, g_golden_err) = _run(True)
-        if g_args.cmpoutput == None:
-            g_args.cmpoutput = g_golden_err.decode()
-        _log (1, "golden exit: {}".format(g_golden_exit))
-        if g_args.cmpoutput:
-            _log (1, "golden err: {}".format(g_args.cmpoutput))
-        _log (1, "golden runtime: {0: .2f} seconds".format(g_golden_runtime))
+        shutil.copy(args.cmd[0], g_tmpbin)  # make copy of binary
+        for worker in range(1, args.jobs):  # one copy per worker
+            shutil.copy(args.cmd[0], _tmpbin(worker))
+        args.cmd[0] = g_tmpbin              # use copy for _run
 
-        ddsmt_main ()
+        _prepare (data, state)
+
+        if ddsmt_main () == 0:
+            _cleanup()
+            sys.exit ("[ddsmt] unable to reduce input file")
 
-        ofilesize = os.path.getsize(g_args.outfile)
+        ofilesize = os.path.getsize(args.outfile)
 
         _log (1)
         _log (1, "input file size:  {} B (100%)".format(ifilesize))
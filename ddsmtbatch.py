@@ -0,0 +1,360 @@
+#! /usr/bin/env python3
+#
+# ddSMT: A delta debugger for SMT benchmarks in SMT-Lib v2 format.
+# Copyright (C) 2013-2018, Aina Niemetz.
+#
+# This file is part of ddSMT.
+#
+# ddSMT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ddSMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ddSMT.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Batch reduction: reduce all input files of a directory with the same
+# command. Every input file is reduced by its own instance of ddsmt.py, the
+# instances share a pool of job slots via a jobserver pipe (see
+# DDSMTJobserver in ddsmt.py): each running instance occupies one slot, and
+# slots that are not needed to start further instances (e.g., towards the end
+# of the batch) are used by the running instances to test candidates in
+# parallel. Inputs that are identical or reduce to identical output files are
+# reported as duplicates, a summary of all reductions is written to
+# <outdir>/manifest.json.
+
+import hashlib
+import json
+import os
+import signal
+import sys
+import time
+
+from argparse import ArgumentParser, REMAINDER
+from collections import deque
+from subprocess import Popen, DEVNULL, STDOUT, TimeoutExpired
+
+
+__version__ = "1.0"
+__author__  = "Aina Niemetz <aina.niemetz@gmail.com>"
+
+
+g_args = None
+g_ddsmt = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ddsmt.py")
+
+
+class DDSMTBatchException (Exception):
+
+    def __init__ (self, msg):
+        self.msg = msg
+
+    def __str__ (self):
+        return "[ddsmtbatch] Error: {}".format(self.msg)
+
+
+class DDSMTBatchJob ():
+    """DDSMTBatchJob
+
+       Reduction of a single input file by an instance of ddsmt.py.
+    """
+
+    def __init__(self, infile, outdir):
+        name = os.path.basename(infile)
+        self.infile = infile
+        self.outfile = os.path.join(outdir, name)
+        self.logfile = os.path.join(outdir, name + ".log")
+        self.digest = _digest(infile)
+        self.proc = None
+        self.start_time = None
+        self.runtime = None
+        self.exitcode = None
+        self.status = "pending"
+        self.duplicate_of = None
+
+    def start(self, cmd, pass_fds):
+        if os.path.exists(self.outfile):
+            os.remove(self.outfile)
+        with open(self.logfile, 'w') as logfile:
+            self.proc = Popen(cmd, stdin=DEVNULL, stdout=logfile,
+                              stderr=STDOUT, pass_fds=pass_fds)
+        self.start_time = time.time()
+        self.status = "running"
+
+    def poll(self):
+        if self.proc.poll() == None:
+            return False
+        self.runtime = time.time() - self.start_time
+        self.exitcode = self.proc.returncode
+        self.status = "reduced" if self.exitcode == 0 else "failed"
+        return True
+
+    def message(self):
+        try:
+            with open(self.logfile, 'r') as logfile:
+                lines = [l.strip() for l in logfile if l.strip()]
+                return lines[-1] if lines else ""
+        except IOError:
+            return ""
+
+
+def _log (verbosity, msg = ""):
+    global g_args
+    if g_args.verbosity >= verbosity:
+        sys.stdout.write("[ddsmtbatch] {}\n".format(msg))
+        sys.stdout.flush()
+
+
+def _digest (filename):
+    try:
+        with open(filename, 'rb') as infile:
+            return hashlib.sha256(infile.read()).hexdigest()
+    except IOError as e:
+        raise DDSMTBatchException (str(e))
+
+
+def _infiles (path):
+    if not os.path.isdir(path):
+        return [path]
+    return sorted([os.path.join(path, f) for f in os.listdir(path)
+                   if os.path.isfile(os.path.join(path, f)) \
+                      and f.endswith(".smt2")])
+
+
+def _jobserver (njobs):
+    """_jobserver(njobs)
+
+       Create a jobserver pipe that holds one token per job slot.
+
+       :njobs:  Number of job slots.
+       :return: Tuple (read end, write end) of the pipe.
+    """
+    (rfd, wfd) = os.pipe()
+    os.set_blocking(rfd, False)
+    os.write(wfd, b"+" * njobs)
+    return (rfd, wfd)
+
+
+def _acquire (rfd):
+    try:
+        return len(os.read(rfd, 1)) == 1
+    except (BlockingIOError, InterruptedError):
+        return False
+
+
+def _refill (rfd, wfd, njobs):
+    # tokens held by instances that were killed are lost, reset the pipe when
+    # no instance is running
+    while _acquire(rfd):
+        pass
+    os.write(wfd, b"+" * njobs)
+
+
+def _cmd (job, rfd, wfd):
+    global g_args
+    cmd = [sys.executable, g_ddsmt, "-v",
+           "-j", str(g_args.jobs_per_input),
+           "--jobserver", "{},{}".format(rfd, wfd)]
+    if g_args.timeout:
+        cmd.extend(["-t", str(g_args.timeout)])
+    return cmd + g_args.ddsmt_args + [job.infile, job.outfile] + g_args.cmd
+
+
+def _run (jobs):
+    """_run(jobs)
+
+       Run the given reduction jobs (in the given order) on g_args.jobs job
+       slots. A job is started as soon as a slot is free, slots that are not
+       needed to start jobs are used by the running jobs to test candidates
+       in parallel (at most g_args.jobs_per_input at a time).
+
+       :jobs: List of DDSMTBatchJob.
+    """
+    global g_args
+    (rfd, wfd) = _jobserver(g_args.jobs)
+    pending = deque([job for job in jobs if not job.duplicate_of])
+    running = []
+    try:
+        while pending or running:
+            while pending and _acquire(rfd):
+                job = pending.popleft()
+                job.start(_cmd(job, rfd, wfd), (rfd, wfd))
+                running.append(job)
+                _log (2, "started:  {}".format(job.infile))
+            for job in [job for job in running if job.poll()]:
+                running.remove(job)
+                os.write(wfd, b"+")
+                _log (1, "{:<9} {} ({:.2f} seconds){}".format(
+                    job.status + ":", job.infile, job.runtime,
+                    "" if job.status == "reduced" \
+                            else ": " + job.message()))
+            if not running and pending:
+                _refill(rfd, wfd, g_args.jobs)
+            time.sleep(0.05)
+    except KeyboardInterrupt:
+        # instances in the same process group are interrupted as well, give
+        # them some time to clean up before interrupting them explicitly
+        deadline = time.time() + 1
+        for job in running:
+            try:
+                job.proc.wait(max(deadline - time.time(), 0))
+            except TimeoutExpired:
+                job.proc.send_signal(signal.SIGINT)
+                job.proc.wait()
+            job.poll()
+            job.status = "interrupted"
+        raise
+    finally:
+        os.close(rfd)
+        os.close(wfd)
+
+
+def _dedup (jobs):
+    """_dedup(jobs)
+
+       Mark jobs whose input file is identical to the input file of a
+       previous job as duplicates (before reduction).
+
+       :jobs: List of DDSMTBatchJob.
+    """
+    seen = {}
+    for job in jobs:
+        if job.digest in seen:
+            job.duplicate_of = seen[job.digest].infile
+            job.status = "duplicate"
+        else:
+            seen[job.digest] = job
+
+
+def _dedup_outputs (jobs):
+    """_dedup_outputs(jobs)
+
+       Mark jobs whose output file is identical to the output file of a
+       previous job as duplicates and remove their output files (after
+       reduction).
+
+       :jobs: List of DDSMTBatchJob.
+    """
+    seen = {}
+    for job in jobs:
+        if job.duplicate_of or not os.path.exists(job.outfile):
+            continue
+        digest = _digest(job.outfile)
+        if digest in seen:
+            job.duplicate_of = seen[digest].infile
+            job.status = "duplicate"
+            os.remove(job.outfile)
+        else:
+            seen[digest] = job
+
+
+def _manifest (jobs, runtime):
+    """_manifest(jobs, runtime)
+
+       Write a summary of all jobs to <outdir>/manifest.json.
+
+       :jobs:    List of DDSMTBatchJob.
+       :runtime: Total runtime in seconds.
+    """
+    global g_args
+    manifest = {
+        "command": g_args.cmd,
+        "jobs": g_args.jobs,
+        "runtime": runtime,
+        "inputs": [{
+            "input": job.infile,
+            "output": job.outfile if os.path.exists(job.outfile) else None,
+            "log": job.logfile if job.proc else None,
+            "status": job.status,
+            "duplicate_of": job.duplicate_of,
+            "exitcode": job.exitcode,
+            "runtime": job.runtime,
+            "input_size": os.path.getsize(job.infile),
+            "output_size": os.path.getsize(job.outfile) \
+                    if os.path.exists(job.outfile) else None,
+            "message": job.message() \
+                    if job.status in ("failed", "interrupted") else None }
+            for job in jobs] }
+    try:
+        with open(os.path.join(g_args.outdir, "manifest.json"), 'w') \
+                as outfile:
+            json.dump(manifest, outfile, indent = 2)
+    except IOError as e:
+        raise DDSMTBatchException (str(e))
+
+
+if __name__ == "__main__":
+    try:
+        usage="ddsmtbatch.py [<options>] <indir> <outdir> <cmd> " \
+              "[<cmd options>]"
+        aparser = ArgumentParser (usage=usage)
+        aparser.add_argument ("indir",
+                              help="the input directory (all input files in "\
+                                   "SMT-LIB v2 format) or a single input file")
+        aparser.add_argument ("outdir",
+                              help="the output directory (reduced files, "\
+                                   "logs and manifest.json)")
+        aparser.add_argument ("cmd", nargs=REMAINDER,
+                              help="the command (with optional arguments)")
+        aparser.add_argument ("-j", dest="jobs", metavar="val",
+                              default=os.cpu_count() or 1, type=int,
+                              help="number of job slots, i.e., number of "\
+                                   "tests run in parallel in total "\
+                                   "(default: number of cpus)")
+        aparser.add_argument ("--jobs-per-input", dest="jobs_per_input",
+                              metavar="val", default=4, type=int,
+                              help="maximum number of tests run in parallel "\
+                                   "for a single input file (default: 4)")
+        aparser.add_argument ("-t", dest="timeout", metavar="val",
+                              default=None, type=float,
+                              help="timeout for test runs in seconds "\
+                                   "(passed to ddsmt.py)")
+        aparser.add_argument ("--ddsmt-args", dest="ddsmt_args",
+                              metavar="args", default="",
+                              help="additional command line options for "\
+                                   "ddsmt.py")
+        aparser.add_argument ("-v", action="count", default=0,
+                              dest="verbosity", help="increase verbosity")
+        aparser.add_argument ("--version", action="version",
+                              version=__version__)
+        g_args = aparser.parse_args()
+
+        if not os.path.exists(g_args.indir):
+            raise DDSMTBatchException ("given input file (dir) does not exist")
+        if os.path.exists(g_args.outdir) and not os.path.isdir(g_args.outdir):
+            raise DDSMTBatchException ("given output dir is a file")
+        if not g_args.cmd:
+            raise DDSMTBatchException ("command missing")
+        if g_args.jobs < 1 or g_args.jobs_per_input < 1:
+            raise DDSMTBatchException ("number of jobs must be at least 1")
+        g_args.ddsmt_args = g_args.ddsmt_args.split()
+        os.makedirs(g_args.outdir, exist_ok = True)
+
+        start = time.time()
+        jobs = [DDSMTBatchJob (infile, g_args.outdir)
+                for infile in _infiles(g_args.indir)]
+        _dedup (jobs)
+        _log (1, "input files: {} ({} duplicate(s))".format(
+            len(jobs), sum([1 for job in jobs if job.duplicate_of])))
+        _log (1, "job slots:   {}".format(g_args.jobs))
+        try:
+            _run (jobs)
+        finally:
+            _dedup_outputs (jobs)
+            _manifest (jobs, time.time() - start)
+
+        _log (1)
+        for status in ("reduced", "duplicate", "failed", "interrupted"):
+            _log (1, "{:<12} {}".format(status + ":", sum(
+                [1 for job in jobs if job.status == status])))
+        _log (1, "total time:  {:.2f} seconds".format(time.time() - start))
+        sys.exit(0)
+    except DDSMTBatchException as e:
+        sys.exit(str(e))
+    except KeyboardInterrupt as e:
+        sys.exit("[ddsmtbatch] interrupted")
@@ -16,6 +16,7 @@ mkdir -p "$DDSMTPARSERDIR"
 
 cp -r      \
   "$DDSMTROOTDIR"/ddsmt.py \
+  "$DDSMTROOTDIR"/ddsmtbatch.py \
   "$DDSMTROOTDIR"/COPYING  \
   "$DDSMTROOTDIR"/README   \
 "$DDSMTDIR"
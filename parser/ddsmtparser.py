@@ -17,6 +17,10 @@
 # along with ddSMT.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import io
+import pickle
+import sys
+
 from parser.smtparser import SMTParser, SMTParseException
 
 KIND_ANNFUN    = "<annotated fun symbol>"
@@ -531,53 +535,55 @@ class SMTFunAppNode (SMTNode):
     def __str__ (self):
         # we have to prevent recursive calls here, else deep nesting levels
         # blow up the recursion depth limit
+        # Note: nodes may be shared (DAG), hence closing a node is marked
+        #       explicitly rather than by having visited it before
         strings = []
-        to_visit = [self]
-        visited = {}
+        to_visit = [(self, False)]
         while to_visit:
-            cur = to_visit.pop().get_subst()
+            (cur, closing) = to_visit.pop()
+            if closing:
+                cs = []
+                for c in cur.children:
+                    if not strings:
+                        break
+                    cs.append(strings.pop())
+                strings.append(
+                        "({} {})".format(
+                            cur.fun,
+                            " ".join([s for s in cs])))
+                continue
+            cur = cur.get_subst()
             if not cur:
                 continue
             if type(cur) != SMTFunAppNode:
                 strings.append(str(cur))
             else:
-                if cur.id not in visited:
-                    to_visit.append(cur)
-                    to_visit.extend(cur.children)
-                    visited[cur.id] = cur.id
-                else:
-                    cs = []
-                    for c in cur.children:
-                        if not strings:
-                            break
-                        cs.append(strings.pop())
-                    strings.append(
-                            "({} {})".format(
-                                cur.fun,
-                                " ".join([s for s in cs])))
+                to_visit.append((cur, True))
+                to_visit.extend([(c, False) for c in cur.children])
         assert (len(strings) == 1)
         return strings.pop()
 
     def dump (self, outfile, lead = " "):
         # we have to prevent recursive calls here, else deep nesting levels
         # blow up the recursion depth limit
-        to_visit = [self]
-        visited = {}
+        # Note: nodes may be shared (DAG), hence closing a node is marked
+        #       explicitly rather than by having visited it before
+        to_visit = [(self, False)]
         while to_visit:
-            cur = to_visit.pop().get_subst()
+            (cur, closing) = to_visit.pop()
+            if closing:
+                outfile.write(")")
+                continue
+            cur = cur.get_subst()
             if not cur:
                 continue
             if type(cur) != SMTFunAppNode:
                 cur.dump(outfile)
             else:
-                if cur.id not in visited:
-                    to_visit.append(cur)
-                    outfile.write(lead)
-                    outfile.write("({}".format(cur.fun))
-                    to_visit.extend(cur.children[::-1])
-                    visited[cur.id] = cur.id
-                else:
-                    outfile.write(")")
+                to_visit.append((cur, True))
+                outfile.write(lead)
+                outfile.write("({}".format(cur.fun))
+                to_visit.extend([(c, False) for c in cur.children[::-1]])
 
     def is_and (self):
         return self.kind == KIND_AND
@@ -627,9 +633,15 @@ class SMTVarBindNode (SMTNode):
                 subst.dump(outfile, lead)
         else:
             outfile.write(lead)
-            outfile.write("({}".format(self.var.name))
-            self.children[0].dump(outfile)
-            outfile.write(")")
+            if SMTNode.g_smtformula:
+                SMTNode.g_smtformula.dump_cached(self, outfile, self.__dump)
+            else:
+                self.__dump(outfile)
+
+    def __dump (self, outfile):
+        outfile.write("({}".format(self.var.name))
+        self.children[0].dump(outfile)
+        outfile.write(")")
 
     def is_varb (self):
         return True
@@ -662,56 +674,58 @@ class SMTForallExistsNode (SMTNode):
     def __str__ (self):
         # we have to prevent recursive calls here, else deep nesting levels
         # blow up the recursion depth limit
+        # Note: nodes may be shared (DAG), hence closing a node is marked
+        #       explicitly rather than by having visited it before
         strings = []
-        to_visit = [self]
-        visited = {}
+        to_visit = [(self, False)]
         while to_visit:
-            cur = to_visit.pop().get_subst()
+            (cur, closing) = to_visit.pop()
+            if closing:
+                assert (len(strings) == 1)
+                strings.append(
+                        "({} ({}) {})".format(
+                            cur.kind,
+                            " ".join(
+                                ["({} {!s})".format(s.var.name, s.var.sort)
+                                for s in cur.svars]) \
+                                        if len(cur.svars) > 0 else "",
+                            strings.pop()))
+                continue
+            cur = cur.get_subst()
             if not cur:
                 continue
             if type(cur) != SMTForallExistsNode:
                 strings.append(str(cur))
             else:
-                if cur.id not in visited:
-                    to_visit.append(cur)
-                    to_visit.extend(cur.children)
-                    visited[cur.id] = cur.id
-                else:
-                    assert (len(strings) == 1)
-                    strings.append(
-                            "({} ({}) {})".format(
-                                cur.kind,
-                                " ".join(
-                                    ["({} {!s})".format(s.var.name, s.var.sort)
-                                    for s in cur.svars]) \
-                                            if len(cur.svars) > 0 else "",
-                                strings.pop()))
+                to_visit.append((cur, True))
+                to_visit.extend([(c, False) for c in cur.children])
         assert (len(strings) == 1)
         return strings.pop()
 
     def dump (self, outfile, lead = " "):
         # we have to prevent recursive calls here, else deep nesting levels
         # blow up the recursion depth limit
-        to_visit = [self]
-        visited = {}
+        # Note: nodes may be shared (DAG), hence closing a node is marked
+        #       explicitly rather than by having visited it before
+        to_visit = [(self, False)]
         while to_visit:
-            cur = to_visit.pop().get_subst()
+            (cur, closing) = to_visit.pop()
+            if closing:
+                outfile.write(")")
+                continue
+            cur = cur.get_subst()
             if not cur:
                 continue
             if type(cur) != SMTForallExistsNode:
                 cur.dump(outfile)
             else:
-                if cur.id not in visited:
-                    to_visit.append(cur)
-                    outfile.write(lead)
-                    outfile.write("({} ({})".format(
-                        cur.kind,
-                        " ".join(["({} {!s})".format(s.var.name, s.var.sort)
-                            for s in cur.svars]) if len(cur.svars) > 0 else ""))
-                    to_visit.extend(cur.children[::-1])
-                    visited[cur.id] = cur.id
-                else:
-                    outfile.write(")")
+                to_visit.append((cur, True))
+                outfile.write(lead)
+                outfile.write("({} ({})".format(
+                    cur.kind,
+                    " ".join(["({} {!s})".format(s.var.name, s.var.sort)
+                        for s in cur.svars]) if len(cur.svars) > 0 else ""))
+                to_visit.extend([(c, False) for c in cur.children[::-1]])
 
 
 class SMTLetNode (SMTNode):
@@ -722,11 +736,24 @@ class SMTLetNode (SMTNode):
     def __str__ (self):
         # we have to prevent recursive calls here, else deep nesting levels
         # blow up the recursion depth limit
+        # Note: nodes may be shared (DAG), hence closing a node is marked
+        #       explicitly rather than by having visited it before
         strings = []
-        to_visit = [self]
-        visited = {}
+        to_visit = [(self, False)]
         while to_visit:
-            cur = to_visit.pop()
+            (cur, closing) = to_visit.pop()
+            if closing:
+                cs = []
+                for c in cur.children:
+                    if not strings:
+                        break
+                    cs.append(strings.pop())
+                strings.append(
+                        "({} ({}) {})".format(
+                            cur.kind,
+                            " ".join([s for s in cs[0:-1]]),
+                            cs[-1]))
+                continue
             cursubst = cur.get_subst()
             if not cursubst and type(cur) == SMTVarBindNode:
                 continue
@@ -734,32 +761,26 @@ class SMTLetNode (SMTNode):
             if type(cur) != SMTLetNode:
                 strings.append(str(cur))
             else:
-                if cur.id not in visited:
-                    to_visit.append(cur)
-                    to_visit.extend(cur.children)
-                    visited[cur.id] = cur.id
-                else:
-                    cs = []
-                    for c in cur.children:
-                        if not strings:
-                            break
-                        cs.append(strings.pop())
-                    strings.append(
-                            "({} ({}) {})".format(
-                                cur.kind,
-                                " ".join([s for s in cs[0:-1]]),
-                                cs[-1]))
+                to_visit.append((cur, True))
+                to_visit.extend([(c, False) for c in cur.children])
         assert (len(strings) == 1)
         return strings.pop()
 
     def dump (self, outfile, lead = " "):
         # we have to prevent recursive calls here, else deep nesting levels
         # blow up the recursion depth limit
-        to_visit = [self]
-        visited = {}
+        # Note: nodes may be shared (DAG), hence closing a node is marked
+        #       explicitly rather than by having visited it before
+        to_visit = [(self, False)]
         cntvb = 0
         while to_visit:
-            cur = to_visit.pop()
+            (cur, closing) = to_visit.pop()
+            if closing:
+                if cntvb:
+                    outfile.write(")")
+                    cntvb = 0
+                outfile.write(")")
+                continue
             cursubst = cur.get_subst()
             if not cursubst and type(cur) == SMTVarBindNode:
                 cntvb += 1
@@ -782,14 +803,10 @@ class SMTLetNode (SMTNode):
                 if cntvb:
                     outfile.write(")")
                     cntvb = 0
-                if cur.id not in visited:
-                    to_visit.append(cur)
-                    outfile.write(lead)
-                    outfile.write("({} (".format(cur.kind))
-                    to_visit.extend(cur.children[::-1])
-                    visited[cur.id] = cur.id
-                else:
-                    outfile.write(")")
+                to_visit.append((cur, True))
+                outfile.write(lead)
+                outfile.write("({} (".format(cur.kind))
+                to_visit.extend([(c, False) for c in cur.children[::-1]])
 
     def is_let (self):
         return True
@@ -828,6 +845,9 @@ class SMTNamedAnnNode (SMTAnnNode):
         if self.is_subst():
             self.get_subst().dump(outfile, lead)
         else:
+            if SMTNode.g_smtformula:
+                # output depends on previously dumped nodes, do not cache
+                SMTNode.g_smtformula.nanns_dumped += 1
             outfile.write(lead)
             if self.dumped:  # name-only
                 outfile.write(self.name)
@@ -899,6 +919,12 @@ class SMTCmdNode:
         if self.is_subst():
             return
         outfile.write(lead)
+        if SMTCmdNode.g_smtformula:
+            SMTCmdNode.g_smtformula.dump_cached(self, outfile, self.__dump)
+        else:
+            self.__dump(outfile)
+
+    def __dump (self, outfile):
         if self.kind == KIND_DECLCONST:
             assert (len(self.children) == 1)
             assert (isinstance(self.children[0], SMTFunNode))
@@ -1112,23 +1138,259 @@ class SMTScopeNode:
 
 
 class SMTSubstList:
+
+    UNSET = object()  # journal value of absent dict entries
+
     def __init__ (self):
         self.substs = {}
+        self.changed = set()  # ids of nodes with changed substs since dump
+        self.journal = []     # (dict or object, key, old, new, tracked)
+        self.ncheckpoints = 0 # journal writes only if checkpoints are open
+        self.index = None     # SMTTermIndex to be updated on changes
+        self.uncompressed = {}  # node id -> subst as indexed (see __write)
 
     def subst (self, node, substitution):
         assert (not substitution or \
                 not substitution.is_subst() or \
                 not substitution.get_subst().is_subst())
-        self.substs[node.id] = substitution \
-                if not substitution else substitution.get_subst()
+        self.set(self.substs, node.id, substitution \
+                if not substitution else substitution.get_subst())
+
+    def set (self, d, key, value):
+        # Note: all changes that have to be undone on rollback (substitutions
+        #       and fresh variable bookkeeping) must go through set/unset,
+        #       d is a dict or an object (key is an attribute name)
+        self.__set(d, key, value, True)
+
+    def unset (self, d, key):
+        self.set(d, key, SMTSubstList.UNSET)
+
+    def __set (self, d, key, value, tracked):
+        # Note: untracked changes (path compression) do not change the
+        #       resolved substitution of any node
+        if self.ncheckpoints:
+            self.journal.append(
+                    (d, key, SMTSubstList.__get(d, key), value, tracked))
+        self.__write(d, key, value, tracked)
+
+    @staticmethod
+    def __get (d, key):
+        if not isinstance(d, dict):
+            return getattr(d, key)
+        return d.get(key, SMTSubstList.UNSET)
+
+    def __write (self, d, key, value, tracked):
+        if not isinstance(d, dict):
+            setattr(d, key, value)
+            return
+        old = d.get(key, SMTSubstList.UNSET)
+        if value is SMTSubstList.UNSET:
+            del(d[key])
+        else:
+            d[key] = value
+        if d is self.substs:
+            if not tracked:
+                # path compression does not change what a node resolves to,
+                # the terms index keeps the uncompressed subst (see
+                # get_indexed) and is not updated
+                if self.uncompressed.get(key, old) is value:
+                    del(self.uncompressed[key])
+                else:
+                    self.uncompressed.setdefault(key, old)
+                return
+            self.changed.add(key)
+            if self.index:
+                self.index.update(
+                        key, self.uncompressed.pop(key, old), value)
+            else:
+                self.uncompressed.pop(key, None)
+
+    def checkpoint (self):
+        self.ncheckpoints += 1
+        return len(self.journal)
+
+    def commit (self, checkpoint):
+        assert (self.ncheckpoints > 0)
+        self.ncheckpoints -= 1
+        entries = self.journal[checkpoint:]
+        if not self.ncheckpoints:
+            self.journal.clear()
+        return entries
+
+    def rollback (self, checkpoint):
+        assert (self.ncheckpoints > 0)
+        entries = self.journal[checkpoint:]
+        for (d, key, old, new, tracked) in reversed(entries):
+            self.__write(d, key, old, tracked)
+        del(self.journal[checkpoint:])
+        self.ncheckpoints -= 1
+        return entries
+
+    def replay (self, entries):
+        for (d, key, old, new, tracked) in entries:
+            assert (SMTSubstList.__get(d, key) is old)
+            self.__set(d, key, new, tracked)
+
+    def get_indexed (self, nid):
+        # subst of given node (id) as maintained by the terms index
+        return self.uncompressed.get(
+                nid, self.substs.get(nid, SMTSubstList.UNSET))
 
     def is_subst (self, node):
         return node.id in self.substs
 
     def get_subst (self, node):
-        while node and node.is_subst():
-            node = self.substs[node.id]
-        return node
+        substs = self.substs
+        if node.id not in substs:
+            return node
+        res = node
+        while res and res.id in substs:
+            res = substs[res.id]
+        # path compression: let all nodes on the path point to the result
+        # (journaled, i.e., undone on rollback of the substitutions creating
+        # the path)
+        cur = substs[node.id]
+        while cur is not res:
+            self.__set(substs, node.id, res, False)
+            node = cur
+            cur = substs[node.id]
+        return res
+
+class SMTTermIndex:
+    """Index of the terms reachable from commands of a given class
+       ('define-fun', 'assert', 'get-value') by (kind, sort class).
+
+       A term is reachable if it is not substituted and (transitively)
+       referenced by the term roots of a non-substituted command (in a
+       non-substituted scope), where references to substituted terms resolve
+       to their substitution and a symbol defined via a substituted term is
+       neither indexed nor followed (as in _filter_terms). Reachability is
+       maintained incrementally via reference counts on every change of a
+       substitution (including rollback).
+    """
+
+    CLASSES = (KIND_DEFFUN, KIND_ASSERT, KIND_GETVALUE)
+
+    def __init__ (self, smtformula):
+        self.substlist = smtformula.substs
+        self.nodes = {}  # node id -> node (all nodes ever reached)
+        self.funs = {}   # term id -> fun nodes defined by this term
+        self.refs = {}   # class -> node id -> number of references
+        self.terms = {}  # class -> (kind, sort class) -> node id -> node
+        for cls in SMTTermIndex.CLASSES:
+            self.refs[cls] = {}
+            self.terms[cls] = {}
+            self.__incref(cls, [smtformula.scopes])
+
+    @staticmethod
+    def sort_class (sort):
+        if sort == None:
+            return None
+        if sort.is_bv_sort():
+            return "BitVec"
+        if sort.is_arr_sort():
+            return "Array"
+        return sort.name
+
+    def get_terms (self, cls, kinds = None, sort = None):
+        res = []
+        for (kind, sclass), terms in self.terms[cls].items():
+            if (kinds == None or kind in kinds) and \
+               (sort == None or sclass == sort):
+                res.extend(terms.values())
+        return res
+
+    def update (self, nid, old, new):
+        unset = SMTSubstList.UNSET
+        node = self.nodes.get(nid)
+        funs = self.funs.get(nid) \
+                if (old is unset) != (new is unset) else None
+        for cls in SMTTermIndex.CLASSES:
+            refs = self.refs[cls]
+            if node and nid in refs:
+                self.__incref(cls, self.__children(cls, node, new))
+                self.__decref(cls, self.__children(cls, node, old))
+                if self.__is_term(node, old):
+                    self.__remove(cls, node)
+                if self.__is_term(node, new):
+                    self.__add(cls, node)
+            if not funs:
+                continue
+            for fun in funs.values():
+                if fun.id not in refs or fun.id in self.substlist.substs:
+                    continue
+                if new is unset:
+                    self.__incref(cls, fun.children)
+                    self.__add(cls, fun)
+                else:
+                    self.__decref(cls, fun.children)
+                    self.__remove(cls, fun)
+
+    def __is_term (self, node, subst):
+        return isinstance(node, SMTNode) \
+                and subst is SMTSubstList.UNSET \
+                and not (node.is_fun() and node.children and
+                         node.children[0].id in self.substlist.substs)
+
+    def __children (self, cls, node, subst):
+        if subst is not SMTSubstList.UNSET:
+            return [subst] if subst else []
+        if isinstance(node, SMTScopeNode):
+            return node.cmds + node.scopes
+        if isinstance(node, SMTCmdNode):
+            if node.kind != cls:
+                return []
+            return node.children if node.is_getvalue() \
+                                 else [node.children[-1]]
+        if node.is_fun() and node.children and \
+           node.children[0].id in self.substlist.substs:
+            return []
+        return node.children
+
+    def __add (self, cls, node):
+        key = (node.kind, SMTTermIndex.sort_class(node.sort))
+        self.terms[cls].setdefault(key, {})[node.id] = node
+
+    def __remove (self, cls, node):
+        key = (node.kind, SMTTermIndex.sort_class(node.sort))
+        self.terms[cls][key].pop(node.id, None)
+
+    def __incref (self, cls, nodes):
+        refs = self.refs[cls]
+        get_indexed = self.substlist.get_indexed
+        to_visit = list(nodes)
+        while to_visit:
+            cur = to_visit.pop()
+            nrefs = refs.get(cur.id, 0)
+            refs[cur.id] = nrefs + 1
+            if nrefs:
+                continue
+            if cur.id not in self.nodes:
+                self.nodes[cur.id] = cur
+                if isinstance(cur, SMTFunNode) and cur.children:
+                    self.funs.setdefault(
+                            cur.children[0].id, {})[cur.id] = cur
+            subst = get_indexed(cur.id)
+            if self.__is_term(cur, subst):
+                self.__add(cls, cur)
+            to_visit.extend(self.__children(cls, cur, subst))
+
+    def __decref (self, cls, nodes):
+        refs = self.refs[cls]
+        get_indexed = self.substlist.get_indexed
+        to_visit = list(nodes)
+        while to_visit:
+            cur = to_visit.pop()
+            nrefs = refs[cur.id] - 1
+            if nrefs:
+                refs[cur.id] = nrefs
+                continue
+            del(refs[cur.id])
+            subst = get_indexed(cur.id)
+            if self.__is_term(cur, subst):
+                self.__remove(cls, cur)
+            to_visit.extend(self.__children(cls, cur, subst))
+
 
 class SMTFormula:
     g_node_id = 0 # unique id for nodes of type SMTNode, SMTCmdNode, 
@@ -1141,8 +1403,20 @@ class SMTFormula:
         self.substs = SMTSubstList ()
         self.sorts_cache = {}
         self.consts_cache = {}
+        # (scope id, fun id, children ids) -> function application node
+        # (None if function applications are not shared, see funAppNode)
+        self.funapps_cache = None
+        self.nshared = 0       # number of function applications shared
         self.funs_cache = {}   # fun name -> currently visible declaring scopes
         self.anns_cache = []   # named annotation nodes
+        self.dump_cache = {}   # node id -> serialized cmd or var binding
+        self.dump_parents = None  # node id -> ids of parent nodes
+        self.subst_parents = {}   # node id -> ids of nodes substituted by it
+        self.nanns_dumped = 0
+        self.terms_index = None
+        # nodes with ids in (id_base, nparsed] belong to the input formula
+        self.id_base = SMTFormula.g_node_id
+        self.nparsed = self.id_base
         self.__add_predefined_sorts ()
 
     def __add_predefined_sorts (self):
@@ -1153,16 +1427,341 @@ class SMTFormula:
         self.add_arrSort ()      # abstract array base sort
 
     def dump (self, filename = None, root = None):
-        out = root if root != None else self.scopes
-        for ann in self.anns_cache:
-            ann.dumped = False  # reset
         if not filename:
-            out.dump(sys.stdout)
-            sys.stdout.write("\n")
+            self.__dump(sys.stdout, root)
         else:
             with open(filename, 'w') as outfile:
-                out.dump(outfile)
-                outfile.write("\n")
+                self.__dump(outfile, root)
+
+    def dumps (self, root = None):
+        outfile = io.StringIO()
+        self.__dump(outfile, root)
+        return outfile.getvalue()
+
+    def __dump (self, outfile, root):
+        out = root if root != None else self.scopes
+        for ann in self.anns_cache:
+            ann.dumped = False  # reset
+        self.__invalidate_dump_cache()
+        out.dump(outfile)
+        outfile.write("\n")
+
+    def dump_cached (self, node, outfile, dump_fun):
+        # Note: serializations of commands and variable bindings are cached
+        #       and reused until a substitution within their subtree occurs
+        #       (caching every subterm would require memory quadratic in the
+        #       nesting depth)
+        res = self.dump_cache.get(node.id)
+        if res == None:
+            buf = io.StringIO()
+            nanns = self.nanns_dumped
+            dump_fun(buf)
+            res = buf.getvalue()
+            if nanns == self.nanns_dumped:
+                self.dump_cache[node.id] = res
+        outfile.write(res)
+
+    def __add_dump_parents (self, roots):
+        # Note: includes fun symbols of (annotated) fun applications, which
+        #       are dumped substitution-aware via str()
+        parents = self.dump_parents
+        to_visit = [r for r in roots if r.id not in parents]
+        for r in to_visit:
+            parents[r.id] = []
+        while to_visit:
+            cur = to_visit.pop()
+            children = []
+            for c in cur.children:
+                if isinstance(c, list):
+                    children.extend(c)
+                else:
+                    children.append(c)
+            if isinstance(cur, (SMTFunAppNode, SMTAnFunNode)):
+                children.append(cur.fun)
+            for c in children:
+                if not isinstance(c, (SMTNode, SMTCmdNode)):
+                    continue
+                if c.id not in parents:
+                    parents[c.id] = [cur.id]
+                    to_visit.append(c)
+                else:
+                    parents[c.id].append(cur.id)
+
+    def __invalidate_dump_cache (self):
+        if self.dump_parents == None:
+            self.dump_parents = {}
+            cmds = []
+            to_visit = [self.scopes]
+            while to_visit:
+                cur = to_visit.pop()
+                cmds.extend(cur.cmds)
+                to_visit.extend(cur.scopes)
+            self.__add_dump_parents(cmds)
+        changed = self.substs.changed
+        self.substs.changed = set()
+        to_visit = []
+        for nid in changed:
+            subst = self.substs.substs.get(nid)
+            if subst != None:
+                # the dump of a node depends on the dump of its substitution
+                self.__add_dump_parents([subst])
+                self.subst_parents.setdefault(subst.id, set()).add(nid)
+            to_visit.append(nid)
+        visited = set()
+        while to_visit:
+            nid = to_visit.pop()
+            if nid in visited:
+                continue
+            visited.add(nid)
+            self.dump_cache.pop(nid, None)
+            to_visit.extend(self.dump_parents.get(nid, ()))
+            to_visit.extend(self.subst_parents.get(nid, ()))
+
+    def build_terms_index (self):
+        self.terms_index = SMTTermIndex (self)
+        self.substs.index = self.terms_index
+
+    def parsed_nodes (self):
+        """parsed_nodes()
+
+           Collect all nodes of the input formula (nodes created after
+           parsing, e.g., fresh variables, are not included).
+
+           :return: Dictionary mapping node ids to nodes.
+        """
+        nodes = {}
+        to_visit = [self.scopes]
+        while to_visit:
+            cur = to_visit.pop()
+            if cur.id in nodes or cur.id > self.nparsed:
+                continue
+            nodes[cur.id] = cur
+            if isinstance(cur, SMTScopeNode):
+                to_visit.extend(cur.scopes)
+                to_visit.extend(cur.cmds)
+                to_visit.extend(cur.sorts.values())
+                to_visit.extend(cur.funs.values())
+                continue
+            if isinstance(cur, SMTNode) and cur.sort:
+                to_visit.append(cur.sort)
+            to_visit.extend([c for c in cur.children \
+                    if isinstance(c, (SMTNode, SMTCmdNode, SMTScopeNode))])
+        return nodes
+
+    def __fresh_refs (self):
+        # map node id -> reference for all nodes created since parsing
+        refs = {}
+        for name, fun in self.scopes.funs.items():
+            if fun.id > self.nparsed:
+                refs[fun.id] = ["v", name]
+        for name, cmd in self.scopes.declfun_cmds.items():
+            if cmd.id > self.nparsed:
+                refs[cmd.id] = ["d", name]
+        for ostr, const in self.consts_cache.items():
+            if const.id > self.nparsed:
+                refs[const.id] = ["c", ostr, const.kind,
+                                  self.__ref(const.sort, refs), const.value]
+        for sort in self.scopes.sorts.values():
+            if sort.id > self.nparsed and sort.is_bv_sort():
+                refs[sort.id] = ["b", sort.bw]
+        return refs
+
+    def __ref (self, node, refs):
+        if node == None:
+            return None
+        if node.id <= self.nparsed:
+            return ["n", node.id - self.id_base]
+        if isinstance(node, SMTSortNode) and node.is_bv_sort():
+            return ["b", node.bw]
+        if node.id not in refs:
+            raise DDSMTParseCheckException (
+                    "unable to save substitution node '{}'".format(node))
+        return refs[node.id]
+
+    def __deref (self, ref, nodes):
+        if ref == None:
+            return None
+        try:
+            if ref[0] == "n":
+                return nodes[ref[1] + self.id_base]
+            if ref[0] == "v":
+                return self.scopes.funs[ref[1]]
+            if ref[0] == "d":
+                return self.scopes.declfun_cmds[ref[1]]
+            if ref[0] == "b":
+                return self.bvSortNode(ref[1])
+            if ref[0] == "c":
+                (ostr, kind, sort, value) = ref[1:]
+                sort = self.__deref(sort, nodes)
+                if sort.is_bv_sort():
+                    return self.bvConstNode(kind, sort.bw, value, ostr)
+                return self.constNode(kind, sort, value, ostr)
+        except (KeyError, IndexError, ValueError):
+            pass
+        raise DDSMTParseCheckException (
+                "invalid substitution node reference '{}'".format(ref))
+
+    def save_substs (self):
+        """save_substs()
+
+           Save the current substitutions and fresh variables. Nodes of the
+           input formula are referenced by id, fresh variables by name and
+           constants by value (substitutions of nodes that are not reachable
+           anymore are dropped).
+
+           :return: Dictionary of lists, numbers and strings (JSON).
+        """
+        assert (self.substs.ncheckpoints == 0)
+        refs = self.__fresh_refs()
+        fresh = []
+        for name, fun in self.scopes.funs.items():
+            if fun.id > self.nparsed:
+                fresh.append([name, self.__ref(fun.sort, refs),
+                              name in self.scopes.declfun_cmds])
+        substs = []
+        for nid, subst in self.substs.substs.items():
+            if nid <= self.nparsed:
+                substs.append([["n", nid - self.id_base],
+                               self.__ref(subst, refs)])
+            elif nid in refs:
+                substs.append([refs[nid], self.__ref(subst, refs)])
+        return { "declfun_id": self.scopes.declfun_id,
+                 "fresh": fresh,
+                 "substs": substs }
+
+    def load_substs (self, state):
+        """load_substs(state)
+
+           Restore substitutions and fresh variables saved via save_substs
+           in the freshly parsed input formula.
+
+           :state: Dictionary as returned by save_substs.
+        """
+        assert (not self.substs.substs)
+        nodes = self.parsed_nodes()
+        try:
+            for (name, sort, declared) in state["fresh"]:
+                self.__add_declfun(name, self.__deref(sort, nodes))
+            for (node, subst) in state["substs"]:
+                self.substs.set(self.substs.substs,
+                                self.__deref(node, nodes).id,
+                                self.__deref(subst, nodes))
+            for (name, sort, declared) in state["fresh"]:
+                if not declared:
+                    self.substs.unset(self.scopes.declfun_cmds, name)
+            self.scopes.declfun_id = state["declfun_id"]
+        except (KeyError, TypeError, ValueError):
+            raise DDSMTParseCheckException ("invalid substitution state")
+
+    @staticmethod
+    def __attrs (cls):
+        return [a for c in cls.__mro__
+                  for a in c.__dict__.get("__slots__", ())]
+
+    @staticmethod
+    def __node_classes ():
+        res = set()
+        to_visit = [SMTNode, SMTCmdNode, SMTScopeNode, SMTSubstList]
+        while to_visit:
+            cls = to_visit.pop()
+            res.add(cls)
+            to_visit.extend(cls.__subclasses__())
+        return res
+
+    def save (self, outfile):
+        """save(outfile)
+
+           Save the input formula (as returned by DDSMTParser.parse) in
+           binary form. Nodes are pickled as a flat list of their attributes,
+           with references to other nodes pickled as their index (the nesting
+           depth of terms is thus not limited by the recursion limit). The
+           terms index is not saved but rebuilt by load.
+
+           :outfile: File object (binary mode) to write to.
+        """
+        assert (not self.substs.substs)
+        objs = [self]
+        index = { id(self): 0 }
+        classes = self.__node_classes()
+        def persistent_id (obj):
+            # Note: called for every object to be pickled
+            if type(obj) not in classes:
+                return "terms_index" if type(obj) == SMTTermIndex else None
+            i = index.get(id(obj))
+            if i == None:
+                i = index[id(obj)] = len(objs)
+                objs.append(obj)
+            return (i, type(obj))
+        pickler = pickle.Pickler(outfile, pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = persistent_id
+        pickler.dump(SMTFormula.g_node_id - self.id_base)
+        attrs = {}
+        i = 0
+        while i < len(objs):
+            # pickle all nodes indexed so far, this indexes further nodes
+            states = []
+            for obj in objs[i:]:
+                cls = type(obj)
+                if cls not in attrs:
+                    attrs[cls] = self.__attrs(cls)
+                states.append(([getattr(obj, a) for a in attrs[cls]],
+                               getattr(obj, "__dict__", None)))
+            i += len(states)
+            pickler.dump(states)
+        pickler.dump(None)
+
+    @staticmethod
+    def load (infile):
+        """load(infile)
+
+           Load a formula saved via save. Node ids are renumbered as if the
+           formula was parsed now. Note: the file is unpickled, which may
+           execute arbitrary code, only load files from trusted sources.
+
+           :infile: File object (binary mode) to read from.
+           :return: The formula.
+        """
+        objs = { 0: SMTFormula.__new__(SMTFormula) }
+        def persistent_load (pid):
+            if pid == "terms_index":
+                return None
+            (i, cls) = pid
+            if i not in objs:
+                objs[i] = cls.__new__(cls)
+            return objs[i]
+        unpickler = pickle.Unpickler(infile)
+        unpickler.persistent_load = persistent_load
+        smtformula = objs[0]
+        attrs = {}
+        try:
+            nids = unpickler.load()
+            shift = None
+            i = 0
+            states = unpickler.load()
+            while states != None:
+                for (values, d) in states:
+                    obj = objs[i]
+                    cls = type(obj)
+                    if cls not in attrs:
+                        attrs[cls] = SMTFormula.__attrs(cls)
+                    for (a, v) in zip(attrs[cls], values):
+                        setattr(obj, a, v)
+                    if d:
+                        obj.__dict__.update(d)
+                    if shift == None:
+                        shift = SMTFormula.g_node_id - smtformula.id_base
+                    elif hasattr(obj, "id"):
+                        obj.id += shift
+                    i += 1
+                states = unpickler.load()
+            smtformula.id_base += shift
+            smtformula.nparsed += shift
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError,
+                IndexError, KeyError, TypeError, ValueError):
+            raise DDSMTParseCheckException ("invalid formula file")
+        SMTFormula.g_node_id = smtformula.id_base + nids
+        smtformula.build_terms_index()
+        return smtformula
 
     def is_bv_logic (self):
         return self.logic == "ALL" or self.logic.find("BV") >= 0
@@ -1185,7 +1784,7 @@ class SMTFormula:
         self.substs.subst(node, substitution)
         if isinstance (node, SMTNode) and node.is_fun() and \
             self.is_substvar(node):
-            del (self.scopes.declfun_cmds[node.name])
+            self.substs.unset(self.scopes.declfun_cmds, node.name)
 
 
     def is_subst (self, node):
@@ -1596,7 +2195,20 @@ class SMTFormula:
             else:
                 kind = name
         sort = self.funApp2sort(fun, kind, children)
-        return SMTFunAppNode (fun, kind, sort, children)
+        if self.funapps_cache == None:
+            return SMTFunAppNode (fun, kind, sort, children)
+        # hash-consing: structurally equal applications within the same
+        # scope are represented by the same node
+        # Note: substitutions are per node, hence substituting a shared
+        #       application substitutes all of its occurrences
+        key = (self.cur_scope.id, fun.id, tuple(c.id for c in children))
+        node = self.funapps_cache.get(key)
+        if node != None:
+            self.nshared += 1
+            return node
+        node = SMTFunAppNode (fun, kind, sort, children)
+        self.funapps_cache[key] = node
+        return node
 
     def letFeNode (self, kind, children, svars = None):
         assert (kind in (KIND_LET, KIND_FORALL, KIND_EXISTS))
@@ -1662,13 +2274,25 @@ class SMTFormula:
         return cmd
 
     def add_fresh_declfunCmdNode (self, sort):
-        self.scopes.declfun_id += 1
-        name = "_substvar_{}_".format(self.scopes.declfun_id)
+        # Note: the counter is journaled (restored on rollback), fresh names
+        #       thus do not depend on the candidates tested before
+        declfun_id = self.scopes.declfun_id + 1
+        name = "_substvar_{}_".format(declfun_id)
         while self.find_fun (name, scope=self.scopes, find_nested=False):
-            self.scopes.declfun_id = int(name[10:-1]) + 1
-            name = "_substvar_{}_".format(self.scopes.declfun_id)
-        fun = self.add_fun (name, sort, [], [], [])
-        self.scopes.declfun_cmds[name] = SMTCmdNode (KIND_DECLFUN, [fun])
+            declfun_id = int(name[10:-1]) + 1
+            name = "_substvar_{}_".format(declfun_id)
+        self.substs.set(self.scopes, "declfun_id", declfun_id)
+        return self.__add_declfun (name, sort)
+
+    def __add_declfun (self, name, sort):
+        # Note: fresh variables are added via the substitution journal to be
+        #       removed again on rollback
+        fun = SMTFunNode (name, sort, [], [], [])
+        self.substs.set(self.scopes.funs, name, fun)
+        self.substs.set(self.funs_cache, name,
+                        self.funs_cache.get(name, []) + [self.scopes])
+        self.substs.set(self.scopes.declfun_cmds, name,
+                        SMTCmdNode (KIND_DECLFUN, [fun]))
         return fun
 
     def __assert_varb (self, var_bindings):
@@ -1689,9 +2313,11 @@ class SMTFormula:
 
 class DDSMTParser (SMTParser):
 
-    def __init__ (self):
+    def __init__ (self, share_terms = False):
         super().__init__()
         self.smtformula = SMTFormula()
+        if share_terms:
+            self.smtformula.funapps_cache = {}
         self.__set_parse_actions()
 
     def parse (self, infile):
@@ -1702,6 +2328,9 @@ class DDSMTParser (SMTParser):
         SMTNode.g_smtformula = self.smtformula
         SMTCmdNode.g_smtformula = self.smtformula
         SMTScopeNode.g_smtformula = self.smtformula
+        self.smtformula.nparsed = SMTFormula.g_node_id
+        self.smtformula.funapps_cache = None  # only needed while parsing
+        self.smtformula.build_terms_index()
         return self.smtformula
 
     def __set_parse_actions (self):
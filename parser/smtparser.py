@@ -19,6 +19,11 @@
 
 import sys
 import re
+import mmap
+
+from array import array
+from bisect import bisect_left
+from collections import deque
 
 
 class SMTParseException (Exception):
@@ -141,9 +146,29 @@ class SMTParser:
 
     PLACEHOLDER = "@::@"
 
+    # single-pass tokenizer, matches (in this order) whitespace, comments,
+    # '(_' (indexed identifier), parentheses, quoted symbols, string literals
+    # (with escaped quotes '\"') and any other token (a ')' preceded by a
+    # backslash does not end a token)
+    TOKENS = re.compile (
+            br'\s+|;[^\n]*'
+            br'|(\(_(?=\s)|[()]'
+            br'|\|[^|]*\|?'
+            br'|"[^"\\]*(?:\\"?[^"\\]*)*"?'
+            br'|(?:[^\s()|";\\]+|\\\)?)+)')
+
+    NEWLINE = re.compile (b'\n')
+
+    # maximum number of tokens __scan_back may go back
+    LOOKBACK = 8
+
     def __init__ (self):
         self.filename = ""
-        self.tokens = []
+        self.tokens = None
+        self.window = None
+        self.offsets = None
+        self.newlines = array('Q')
+        self.nread = 0
         self.la = ""
         self.pos = 0
 
@@ -179,111 +204,78 @@ class SMTParser:
     def parse (self, filename):
         self.filename = filename
         self.tokens = self.__tokenize()
-        self.__scan()
-        return self.script.parse_action(self.__script())
+        self.window = deque(maxlen = SMTParser.LOOKBACK)
+        # start offsets of the tokens in the window (ring buffer)
+        self.offsets = array('Q', [0] * SMTParser.LOOKBACK)
+        # offsets of newlines, only built (on demand) by get_pos
+        self.newlines = array('Q')
+        self.nread = 0
+        self.pos = 0
+        try:
+            self.__scan()
+            return self.script.parse_action(self.__script())
+        finally:
+            self.tokens.close()
 
     def get_pos (self):
-        line = 1
-        col = 0
-        with open (self.filename, 'r') as infile:
-            instring = infile.read()
-            (idx, line, col) = self.__skip_space(instring, 0, 1, 0)
-            (idx, line, col) = self.__skip_comment(instring, idx, line, col)
-            for token in self.tokens[:self.pos - 1]:
-                for i in range(0, len(token)):
-                    (idx, line, col) = \
-                            self.__skip_space(instring, idx, line, col)
-                    if token[i].isspace():
-                        continue
-                    assert (token[i] == instring[idx] \
-                            or (token[i] == SMTParser.COMMA and
-                                instring[idx] == SMTParser.COMMENT))
-                    col += 1
-                    idx += 1
-                (idx, line, col) = self.__skip_space(instring, idx, line, col)
-                (idx, line, col) = self.__skip_comment(instring, idx, line, col)
-                (idx, line, col) = self.__skip_space(instring, idx, line, col)
-        return (line, col + 1)
-
-    def __skip_space (self, instring, idx, line, col):
-        while idx < len(instring) and instring[idx].isspace():
-            if instring[idx] == '\n':
-                line += 1
-                col = 0
-            else:
-                col += 1
-            idx += 1
-        return (idx, line, col)
-
-    def __skip_comment (self, instring, idx, line, col):
-        while idx < len(instring) and instring[idx] == SMTParser.COMMENT:
-            while idx < len(instring) and instring[idx] != '\n':
-                 idx += 1
-            (idx, line, col) = self.__skip_space(instring, idx, line, col)
-        return (idx, line, col)
+        with open (self.filename, 'rb') as infile:
+            inmap = self.__mmap(infile)
+        # position of the current token (or of the end of the input)
+        if self.la:
+            idx = self.offsets[(self.pos - 1) % SMTParser.LOOKBACK]
+        else:
+            idx = len(inmap)
+        # extend the newline index up to idx (if necessary)
+        start = self.newlines[-1] + 1 if self.newlines else 0
+        self.newlines.extend(m.start() for m in
+                SMTParser.NEWLINE.finditer(inmap, start, idx))
+        line = bisect_left(self.newlines, idx)
+        bol = self.newlines[line - 1] + 1 if line else 0
+        col = len(inmap[bol:idx].decode(errors='replace'))
+        return (line + 1, col + 1)
+
+    def __mmap (self, infile):
+        try:
+            return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # empty file or not a regular file (e.g., a pipe)
+            return infile.read()
 
     def __scan (self):
-        try:
-            self.la = self.tokens[self.pos]
-        except IndexError:
-            self.la = ""
+        if self.pos < self.nread:
+            # scanning forward again after __scan_back
+            self.la = self.window[self.pos - self.nread]
+        else:
+            (offset, self.la) = next(self.tokens, (0, ""))
+            self.window.append(self.la)
+            self.offsets[self.nread % SMTParser.LOOKBACK] = offset
+            self.nread += 1
         self.pos += 1
 
+    def __first (self):
+        # first character of the current token, which is the empty string at
+        # the end of the input
+        if not self.la:
+            raise SMTParseException ("unexpected end of input", self)
+        return self.la[0]
+
     def __scan_back (self, steps):
         assert (self.pos - steps > 0)
+        assert (self.nread - self.pos + steps < SMTParser.LOOKBACK)
         self.pos -= steps
-        self.la = self.tokens[self.pos - 1]
+        self.la = self.window[self.pos - 1 - self.nread]
 
     def __tokenize (self):
-        with open (self.filename, 'r') as infile:
-            tokens = []
-            # Note: separate re.subs are way faster than combined subs that
-            #       require more testing, e.g.
-            #           re.sub(r'(?<!\\)(?P<m>["\)])',
-            #                  " {} ".format(r'\g<m>'), instring)
-            instring = re.sub(
-                    r'set-info :source\s*\|.*?\|',
-                    lambda x: re.sub(
-                        SMTParser.COMMENT, SMTParser.PLACEHOLDER, x.group(0)),
-                    infile.read(),
-                    flags=re.DOTALL)
-            instring = re.sub (
-                    r'".*?"',
-                    lambda x: re.sub(
-                        SMTParser.COMMENT, SMTParser.PLACEHOLDER, x.group(0)),
-                    instring,
-                    flags=re.DOTALL)
-            instring = re.sub(r';[^\n]*\n', ' ' , instring)
-            instring = re.sub(r'(\((?!_\s)|\(_\s)', r' \1 ', instring)
-            instring = re.sub(r'@::@', ';', instring)
-
-            pidx = instring.find(SMTParser.PIPE)
-            qidx = instring.find(SMTParser.QUOTE)
-            c = SMTParser.PIPE if qidx == -1 or (pidx >= 0 and pidx < qidx) \
-                               else SMTParser.QUOTE
-            instring = instring.partition(c)
-            while instring[0]:
-                tokens.extend(
-                        re.sub(r'(?<!\\)\)', ' ) ', instring[0]).split())
-                part = instring[2].partition(c)
-                if c == SMTParser.PIPE:
-                    tokens.append("{}{}{}".format(
-                        instring[1], part[0], part[1]))
-                else:
-                    strings = []
-                    strings.append(part[0])
-                    while part[0] and part[0][-1] == '\\':
-                        part = part[2].partition(c)
-                        strings.append(part[0])
-                    tokens.append("\"{}\"".format(
-                        "\"".join([s for s in strings])))
-                pidx = part[2].find(SMTParser.PIPE)
-                qidx = part[2].find(SMTParser.QUOTE)
-                c = SMTParser.PIPE if qidx == -1 or (pidx >= 0 and pidx < qidx)\
-                                   else SMTParser.QUOTE
-                instring = part[2].partition(c)
-            tokens.extend(re.sub(r'(?<!\\)\)', ' ) ', instring[2]).split())
-            return tokens
+        # tokens (with their start offset) are read lazily from a memory map
+        # of the input, only the last SMTParser.LOOKBACK tokens are kept (see
+        # __scan_back)
+        with open (self.filename, 'rb') as infile:
+            inmap = self.__mmap(infile)
+        for m in SMTParser.TOKENS.finditer(inmap):
+            # Note: whitespace and comments match with an empty group
+            if m.lastindex:
+                yield (m.start(), m.group(1).decode())
+
     def __check_lpar (self, msg = "'(' expected"):
         if self.la != SMTParser.LPAR:
             raise SMTParseException (msg, self)
@@ -334,7 +326,7 @@ class SMTParser:
 
     def __string (self):
         tokens = SMTParseResult()
-        if not self.la[0] == SMTParser.QUOTE:
+        if not self.__first() == SMTParser.QUOTE:
             raise SMTParseException ("string expected", self)
         if not self.la[-1] == SMTParser.QUOTE:
             raise SMTParseException ("unclosed string literal", self)
@@ -359,7 +351,8 @@ class SMTParser:
         #        r'[0-9a-zA-Z\*|\+\-/\*\=%\?\!\.\$_~&\^\<\>@]*', self.la):
         #    raise SMTParseException (
         #            "unexpected character: {}".format(self.la[0]), self)
-        if self.la[0] == SMTParser.PIPE and not self.la[-1] == SMTParser.PIPE:
+        if self.__first() == SMTParser.PIPE \
+           and not self.la[-1] == SMTParser.PIPE:
             raise SMTParseException ("unclosed symbol, missing '|'", self)
         tokens.append(self.la)
         self.__scan()
@@ -367,7 +360,7 @@ class SMTParser:
 
     def __keyword (self):
         tokens = SMTParseResult()
-        if self.la[0] != ':':
+        if self.__first() != ':':
             raise SMTParseException ("keyword expected", self)
         for i in range(1, len(self.la)):
             c = self.la[i]
@@ -380,13 +373,13 @@ class SMTParser:
 
     def __spec_constant (self):
         tokens = SMTParseResult()
-        if self.la[0] == SMTParser.QUOTE:
+        if self.__first() == SMTParser.QUOTE:
             tokens.append(self.string.parse_action(self.__string()))
         elif re.match(r'^#b', self.la):
             tokens.append(self.binary.parse_action(self.__binary()))
         elif re.match(r'^#x', self.la):
             tokens.append(self.hexadecimal.parse_action(self.__hexadecimal()))
-        elif self.la[0].isdigit():
+        elif self.__first().isdigit():
             if '.' in self.la:
                 tokens.append(self.decimal.parse_action(self.__decimal()))
             else:
@@ -399,13 +392,13 @@ class SMTParser:
 
     def __s_expr (self):
         tokens = SMTParseResult()
-        if self.la[0] == ':':
+        if self.__first() == ':':
             tokens.append(self.keyword.parse_action(self.__keyword()))
         elif self.la in (SMTParser.TRUE, SMTParser.FALSE) \
-                or self.__first_of_const(self.la[0]):
+                or self.__first_of_const(self.__first()):
             tokens.append(
                     self.spec_constant.parse_action(self.__spec_constant()))
-        elif self.__first_of_symbol(self.la[0]):
+        elif self.__first_of_symbol(self.__first()):
             tokens.append(self.symbol.parse_action(self.__symbol()))
         else:
             self.__check_lpar("s-expression expected")
@@ -417,7 +410,7 @@ class SMTParser:
 
     def __ident (self):
         tokens = SMTParseResult()
-        if self.__first_of_symbol(self.la[0]):
+        if self.__first_of_symbol(self.__first()):
             tokens.append(self.symbol.parse_action(self.__symbol()))
         elif self.la == SMTParser.IDXED:
             self.__scan()
@@ -436,7 +429,8 @@ class SMTParser:
 
     def __sort (self):
         tokens = SMTParseResult()
-        if self.__first_of_symbol(self.la[0]) or self.la == SMTParser.IDXED:
+        if self.__first_of_symbol(self.__first()) \
+           or self.la == SMTParser.IDXED:
             tokens.append(self.ident.parse_action(self.__ident()))
         else:
             self.__check_lpar("sort expected")
@@ -453,7 +447,8 @@ class SMTParser:
 
     def __sort_expr (self):
         tokens = SMTParseResult()
-        if self.__first_of_symbol(self.la[0]) or self.la == SMTParser.IDXED:
+        if self.__first_of_symbol(self.__first()) \
+           or self.la == SMTParser.IDXED:
             tokens.append(self.ident.parse_action(self.__ident()))
         else:
             self.__check_lpar("sort expression expected")
@@ -471,10 +466,10 @@ class SMTParser:
     def __attr_value (self):
         tokens = SMTParseResult()
         if self.la in (SMTParser.TRUE, SMTParser.FALSE) \
-                or self.__first_of_const(self.la[0]):
+                or self.__first_of_const(self.__first()):
             tokens.append(
                     self.spec_constant.parse_action(self.__spec_constant()))
-        elif self.__first_of_symbol(self.la[0]):
+        elif self.__first_of_symbol(self.__first()):
             tokens.append(self.symbol.parse_action(self.__symbol()))
         else:
             self.__check_lpar("attribute value expected")
@@ -487,13 +482,14 @@ class SMTParser:
     def __attribute (self):
         tokens = SMTParseResult()
         tokens.append(self.keyword.parse_action(self.__keyword()))
-        if self.la[0] not in (':', SMTParser.RPAR):
+        if self.__first() not in (':', SMTParser.RPAR):
             tokens.append(self.attr_value.parse_action(self.__attr_value()))
         return tokens
 
     def __qual_ident (self):
         tokens = SMTParseResult()
-        if self.__first_of_symbol(self.la[0]) or self.la == SMTParser.IDXED:
+        if self.__first_of_symbol(self.__first()) \
+           or self.la == SMTParser.IDXED:
             tokens.append(self.ident.parse_action(self.__ident()))
         else:
             self.__check_lpar("qualified identifier expected")
@@ -570,14 +566,8 @@ class SMTParser:
         while True:
             if self.la == SMTParser.RPAR:
                 # check number of nested terms given
-                nterms = len(terms[-1][1])
-                if terms[-1][0] == SMTParser.LPAR and nterms == 0:
+                if not terms[-1][1]:
                     raise SMTParseException ("term expected", self)
-                elif terms[-1][0] in (SMTParser.LET, SMTParser.EXISTS,
-                                      SMTParser.FORALL) and nterms != 1:
-                    self.pos = terms[-1][1][0]
-                    self.__scan()
-                    self.__check_rpar()
                 # build term expression
                 tokens = SMTParseResult()
                 tmp = []
@@ -609,15 +599,19 @@ class SMTParser:
                 cntpar -= 1
                 self.__check_rpar()
             else:
+                if terms[-1][0] in (SMTParser.LET, SMTParser.EXISTS,
+                                    SMTParser.FORALL) and terms[-1][1]:
+                    # exactly one term expected
+                    self.__check_rpar()
                 terms[-1][1].append(self.pos)
                 if self.la in (SMTParser.TRUE, SMTParser.FALSE) \
-                   or self.__first_of_const(self.la[0]):
+                   or self.__first_of_const(self.__first()):
                        tokens = SMTParseResult()
                        tokens.append(self.spec_constant.parse_action(
                            self.__spec_constant()))
                        stack.append(tokens)
                 elif self.la == SMTParser.IDXED \
-                     or self.__first_of_symbol(self.la[0]):
+                     or self.__first_of_symbol(self.__first()):
                          tokens = SMTParseResult()
                          tokens.append(self.qual_ident.parse_action(
                              self.__qual_ident()))
@@ -666,7 +660,7 @@ class SMTParser:
                         self.__check_rpar()
                     else:
                         cntpar += 1
-                        terms.append([self.la, []])
+                        terms.append([SMTParser.LPAR, []])
                         stack.extend(
                                 [SMTParser.LPAR,  # fun app marker
                                  self.qual_ident.parse_action(
@@ -816,6 +810,6 @@ class SMTParser:
 
     def __script (self):
         tokens = SMTParseResult()
-        while self.pos < len(self.tokens):
+        while self.la:
             tokens.append(self.command.parse_action(self.__command()))
         return tokens
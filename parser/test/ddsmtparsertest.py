@@ -19,6 +19,7 @@
 # along with ddSMT.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import io
 import os
 import filecmp
 import resource
@@ -29,7 +30,9 @@ import re
 from argparse import ArgumentParser, REMAINDER
 from subprocess import Popen, PIPE
 sys.path.insert(1, os.path.join(sys.path[0], '../../'))
-from parser.ddsmtparser import DDSMTParser, DDSMTParseException
+from parser.ddsmtparser import DDSMTParser, DDSMTParseException, \
+                              SMTFormula, SMTNode, SMTCmdNode, SMTScopeNode, \
+                              SMTTermIndex
 from parser.smtparser import SMTParser
 
 
@@ -39,6 +42,7 @@ __author__  = "Aina Niemetz <aina.niemetz@gmail.com>"
 g_args = None
 g_tmpfile = "/tmp/tmp-ddsmtparsertest-" + str(os.getpid()) + ".smt2"
 g_tmpinfile = "/tmp/tmp-ddsmtparsertest-fuzz-" + str(os.getpid()) + ".smt2"
+g_tmpmutfile = "/tmp/tmp-ddsmtparsertest-mut-" + str(os.getpid()) + ".smt2"
 g_reg = None
 
 
@@ -53,11 +57,13 @@ class DDSMTParserTestException (Exception):
 
 
 def _cleanup ():
-    global g_tmpfile, g_tmpinfile
+    global g_tmpfile, g_tmpinfile, g_tmpmutfile
     if os.path.exists(g_tmpfile):
         os.remove(g_tmpfile)
     if os.path.exists(g_tmpinfile):
         os.remove(g_tmpinfile)
+    if os.path.exists(g_tmpmutfile):
+        os.remove(g_tmpmutfile)
 
 
 
@@ -82,7 +88,7 @@ def _dump (smtformula, filename = None, root = None):
 
 
 def _cmp (file1, file2):
-    with open (file1, "rU") as f1, open (file2, "rU") as f2:
+    with open (file1, "r") as f1, open (file2, "r") as f2:
         f1str = re.sub(
                 r'set-info :source\s*\|.*?\|',
                 lambda x: re.sub(
@@ -117,8 +123,219 @@ def _cmp (file1, file2):
 
 
 
+def _activate (smtformula):
+    # the nodes of a formula refer to it via class attributes
+    SMTNode.g_smtformula = smtformula
+    SMTCmdNode.g_smtformula = smtformula
+    SMTScopeNode.g_smtformula = smtformula
+
+
+
+def _ref_tokenize (instring):
+    # tokenizer of the original (multi-pass) implementation of SMTParser,
+    # reference for the tokens of SMTParser.__tokenize
+    tokens = []
+    instring = re.sub(
+            r'set-info :source\s*\|.*?\|',
+            lambda x: re.sub(
+                SMTParser.COMMENT, SMTParser.PLACEHOLDER, x.group(0)),
+            instring,
+            flags=re.DOTALL)
+    instring = re.sub (
+            r'".*?"',
+            lambda x: re.sub(
+                SMTParser.COMMENT, SMTParser.PLACEHOLDER, x.group(0)),
+            instring,
+            flags=re.DOTALL)
+    instring = re.sub(r';[^\n]*\n', ' ' , instring)
+    instring = re.sub(r'(\((?!_\s)|\(_\s)', r' \1 ', instring)
+    instring = re.sub(r'@::@', ';', instring)
+    pidx = instring.find(SMTParser.PIPE)
+    qidx = instring.find(SMTParser.QUOTE)
+    c = SMTParser.PIPE if qidx == -1 or (pidx >= 0 and pidx < qidx) \
+                       else SMTParser.QUOTE
+    instring = instring.partition(c)
+    while instring[0]:
+        tokens.extend(re.sub(r'(?<!\\)\)', ' ) ', instring[0]).split())
+        part = instring[2].partition(c)
+        if c == SMTParser.PIPE:
+            tokens.append("{}{}{}".format(instring[1], part[0], part[1]))
+        else:
+            strings = []
+            strings.append(part[0])
+            while part[0] and part[0][-1] == '\\':
+                part = part[2].partition(c)
+                strings.append(part[0])
+            tokens.append("\"{}\"".format("\"".join([s for s in strings])))
+        pidx = part[2].find(SMTParser.PIPE)
+        qidx = part[2].find(SMTParser.QUOTE)
+        c = SMTParser.PIPE if qidx == -1 or (pidx >= 0 and pidx < qidx) \
+                           else SMTParser.QUOTE
+        instring = part[2].partition(c)
+    tokens.extend(re.sub(r'(?<!\\)\)', ' ) ', instring[2]).split())
+    # Note: empty tokens were handled as end of input
+    return [t for t in tokens if t]
+
+
+
+def _ref_skip_space (instring, idx, line, col):
+    while idx < len(instring) and instring[idx].isspace():
+        if instring[idx] == '\n':
+            line += 1
+            col = 0
+        else:
+            col += 1
+        idx += 1
+    return (idx, line, col)
+
+
+
+def _ref_skip_comment (instring, idx, line, col):
+    while idx < len(instring) and instring[idx] == SMTParser.COMMENT:
+        while idx < len(instring) and instring[idx] != '\n':
+             idx += 1
+        (idx, line, col) = _ref_skip_space(instring, idx, line, col)
+    return (idx, line, col)
+
+
+
+def _ref_pos (instring, tokens, pos):
+    # position (line, column) of the current token (given the number of
+    # scanned tokens pos) as computed by the original implementation of
+    # SMTParser.get_pos, reference for the positions in parse errors
+    (idx, line, col) = _ref_skip_space(instring, 0, 1, 0)
+    (idx, line, col) = _ref_skip_comment(instring, idx, line, col)
+    for token in tokens[:pos - 1]:
+        for i in range(0, len(token)):
+            (idx, line, col) = _ref_skip_space(instring, idx, line, col)
+            if token[i].isspace():
+                continue
+            col += 1
+            idx += 1
+        (idx, line, col) = _ref_skip_space(instring, idx, line, col)
+        (idx, line, col) = _ref_skip_comment(instring, idx, line, col)
+        (idx, line, col) = _ref_skip_space(instring, idx, line, col)
+    return (line, col + 1)
+
+
+
+def _check_tokens (infile):
+    with open (infile, "r") as f:
+        expected = _ref_tokenize(f.read())
+    parser = SMTParser()
+    parser.filename = infile
+    tokens = [t for (offset, t) in parser._SMTParser__tokenize()]
+    # Note: the original tokenizer pads '(' with spaces within string
+    #       literals and quoted symbols
+    tokens = [re.sub(r'(\((?!_\s)|\(_\s)', r' \1 ', t) \
+              if t[0] in (SMTParser.QUOTE, SMTParser.PIPE) else t
+              for t in tokens]
+    return tokens == expected
+
+
+
+def _check_errors (infile, nmutations = 10):
+    # parse errors in inputs truncated at or extended by a ')' at several
+    # positions are reported at the same position as before
+    global g_tmpmutfile
+    with open (infile, "r") as f:
+        instring = f.read()
+    for i in range(1, nmutations + 1):
+        cut = len(instring) * i // (nmutations + 1)
+        for mutated in (instring[:cut],
+                        instring[:cut] + SMTParser.RPAR + instring[cut:]):
+            with open (g_tmpmutfile, "w") as f:
+                f.write(mutated)
+            try:
+                DDSMTParser().parse(g_tmpmutfile)
+                continue
+            except DDSMTParseException as e:
+                pos = _ref_pos(mutated, _ref_tokenize(mutated), e.parser.pos)
+                if (e.line, e.col) != pos:
+                    return False
+    return True
+
+
+
+def _check_shared (infile, smtformula):
+    # a formula parsed with shared function applications (a DAG) dumps and
+    # prints the same as the formula parsed without sharing
+    _activate (smtformula)
+    expected = (smtformula.dumps(), [str(c) for c in smtformula.scopes.cmds])
+    shared = DDSMTParser(True).parse(infile)
+    _activate (shared)
+    res = (shared.dumps(), [str(c) for c in shared.scopes.cmds]) == expected
+    _activate (smtformula)
+    return res
+
+
+
+def _check_parse_cache (smtformula):
+    # a formula saved to and loaded from the parse cache dumps the same as
+    # the freshly parsed formula
+    _activate (smtformula)
+    expected = smtformula.dumps()
+    buf = io.BytesIO()
+    smtformula.save(buf)
+    buf.seek(0)
+    loaded = SMTFormula.load(buf)
+    _activate (loaded)
+    res = loaded.dumps() == expected
+    _activate (smtformula)
+    return res
+
+
+
+def _check_rollback (smtformula):
+    # substitute terms (creating substitution chains) and commands, check
+    # that cached dumps match uncached dumps, and that rolling back all
+    # substitutions restores the original dump
+    _activate (smtformula)
+    substlist = smtformula.substs
+    expected = smtformula.dumps()
+    terms = {}
+    for cls in SMTTermIndex.CLASSES:
+        terms.update((t.id, t) for t in smtformula.terms_index.get_terms(cls))
+    terms = [terms[nid] for nid in sorted(terms)]
+    cmds = []
+    to_visit = [smtformula.scopes]
+    while to_visit:
+        cur = to_visit.pop()
+        cmds.extend(cur.cmds)
+        to_visit.extend(cur.scopes)
+    checkpoint = substlist.checkpoint()
+    for i in range(len(terms)):
+        t = terms[i]
+        if t.is_subst() or not t.sort:
+            continue
+        children = [c.get_subst() for c in t.children \
+                    if isinstance(c, SMTNode)]
+        children = [c for c in children if c and c.sort is t.sort]
+        if i % 2 and children:
+            t.subst(children[0])
+        elif i % 3 == 0:
+            t.subst(smtformula.add_fresh_declfunCmdNode(t.sort))
+        if i % 7 == 0 or i == len(terms) - 1:
+            [t.get_subst() for t in terms]  # path compression
+            cached = smtformula.dumps()
+            dump_cache = smtformula.dump_cache
+            smtformula.dump_cache = {}
+            uncached = smtformula.dumps()
+            smtformula.dump_cache = dump_cache
+            if cached != uncached:
+                substlist.rollback(checkpoint)
+                return False
+    for cmd in cmds[1::2]:
+        if cmd.is_assert() and not cmd.is_subst():
+            cmd.subst(None)
+    smtformula.dumps()
+    substlist.rollback(checkpoint)
+    return smtformula.dumps() == expected
+
+
+
 def _runtest (infile):
-    global g_tmpfile
+    global g_tmpfile, nbugs
     assert (g_tmpfile)
     parser = DDSMTParser()
     smtformula = parser.parse(infile)
@@ -137,6 +354,18 @@ def _runtest (infile):
         nbugs += 1
         _log (1, "bug: " + bugfile)
 
+    for (name, check) in (
+            ("shared terms", lambda: _check_shared(infile, smtformula)),
+            ("parse cache", lambda: _check_parse_cache(smtformula)),
+            ("rollback", lambda: _check_rollback(smtformula)),
+            ("tokens", lambda: _check_tokens(infile)),
+            ("error positions", lambda: _check_errors(infile))):
+        if not check():
+            nbugs += 1
+            _log (0, "bug: {}: {}".format(name, infile))
+        else:
+            _log (1, "{}: done".format(name))
+
 
 
 
@@ -191,7 +420,7 @@ if __name__ == "__main__":
 
             _log (0, "{} bugs found".format(nbugs)) 
             _cleanup()
-            sys.exit(0)
+            sys.exit(1 if nbugs else 0)
     except (DDSMTParseException, DDSMTParserTestException) as e:
         _cleanup()
         sys.exit(str(e))
@@ -0,0 +1,144 @@
+#! /usr/bin/env python3
+#
+# ddSMT: a delta debugger for SMT benchmarks in SMT-Lib v2 format.
+# Copyright (C) 2013-2018, Aina Niemetz.
+#
+# This file is part of ddSMT.
+#
+# ddSMT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ddSMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ddSMT.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# Micro-benchmark for the tokenizer (SMTParser.__tokenize): a generated
+# formula with comments, string literals, quoted symbols and indexed
+# identifiers is tokenized with the single-pass tokenizer (SMTParser.TOKENS)
+# and with the sequence of re.subs over the whole input as used before.
+# Both have to produce the same token stream.
+
+import os
+import re
+import sys
+import time
+
+from argparse import ArgumentParser
+sys.path.insert(1, os.path.join(sys.path[0], '../../'))
+from parser.smtparser import SMTParser
+
+
+g_tmpfile = "/tmp/tmp-lexbench-" + str(os.getpid()) + ".smt2"
+
+
+def _generate (filename, nvars, nasserts):
+    with open(filename, 'w') as outfile:
+        outfile.write("(set-info :source |\n  generated; by lexbench\n|)\n")
+        outfile.write("(set-logic QF_BV)\n")
+        for i in range(nvars):
+            outfile.write("(declare-fun |x {}| () (_ BitVec 32))\n".format(i))
+        for i in range(nasserts):
+            outfile.write("; assert {}\n".format(i))
+            outfile.write(
+                "(assert (! (= (bvadd |x {}| ((_ extract 31 0) |x {}|)) " \
+                "(bvxor |x {}| #x0000002a)) :named a{}))\n".format(
+                    i % nvars, (i + 1) % nvars, (i + 2) % nvars, i))
+        outfile.write("(set-info :status \"unknown; generated\")\n")
+        outfile.write("(check-sat)\n(exit)\n")
+
+
+def _tokenize_resub (filename):
+    with open (filename, 'r') as infile:
+        tokens = []
+        instring = re.sub(
+                r'set-info :source\s*\|.*?\|',
+                lambda x: re.sub(
+                    SMTParser.COMMENT, SMTParser.PLACEHOLDER, x.group(0)),
+                infile.read(),
+                flags=re.DOTALL)
+        instring = re.sub (
+                r'".*?"',
+                lambda x: re.sub(
+                    SMTParser.COMMENT, SMTParser.PLACEHOLDER, x.group(0)),
+                instring,
+                flags=re.DOTALL)
+        instring = re.sub(r';[^\n]*\n', ' ' , instring)
+        instring = re.sub(r'(\((?!_\s)|\(_\s)', r' \1 ', instring)
+        instring = re.sub(r'@::@', ';', instring)
+
+        pidx = instring.find(SMTParser.PIPE)
+        qidx = instring.find(SMTParser.QUOTE)
+        c = SMTParser.PIPE if qidx == -1 or (pidx >= 0 and pidx < qidx) \
+                           else SMTParser.QUOTE
+        instring = instring.partition(c)
+        while instring[0]:
+            tokens.extend(
+                    re.sub(r'(?<!\\)\)', ' ) ', instring[0]).split())
+            part = instring[2].partition(c)
+            if c == SMTParser.PIPE:
+                tokens.append("{}{}{}".format(
+                    instring[1], part[0], part[1]))
+            else:
+                strings = []
+                strings.append(part[0])
+                while part[0] and part[0][-1] == '\\':
+                    part = part[2].partition(c)
+                    strings.append(part[0])
+                tokens.append("\"{}\"".format(
+                    "\"".join([s for s in strings])))
+            pidx = part[2].find(SMTParser.PIPE)
+            qidx = part[2].find(SMTParser.QUOTE)
+            c = SMTParser.PIPE if qidx == -1 or (pidx >= 0 and pidx < qidx)\
+                               else SMTParser.QUOTE
+            instring = part[2].partition(c)
+        tokens.extend(re.sub(r'(?<!\\)\)', ' ) ', instring[2]).split())
+        # the re.sub based tokenizer always yields an empty last token
+        return [t for t in tokens if t]
+
+
+def _tokenize (filename):
+    parser = SMTParser()
+    parser.filename = filename
+    return [t for (offset, t) in parser._SMTParser__tokenize()]
+
+
+def _bench (nasserts, nruns, tokenize):
+    _generate (g_tmpfile, 100, nasserts)
+    start = time.time()
+    for i in range(nruns):
+        tokens = tokenize(g_tmpfile)
+    runtime = time.time() - start
+    return (tokens, os.path.getsize(g_tmpfile), runtime)
+
+
+if __name__ == "__main__":
+    try:
+        aparser = ArgumentParser ()
+        aparser.add_argument ("-a", dest="nasserts", type=int, default=5000,
+                              help="number of asserts (default: 5000)")
+        aparser.add_argument ("-n", dest="nruns", type=int, default=5,
+                              help="number of times the input is tokenized "\
+                                   "(default: 5)")
+        args = aparser.parse_args()
+        res = []
+        for (name, tokenize) in (("re.sub passes:", _tokenize_resub),
+                                 ("single pass:", _tokenize)):
+            (tokens, size, runtime) = _bench (args.nasserts, args.nruns,
+                                              tokenize)
+            res.append(tokens)
+            print ("[lexbench] {:<16} {} tokens, {:.1f} MiB, {} runs: " \
+                   "{:.3f} seconds ({:.1f} MiB/s)".format(
+                       name, len(tokens), size / 1048576, args.nruns,
+                       runtime, size * args.nruns / 1048576 / runtime))
+        assert (res[0] == res[1])
+    finally:
+        if os.path.exists(g_tmpfile):
+            os.remove(g_tmpfile)
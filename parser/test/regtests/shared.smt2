@@ -0,0 +1,12 @@
+(set-logic AUFBV)
+(declare-fun a () (Array (_ BitVec 4) (_ BitVec 4)))
+(declare-fun x () (_ BitVec 4))
+(declare-fun y () (_ BitVec 4))
+(declare-fun f ((_ BitVec 4)) (_ BitVec 4))
+(assert (= (bvadd (f x) (f x)) (bvmul (bvadd (f x) (f x)) (f x))))
+(assert (= (select a (bvnot y)) (select a (bvnot y))))
+(assert (let ((z (bvnot y)) (w (bvnot y))) (let ((v (bvnot y))) (= (bvand z w) (bvand z w) (bvnot y)))))
+(assert (and (forall ((u (_ BitVec 4))) (= (f u) (bvnot y))) (forall ((u (_ BitVec 4))) (= (f u) (bvnot y)))))
+(assert (= (bvnot y) (bvnot y)))
+(check-sat)
+(exit)
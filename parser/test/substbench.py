@@ -0,0 +1,114 @@
+#! /usr/bin/env python3
+#
+# ddSMT: a delta debugger for SMT benchmarks in SMT-Lib v2 format.
+# Copyright (C) 2013-2018, Aina Niemetz.
+#
+# This file is part of ddSMT.
+#
+# ddSMT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ddSMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ddSMT.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Micro-benchmark for the resolution of substitution chains
+# (SMTSubstList.get_subst): every term of a generated formula is substituted
+# with a fresh variable, which is then substituted again (and again), as
+# happens over many rounds of term substitution. Resolving all terms is
+# timed with path compression (SMTSubstList.get_subst) and without (plain
+# chain walk as used before).
+
+import os
+import sys
+import time
+
+from argparse import ArgumentParser
+sys.path.insert(1, os.path.join(sys.path[0], '../../'))
+from parser.ddsmtparser import DDSMTParser
+
+
+g_tmpfile = "/tmp/tmp-substbench-" + str(os.getpid()) + ".smt2"
+
+
+def _generate (filename, nvars, nasserts):
+    with open(filename, 'w') as outfile:
+        outfile.write("(set-logic QF_BV)\n")
+        for i in range(nvars):
+            outfile.write("(declare-fun x{} () (_ BitVec 32))\n".format(i))
+        for i in range(nasserts):
+            outfile.write(
+                "(assert (= (bvadd x{} (bvmul x{} x{})) (bvxor x{} x{})))\n"\
+                        .format(*[(i + k) % nvars for k in range(5)]))
+        outfile.write("(check-sat)\n(exit)\n")
+
+
+def _resolve_chain (substlist, node):
+    while node and node.id in substlist.substs:
+        node = substlist.substs[node.id]
+    return node
+
+
+def _terms (smtformula):
+    terms = {}
+    for cmd in smtformula.scopes.cmds:
+        if cmd.is_assert():
+            to_visit = [cmd.children[0]]
+            while to_visit:
+                cur = to_visit.pop()
+                terms[cur.id] = cur
+                to_visit.extend(cur.children)
+    return list(terms.values())
+
+
+def _bench (nvars, nasserts, depth, nwalks, compress):
+    _generate (g_tmpfile, nvars, nasserts)
+    smtformula = DDSMTParser().parse(g_tmpfile)
+    substlist = smtformula.substs
+    terms = _terms (smtformula)
+    # build substitution chains of given depth
+    targets = terms
+    for i in range(depth):
+        fresh = [smtformula.add_fresh_declfunCmdNode(t.sort) for t in targets]
+        for t, f in zip(targets, fresh):
+            t.subst(f)
+        targets = fresh
+    resolve = substlist.get_subst if compress \
+            else lambda n: _resolve_chain(substlist, n)
+    start = time.time()
+    for i in range(nwalks):
+        res = [resolve(t) for t in terms]
+    runtime = time.time() - start
+    assert (all(r is f for r, f in zip(res, targets)))
+    return (len(terms), runtime)
+
+
+if __name__ == "__main__":
+    try:
+        aparser = ArgumentParser ()
+        aparser.add_argument ("-a", dest="nasserts", type=int, default=2000,
+                              help="number of asserts (default: 2000)")
+        aparser.add_argument ("-d", dest="depth", type=int, default=50,
+                              help="depth of substitution chains "\
+                                   "(default: 50)")
+        aparser.add_argument ("-n", dest="nwalks", type=int, default=20,
+                              help="number of times all terms are resolved "\
+                                   "(default: 20)")
+        args = aparser.parse_args()
+        for compress in (False, True):
+            (nterms, runtime) = _bench (100, args.nasserts, args.depth,
+                                        args.nwalks, compress)
+            print ("[substbench] {:<20} {} terms, chain depth {}, " \
+                   "{} walks: {:.3f} seconds".format(
+                       "path compression:" if compress else "chain walk:",
+                       nterms, args.depth, args.nwalks, runtime))
+    finally:
+        if os.path.exists(g_tmpfile):
+            os.remove(g_tmpfile)
@@ -0,0 +1,476 @@
+#! /usr/bin/env python3
+#
+# ddSMT: a delta debugger for SMT benchmarks in SMT-Lib v2 format.
+# Copyright (C) 2013-2018, Aina Niemetz.
+#
+# This file is part of ddSMT.
+#
+# ddSMT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ddSMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ddSMT.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Behaviour tests of ddsmt.py: reduce regression inputs with a fake solver
+# (see solver.py) and check the outputs.
+
+import json
+import os
+import re
+import shutil
+import signal
+import sys
+import time
+
+from argparse import ArgumentParser
+from subprocess import Popen, PIPE, DEVNULL, TimeoutExpired
+
+
+g_args = None
+g_rootdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+g_ddsmt = os.path.join(g_rootdir, "ddsmt.py")
+g_ddsmtbatch = os.path.join(g_rootdir, "ddsmtbatch.py")
+g_solver = os.path.join(g_rootdir, "test", "solver.py")
+g_regtests = os.path.join(g_rootdir, "parser", "test", "regtests")
+g_tmpdir = "/tmp/tmp-ddsmttest-" + str(os.getpid())
+g_checks = []
+
+
+class DDSMTTestException (Exception):
+
+    def __init__ (self, msg):
+        self.msg = msg
+
+    def __str__ (self):
+        return "[ddsmttest] Error: {}".format(self.msg)
+
+
+
+def _cleanup ():
+    global g_tmpdir
+    if os.path.exists(g_tmpdir):
+        shutil.rmtree(g_tmpdir)
+
+
+
+def _log (verbosity, msg = ""):
+    global g_args
+    if g_args.verbosity >= verbosity:
+        sys.stdout.write("[ddsmttest] {}\n".format(msg))
+
+
+
+def _tmp (name):
+    return os.path.join(g_tmpdir, name)
+
+
+
+def _ddsmt (options, infile, outfile, solver = ()):
+    # run ddsmt.py on given input with the fake solver, return its exit code
+    # and log
+    cmd = [sys.executable, g_ddsmt] + options + [infile, outfile, g_solver] \
+            + list(solver)
+    _log (2, " ".join(cmd))
+    proc = Popen (cmd, stdout=PIPE, stderr=PIPE)
+    out, err = proc.communicate()
+    _log (3, out.decode() + err.decode())
+    return (proc.returncode, out.decode() + err.decode())
+
+
+
+def _reduce (options, infile, solver = ()):
+    # reduce given input, return the output if it still triggers the bug
+    # (and None otherwise)
+    outfile = _tmp("out.smt2")
+    if os.path.exists(outfile):
+        os.remove(outfile)
+    (returncode, log) = _ddsmt (options, infile, outfile, solver)
+    if returncode != 0 or not os.path.exists(outfile):
+        _log (1, "ddsmt.py failed: {}".format(log.strip()))
+        return None
+    proc = Popen ([g_solver] + list(solver) + [outfile],
+                  stdout=PIPE, stderr=PIPE)
+    proc.communicate()
+    if proc.returncode != 1:
+        _log (1, "output does not trigger the bug")
+        return None
+    with open(outfile) as f:
+        return f.read()
+
+
+
+def _processes (pattern):
+    # pids of the processes with given pattern in their command line
+    res = []
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open("/proc/{}/cmdline".format(pid), "rb") as f:
+                if pattern.encode() in f.read():
+                    res.append(int(pid))
+        except IOError:
+            continue
+    return res
+
+
+
+def _check (fun):
+    g_checks.append(fun)
+    return fun
+
+
+
+@_check
+def parallel ():
+    # tests run concurrently slow each other down, which must not turn
+    # into timeouts: the output is the same for any number of jobs
+    infile = os.path.join(g_regtests, "shared.smt2")
+    outputs = [_reduce (options + ["-t", "0.3"], infile, ["--cpu", "0.1"])
+               for options in ([], ["-j", "4"], ["--speculate"])]
+    return outputs[0] != None and outputs.count(outputs[0]) == len(outputs)
+
+
+
+@_check
+def cache ():
+    # a second run with the same disk cache runs no tests and produces the
+    # same output
+    infile = os.path.join(g_regtests, "shared.smt2")
+    outputs, ntests = [], []
+    for i in range(2):
+        (returncode, log) = _ddsmt (["-v", "--cache", _tmp("cache")],
+                                    infile, _tmp("out.smt2"))
+        if returncode != 0:
+            return False
+        ntests.append(int(re.search(r"tests  total: (\d+)", log).group(1)))
+        with open(_tmp("out.smt2")) as f:
+            outputs.append(f.read())
+    return ntests[0] > 0 and ntests[1] == 0 and outputs[0] == outputs[1]
+
+
+@_check
+def session ():
+    # candidates tested in a session (or, after the session was disabled
+    # since it hangs, in fresh processes) give the same output as without
+    # session, sessions are ignored without search pattern
+    infile = os.path.join(g_regtests, "shared.smt2")
+    expected = _reduce (["-o", "error: bug"], infile)
+    for (options, msg) in (
+            (["--session", "push", "--session-args=--interactive"],
+             "session tests: "),
+            (["--session", "reset", "--session-args=--interactive"],
+             "session tests: "),
+            (["--session", "push", "--session-args=--interactive --hang 99"],
+             "session disabled"),
+            (["-o", "", "--session", "push", "--session-args=--interactive"],
+             "session mode disabled")):
+        (returncode, log) = _ddsmt (["-vv", "-o", "error: bug"] + options,
+                                    infile, _tmp("out.smt2"))
+        if returncode != 0 or msg not in log:
+            _log (1, "'{}' missing in log".format(msg))
+            return False
+        with open(_tmp("out.smt2")) as f:
+            if "" not in options and f.read() != expected:
+                return False
+    return expected != None
+
+
+
+@_check
+def parse_cache ():
+    # corrupt cache files are ignored, the cache directory is private
+    infile = os.path.join(g_regtests, "shared.smt2")
+    cachedir = _tmp("parse-cache")
+    expected = _reduce (["-v", "--parse-cache", cachedir], infile)
+    if expected == None or os.stat(cachedir).st_mode & 0o777 != 0o700:
+        return False
+    (cachefile,) = os.listdir(cachedir)
+    with open(os.path.join(cachedir, cachefile), "rb") as f:
+        data = f.read()
+    for corrupt in (data[:len(data) // 2], b"garbage", b""):
+        with open(os.path.join(cachedir, cachefile), "wb") as f:
+            f.write(corrupt)
+        (returncode, log) = _ddsmt (["-v", "--parse-cache", cachedir],
+                                    infile, _tmp("out.smt2"))
+        if returncode != 0 or "unable to load" not in log:
+            return False
+        with open(_tmp("out.smt2")) as f:
+            if f.read() != expected:
+                return False
+    os.chmod(cachedir, 0o777)
+    (returncode, log) = _ddsmt (["--parse-cache", cachedir], infile,
+                                _tmp("out.smt2"))
+    return returncode != 0 and "writable by others" in log
+
+
+@_check
+def fresh ():
+    # fresh variables are named independently of the candidates tested
+    # before (and rolled back): the output is the same for any number of
+    # jobs
+    infile = os.path.join(g_regtests, "shared.smt2")
+    outputs = [_reduce (options, infile, ["--bug", "bvmul", "--exclude",
+                                          "(_ bv"])
+               for options in ([], ["-j", "4"], ["--speculate"])]
+    return outputs[0] != None and "_substvar_" in outputs[0] \
+            and outputs.count(outputs[0]) == len(outputs)
+
+
+
+@_check
+def hdd ():
+    # substituting terms level by level reduces as far as the default
+    # (breadth-first) order, the output is the same for any number of jobs
+    for (name, bug) in (("adder.smt2", "bvadd,concat"),
+                        ("ultimate-sc2011rules-qf-abv-ex.smt2", "bvslt")):
+        infile = os.path.join(g_regtests, name)
+        expected = _reduce (["-t", "5"], infile, ["--bug", bug])
+        outputs = [_reduce (["-t", "5", "--hdd"] + options, infile,
+                            ["--bug", bug])
+                   for options in ([], ["-j", "2"])]
+        if outputs[0] == None or outputs[0] != outputs[1] \
+           or expected == None or len(outputs[0]) > len(expected):
+            return False
+    return True
+
+
+@_check
+def ddmin ():
+    # complement testing reduces as far as the default strategy, the output
+    # is the same for any number of jobs
+    for (name, bug) in (("shared.smt2", "bvmul,bvnot"),
+                        ("sc2011rules-qf-abv-ex.smt2", "store,forall")):
+        infile = os.path.join(g_regtests, name)
+        expected = _reduce (["-t", "5"], infile, ["--bug", bug])
+        outputs = [_reduce (["-t", "5", "--ddmin"] + options, infile,
+                            ["--bug", bug])
+                   for options in ([], ["-j", "2"])]
+        if outputs[0] == None or outputs[0] != outputs[1] \
+           or expected == None or len(outputs[0]) > len(expected):
+            return False
+    return True
+
+
+@_check
+def scheduler ():
+    # passes are ordered by yield, which does not depend on timing: the
+    # output is the same for any number of jobs and reduces as far as with
+    # passes in fixed order, also without skipping passes
+    infile = os.path.join(g_regtests, "adder.smt2")
+    solver = ["--bug", "bvadd,concat"]
+    expected = _reduce (["-t", "5", "--fixed-order"], infile, solver)
+    outputs = [_reduce (["-t", "5"] + options, infile, solver)
+               for options in ([], ["-j", "2"], ["--max-skip", "0"])]
+    return expected != None and outputs[0] != None \
+            and outputs.count(outputs[0]) == len(outputs) \
+            and len(outputs[0]) <= len(expected)
+
+
+@_check
+def resume ():
+    # a reduction interrupted after a checkpoint and resumed from it gives
+    # the same output as an uninterrupted reduction
+    infile = os.path.join(g_regtests, "adder.smt2")
+    solver = ["--bug", "bvadd,concat", "--cpu", "0.05"]
+    options = ["-t", "5", "--checkpoint-interval", "0"]
+    expected = _reduce (options, infile, solver)
+    checkpoint = _tmp("checkpoint.json")
+    cmd = [sys.executable, g_ddsmt, "--checkpoint", checkpoint] + options \
+            + [infile, _tmp("out.smt2"), g_solver] + solver
+    _log (2, " ".join(cmd))
+    proc = Popen (cmd, stdout=DEVNULL, stderr=DEVNULL)
+    time.sleep(2)
+    for i in range(100):
+        if os.path.exists(checkpoint):
+            break
+        time.sleep(0.1)
+    proc.send_signal(signal.SIGINT)
+    proc.wait()
+    if proc.returncode == 0:
+        _log (1, "reduction done before it was interrupted")
+        return False
+    output = _reduce (options + ["--resume", checkpoint], infile, solver)
+    return expected != None and output == expected
+
+
+@_check
+def batch ():
+    # ddsmtbatch.py reduces each input as ddsmt.py does and reports
+    # duplicate inputs in the manifest
+    indir, outdir = _tmp("in"), _tmp("out")
+    os.makedirs(indir)
+    for (name, regtest) in (("a.smt2", "shared.smt2"),
+                            ("b.smt2", "shared.smt2"),
+                            ("c.smt2", "adder.smt2")):
+        shutil.copy(os.path.join(g_regtests, regtest),
+                    os.path.join(indir, name))
+    solver = ["--bug", "bvadd"]
+    cmd = [sys.executable, g_ddsmtbatch, "-j", "2", "-t", "5", indir,
+           outdir, g_solver] + solver
+    _log (2, " ".join(cmd))
+    proc = Popen (cmd, stdout=PIPE, stderr=PIPE)
+    proc.communicate()
+    if proc.returncode != 0:
+        return False
+    with open(os.path.join(outdir, "manifest.json")) as f:
+        manifest = dict((os.path.basename(i["input"]), i)
+                        for i in json.load(f)["inputs"])
+    if manifest["b.smt2"]["status"] != "duplicate" \
+       or manifest["b.smt2"]["duplicate_of"] != manifest["a.smt2"]["input"]:
+        return False
+    for name in ("a.smt2", "c.smt2"):
+        if manifest[name]["status"] != "reduced":
+            return False
+        with open(manifest[name]["output"]) as f:
+            output = f.read()
+        if output != _reduce (["-t", "5"], os.path.join(indir, name),
+                              solver):
+            return False
+    return True
+
+
+@_check
+def api ():
+    # reduce() gives the same output as ddsmt.py (with an oracle that
+    # decides as the fake solver) and refuses nested calls
+    sys.path.insert(0, g_rootdir)
+    import ddsmt
+    infile = os.path.join(g_regtests, "shared.smt2")
+    expected = _reduce ([], infile)
+    errors = []
+    def oracle (formula):
+        if not errors:
+            try:
+                ddsmt.reduce (infile, oracle)
+            except ddsmt.DDSMTException as e:
+                errors.append(e)
+        return "bvmul" in formula and "bvnot" in formula
+    outputs = [ddsmt.reduce (infile, oracle, jobs = jobs) for jobs in (1, 2)]
+    return expected != None and len(errors) == 1 \
+            and outputs.count(expected) == len(outputs)
+
+
+@_check
+def timeouts ():
+    # the adaptive timeout does not time out tests that vary in runtime
+    # (less than the slack), even if estimated from a single initial run
+    infile = os.path.join(g_regtests, "shared.smt2")
+    (returncode, log) = _ddsmt (["-vv"], infile, _tmp("out.smt2"),
+                                ["--jitter", "0.3"])
+    return returncode == 0 and "[!!] timeout" not in log
+
+
+
+@_check
+def golden ():
+    # initial runs only have to agree in exit code and search pattern
+    infile = os.path.join(g_regtests, "shared.smt2")
+    return _reduce (["--golden-runs", "3", "-o", "error: bug"], infile,
+                    ["--noise"]) != None
+
+
+@_check
+def limits ():
+    # tests that exceed the cpu limit are handled as timeouts, with limits
+    # set before the solver is executed (in the child or by a shell wrapper
+    # with -j)
+    infile = _tmp("in.smt2")
+    with open(infile, "w") as f:
+        f.write("(declare-fun x () (_ BitVec 4))\n"
+                "(assert (= x (bvmul x x)))\n"
+                "(assert (= x (bvnot x)))\n")
+    for options in ([], ["-j", "2"]):
+        output = _reduce (["-t", "100", "--cpulimit", "0.5"] + options,
+                          infile, ["--hang", "2", "--spin"])
+        if output == None or output.count("(assert") != 2:
+            return False
+    return True
+
+
+
+@_check
+def interrupt ():
+    # on Ctrl-C (SIGINT to the process group of ddsmt.py) and SIGTERM,
+    # running tests are killed, although they run in their own session
+    infile = os.path.join(g_regtests, "shared.smt2")
+    res = True
+    for (options, sig) in (([], signal.SIGINT), (["-j", "2"], signal.SIGINT),
+                           ([], signal.SIGTERM)):
+        cmd = [sys.executable, g_ddsmt, "-t", "100"] + options \
+                + [infile, _tmp("out.smt2"), g_solver, "--hang", "5"]
+        _log (2, " ".join(cmd))
+        proc = Popen (cmd, stdout=DEVNULL, stderr=DEVNULL,
+                      start_new_session=True)
+        pattern = "ddsmt-bin-{}".format(proc.pid)
+        for i in range(100):
+            if _processes (pattern):
+                break
+            time.sleep(0.1)
+        if sig == signal.SIGINT:
+            os.killpg(proc.pid, sig)
+        else:
+            os.kill(proc.pid, sig)
+        try:
+            proc.wait(10)
+        except TimeoutExpired:
+            _log (1, "ddsmt.py still running after {}".format(sig.name))
+            proc.kill()
+            proc.wait()
+            res = False
+        time.sleep(0.5)
+        left = _processes (pattern)
+        if left:
+            _log (1, "tests left running after {}".format(sig.name))
+            for pid in left:
+                os.kill(pid, signal.SIGKILL)
+            res = False
+    return res
+
+
+
+if __name__ == "__main__":
+    try:
+        usage="ddsmttest.py [<options>] [<check> ...]"
+        aparser = ArgumentParser (usage=usage)
+        aparser.add_argument ("-v", action="count", default=0,
+                              dest="verbosity", help="increase verbosity")
+        aparser.add_argument ("checks", nargs="*", default=None,
+                              help="the checks to run (default: all), one "\
+                                   "of: {}".format(", ".join(
+                                       [c.__name__ for c in g_checks])))
+        g_args = aparser.parse_args()
+        checks = dict((c.__name__, c) for c in g_checks)
+        for name in g_args.checks:
+            if name not in checks:
+                raise DDSMTTestException ("unknown check '{}'".format(name))
+        nbugs = 0
+
+        for fun in g_checks:
+            if g_args.checks and fun.__name__ not in g_args.checks:
+                continue
+            _cleanup ()
+            os.makedirs(g_tmpdir)
+            if not fun():
+                nbugs += 1
+                _log (0, "bug: {}".format(fun.__name__))
+            else:
+                _log (1, "{}: done".format(fun.__name__))
+
+        _log (0, "{} bugs found".format(nbugs))
+        _cleanup ()
+        sys.exit(1 if nbugs else 0)
+    except DDSMTTestException as e:
+        _cleanup()
+        sys.exit(str(e))
+    except KeyboardInterrupt as e:
+        _cleanup()
+        sys.exit("[ddsmttest] interrupted")
@@ -0,0 +1,111 @@
+#! /usr/bin/env python3
+#
+# ddSMT: a delta debugger for SMT benchmarks in SMT-Lib v2 format.
+# Copyright (C) 2013-2018, Aina Niemetz.
+#
+# This file is part of ddSMT.
+#
+# ddSMT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ddSMT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ddSMT.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Fake solver for ddsmttest.py: fails (error output and exit code 1) on
+# inputs that contain all given patterns (and none of the excluded ones),
+# prints 'sat' otherwise.
+
+import random
+import sys
+import time
+import zlib
+
+from argparse import ArgumentParser
+
+
+def _bug (data):
+    return all(p in data for p in g_args.bug.split(",")) \
+            and not any(p in data for p in g_args.exclude.split(",") if p)
+
+
+def _check (data):
+    start = time.process_time()
+    while time.process_time() - start < g_args.cpu:
+        pass
+    time.sleep(g_args.jitter * (zlib.crc32(data.encode()) % 1000) / 1000)
+    if g_args.hang and data.count("(assert") < g_args.hang:
+        if g_args.spin:
+            while True:
+                pass
+        time.sleep(3600)
+
+
+def _interactive ():
+    # session mode: check each candidate, i.e., the commands up to (pop 1)
+    # or (reset), and answer (echo) commands
+    data = ""
+    for line in sys.stdin:
+        if line.startswith("(push"):
+            data = ""
+        elif line.startswith(("(pop", "(reset")):
+            _check (data)
+            if _bug(data):
+                sys.stderr.write("error: bug\n")
+                sys.stderr.flush()
+            else:
+                print("sat", flush=True)
+            data = ""
+        elif line.startswith("(echo"):
+            print(line.split('"')[1], flush=True)
+        else:
+            data += line
+
+
+
+if __name__ == "__main__":
+    aparser = ArgumentParser ()
+    aparser.add_argument ("infile", nargs="?", default=None,
+                          help="the input file (default: stdin)")
+    aparser.add_argument ("--bug", default="bvmul,bvnot",
+                          help="patterns that trigger the bug")
+    aparser.add_argument ("--exclude", default="",
+                          help="patterns that prevent the bug")
+    aparser.add_argument ("--cpu", type=float, default=0,
+                          help="cpu time to burn per check in seconds")
+    aparser.add_argument ("--jitter", type=float, default=0,
+                          help="sleep up to given seconds per check, "\
+                               "depending on the input")
+    aparser.add_argument ("--noise", action="store_true", default=False,
+                          help="print random error output")
+    aparser.add_argument ("--hang", type=int, default=0,
+                          help="hang on inputs with less asserts")
+    aparser.add_argument ("--spin", action="store_true", default=False,
+                          help="hang by burning cpu time")
+    aparser.add_argument ("--interactive", action="store_true",
+                          default=False,
+                          help="read commands from stdin (session mode)")
+    g_args = aparser.parse_args()
+
+    if g_args.interactive:
+        _interactive ()
+        sys.exit(0)
+    if g_args.infile:
+        with open(g_args.infile) as infile:
+            data = infile.read()
+    else:
+        data = sys.stdin.read()
+    _check (data)
+    if g_args.noise:
+        sys.stderr.write("noise: {}\n".format(random.random()))
+    if _bug(data):
+        sys.stderr.write("error: bug\n")
+        sys.exit(1)
+    print("sat")